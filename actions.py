@@ -2,8 +2,6 @@ from __future__ import annotations
 
 
 from typing import TYPE_CHECKING, Tuple, Optional
-import random
-
 import color
 import exceptions
 
@@ -48,19 +46,18 @@ class PickupAction(Action):
 		actor_location_y = self.entity.y
 		inventory = self.entity.inventory
 
-		for item in self.engine.game_map.items:
-			if actor_location_x == item.x and actor_location_y == item.y:
-				if len(inventory.items) >= inventory.capacity:
-					raise exceptions.Impossible("Your inventory is full.")
+		for item in self.engine.game_map.get_items_at_location(actor_location_x, actor_location_y):
+			if len(inventory.items) >= inventory.capacity:
+				raise exceptions.Impossible("Your inventory is full.")
 
-				self.engine.game_map.entities.remove(item)
-				item.parent = self.entity.inventory
-				inventory.items.append(item)
+			self.engine.game_map.remove_entity(item)
+			item.parent = self.entity.inventory
+			inventory.items.append(item)
 
-				self.engine.message_log.add_message(f"You picked up the {item.name}!",makePing=False)
-				self.engine.sound_engine.emitSound(sound_engine.item_pickup)
-				self.entity.ailments.ailmentTick()
-				return
+			self.engine.message_log.add_message(f"You picked up the {item.name}!",makePing=False)
+			self.engine.sound_engine.emitSound(sound_engine.item_pickup)
+			self.entity.ailments.ailmentTick()
+			return
 
 		raise exceptions.Impossible("There is nothing here to pick up.")
 
@@ -124,6 +121,19 @@ class QuickAccess():
 		else: raise exceptions.Impossible("You have no item bound to the F key.")
 
 
+class TakeStairsAction(Action):
+	def perform(self) -> None:
+		#go up or down, whichever stairs are under the actor
+		if self.entity.xy == self.engine.game_map.downstairs_location:
+			self.engine.descend()
+			direction = "descend"
+		elif self.entity.xy == self.engine.game_map.upstairs_location:
+			self.engine.ascend()
+			direction = "ascend"
+		else:
+			raise exceptions.Impossible("There are no stairs here.")
+		self.engine.message_log.add_message(f"You {direction} to level {self.engine.depth}.", color.descend, makePing=False)
+
 class WaitAction(Action):
 	def perform(self) -> None:
 		self.entity.ailments.ailmentTick()
@@ -211,7 +221,7 @@ class MovementAction(ActionWithDirection):
 
 
 		#if if health is low, check if bleed - lower health is higher odds
-		if random.randint(self.entity.fighter.hp, self.entity.fighter.max_hp) < self.entity.fighter.max_hp/3:
+		if self.engine.rng.randint(self.entity.fighter.hp, self.entity.fighter.max_hp) < self.entity.fighter.max_hp/3:
 			self.entity.bleed(1)
 
 		self.entity.move(self.dx, self.dy)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+import tcod.path
+
+if TYPE_CHECKING:
+	from engine import Engine
+	from entity import Actor
+
+#activity tiers, from full simulation down to none at all
+ACTIVE = "active"
+COARSE = "coarse"
+DORMANT = "dormant"
+
+
+class ActivityConfig:
+	"""
+	How far from the player each tier reaches, in steps along the path to them.
+	Actors in active_range (or in fov, or woken by a noise) get a full turn,
+	those out to coarse_range do a cheap patrol step every coarse_interval turns,
+	anything further away sleeps.
+	"""
+	def __init__(
+		self,
+		enabled: bool = True,
+		active_range: int = 20,
+		coarse_range: int = 40,
+		coarse_interval: int = 4,
+		wake_turns: int = 10,
+		):
+		self.enabled = enabled
+		self.active_range = active_range
+		self.coarse_range = coarse_range
+		self.coarse_interval = max(1, coarse_interval)
+		self.wake_turns = wake_turns
+
+
+class ActivityScheduler:
+	def __init__(self, engine: Engine, config: ActivityConfig = None, fov_radius: int = 17):
+		self.engine = engine
+		self.config = config if config is not None else ActivityConfig()
+		self.fov_radius = fov_radius
+		#actor -> the last turn it stays awake for, set by noises
+		self.awake_until: Dict[Actor, int] = {}
+		#actor -> which turn of the coarse interval it updates on
+		self.phase: Dict[Actor, int] = {}
+		#how many actors ran in each tier last turn, and over the whole session
+		self.stats = {ACTIVE: 0, COARSE: 0, DORMANT: 0}
+		self.totals = {ACTIVE: 0, COARSE: 0, DORMANT: 0}
+
+	def reset(self) -> None:
+		#forgets every actor, for when the player leaves the level they are on
+		self.awake_until.clear()
+		self.phase.clear()
+
+	def wake(self, actor: Actor) -> None:
+		self.awake_until[actor] = self.engine.turn + self.config.wake_turns
+
+	def make_noise(self, x: int, y: int, radius: int) -> None:
+		#everything that can hear it comes back to full fidelity for a while
+		for actor in self.engine.game_map.get_actors_in_radius(x, y, radius):
+			if actor is not self.engine.player:
+				self.wake(actor)
+
+	def schedule(self) -> Dict[str, List[Actor]]:
+		"""
+		Sorts the actors that should do something this turn into tiers.
+		Only actors near the player or recently woken are looked at, so the cost
+		follows how many are nearby rather than how many are on the map.
+		"""
+		engine = self.engine
+		game_map = engine.game_map
+		player = engine.player
+		config = self.config
+		tiers: Dict[str, List[Actor]] = {ACTIVE: [], COARSE: []}
+
+		if not config.enabled:
+			tiers[ACTIVE] = [actor for actor in game_map.actors if actor is not player]
+			self._count(tiers, len(tiers[ACTIVE]))
+			return tiers
+
+		#drop noises that have worn off, or whose actor has since died
+		for actor, until in list(self.awake_until.items()):
+			if until < engine.turn or not actor.is_alive or actor.parent is not game_map:
+				del self.awake_until[actor]
+
+		search_radius = max(config.active_range, config.coarse_range, self.fov_radius)
+		walk_field, x0, y0 = self._walk_field(search_radius)
+		width, height = walk_field.shape
+
+		candidates = dict.fromkeys(game_map.get_actors_in_radius(player.x, player.y, search_radius))
+		candidates.update(dict.fromkeys(self.awake_until))
+		candidates.pop(player, None)
+
+		for actor in candidates:
+			#outside the window is further than any range, the field counts 2 per cardinal and 3 per diagonal
+			x, y = actor.x - x0, actor.y - y0
+			steps = walk_field[x, y] // 2 if 0 <= x < width and 0 <= y < height else search_radius + 1
+			if (steps <= config.active_range
+			or game_map.visible[actor.x, actor.y]
+			or actor in self.awake_until):
+				tiers[ACTIVE].append(actor)
+			elif steps <= config.coarse_range:
+				#staggered so the coarse actors dont all move on the same turn
+				phase = self.phase.setdefault(actor, len(self.phase) % config.coarse_interval)
+				if (engine.turn + phase) % config.coarse_interval == 0:
+					tiers[COARSE].append(actor)
+
+		living = game_map.living_actor_count
+		if len(self.phase) > 2 * living + 64:
+			self.phase = {actor: phase for actor, phase in self.phase.items() if actor.is_alive}
+
+		self._count(tiers, living - 1)
+		return tiers
+
+	def _walk_field(self, radius: int) -> Tuple[np.ndarray, int, int]:
+		"""
+		Path distance from the player over the square window 'radius' around them, with the windows corner.
+		No path of up to 'radius' steps leaves the window, so those distances are the same as over the
+		whole map, and the search costs the same however big the map is.
+		"""
+		game_map = self.engine.game_map
+		player = self.engine.player
+		x0, y0 = max(0, player.x - radius), max(0, player.y - radius)
+		x1, y1 = min(game_map.width, player.x + radius + 1), min(game_map.height, player.y + radius + 1)
+		cost = np.asfortranarray(game_map.get_path_cost(0, 0)[x0:x1, y0:y1])
+		field = tcod.path.maxarray(cost.shape, order="F")
+		field[player.x - x0, player.y - y0] = 0
+		tcod.path.dijkstra2d(field, cost, 2, 3, out=field)
+		return field, x0, y0
+
+	def _count(self, tiers: Dict[str, List[Actor]], total: int) -> None:
+		self.stats[ACTIVE] = len(tiers[ACTIVE])
+		self.stats[COARSE] = len(tiers[COARSE])
+		self.stats[DORMANT] = max(0, total - self.stats[ACTIVE] - self.stats[COARSE])
+		for tier, count in self.stats.items():
+			self.totals[tier] += count
@@ -1,109 +1,296 @@
-from typing import Optional, Tuple, Type, List, Dict, TypeVar, TYPE_CHECKING, Union
+from typing import Callable, Optional, Tuple, Type, List, Dict, TypeVar, TYPE_CHECKING, Union, Sequence
+from collections import OrderedDict
 import math
+import time
 import numpy
 from tcod import los
 
+#playback modes, headless runs skip or fast forward animations since nobody is watching
+PLAY = "play"
+SKIP = "skip" #animations are dropped as soon as they are emitted
+FAST_FORWARD = "fast_forward" #animations jump to their last frame on the next animateFrame
+
+#one animated cell, 'mask' has a bit set for each of bg, fg and ch that it paints
+cell_dt = numpy.dtype(
+	[
+		("x", numpy.int32),
+		("y", numpy.int32),
+		("mask", numpy.uint8),
+		("ch", numpy.int32),
+		("fg", "3B"),
+		("bg", "3B"),
+	]
+)
+PAINT_BG = 1
+PAINT_FG = 2
+PAINT_CH = 4
+
+#a frame that paints nothing
+EMPTY_FRAME = numpy.zeros(0, dtype=cell_dt)
+
+#frames per second an animation plays at unless it says otherwise
+FRAME_RATE = 60
+
+#how many distinct animation templates are kept around
+TEMPLATE_CACHE_SIZE = 128
+
+
+def make_frame(
+	cords: Sequence[Tuple[int, int]],
+	bg: Optional[Tuple[int, int, int]] = None,
+	fg: Optional[Tuple[int, int, int]] = None,
+	ch: Optional[str] = None,
+	) -> numpy.ndarray:
+	#a frame painting the same bg/fg/ch on every cord, None leaves that channel alone
+	frame = numpy.zeros(len(cords), dtype=cell_dt)
+	if len(cords) == 0:
+		return frame
+	cords = numpy.asarray(cords)
+	frame["x"], frame["y"] = cords[:, 0], cords[:, 1]
+	mask = 0
+	if bg is not None:
+		frame["bg"] = bg
+		mask |= PAINT_BG
+	if fg is not None:
+		frame["fg"] = fg
+		mask |= PAINT_FG
+	if ch is not None:
+		frame["ch"] = ord(ch)
+		mask |= PAINT_CH
+	frame["mask"] = mask
+	return frame
+
+
+class TemplateCache:
+	"""
+	Frame lists of animations keyed by kind and parameters, built once relative to the origin.
+	Least recently used templates are dropped past 'capacity'.
+	"""
+	def __init__(self, capacity: int = TEMPLATE_CACHE_SIZE) -> None:
+		self.capacity = capacity
+		self.templates: OrderedDict = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key: tuple, build: Callable[[], List[numpy.ndarray]]) -> Tuple[numpy.ndarray, ...]:
+		template = self.templates.get(key)
+		if template is not None:
+			self.hits += 1
+			self.templates.move_to_end(key)
+			return template
+
+		self.misses += 1
+		frames = build()
+		for frame in frames:
+			frame.flags.writeable = False #shared between every animation using the template
+		template = tuple(frames)
+		self.templates[key] = template
+		if len(self.templates) > self.capacity:
+			self.templates.popitem(last=False)
+		return template
+
+	def clear(self) -> None:
+		self.templates.clear()
+		self.hits = self.misses = 0
+
+templates = TemplateCache()
+
+
 class AnimationEngine:
-	def __init__(self, engine) -> None:
-		self.activeAnimations = []
+	def __init__(self, engine, mode: str = PLAY, clock: Callable[[], float] = time.perf_counter) -> None:
+		#a dict used as an ordered set, iterated in emit order and finished animations removed in O(1)
+		self.activeAnimations: Dict[AnimationObject, None] = {}
 		self.engine = engine
 		self.didFrame = True
+		self.mode = mode
+		self.clock = clock #animations advance by this clock, not by how often they get drawn
 
 	@property
 	def hasActive(self):
 		if len(self.activeAnimations) > 0:
-			self.didFrame = True 
+			self.didFrame = True
 			return True
 		if self.didFrame:
 			self.didFrame = False
 			return True
 		return False
 
+	@property
+	def frameRate(self) -> int:
+		#the fastest animation on screen sets the pace, FRAME_RATE for the frame that clears the last one
+		if not self.activeAnimations:
+			return FRAME_RATE
+		return max(AnimationObject.frameRate for AnimationObject in self.activeAnimations)
+
 	def emitAnimation(self, AnimationObject):
-		self.activeAnimations.append(AnimationObject)
+		if self.mode == SKIP: return
+		self.activeAnimations[AnimationObject] = None
 
 
 	def animateFrame(self, console):
+		"""
+		Paints the frame every active animation is on by now, frames are skipped if drawing falls behind.
+		The current frames are merged into one batch in emit order, clipped to the visible map
+		and written with one masked assignment per channel, so later animations still paint over earlier ones.
+		"""
+		if not self.activeAnimations:
+			return
+
+		now = self.clock()
 		for AnimationObject in self.activeAnimations:
-			if AnimationObject.stepFrame(console, self.engine) == "done":
-				self.activeAnimations.remove(AnimationObject)
+			if self.mode == FAST_FORWARD:
+				AnimationObject.frame = max(AnimationObject.frame, AnimationObject.totalFrames - 1)
+			AnimationObject.advance(now)
+
+		frames = [AnimationObject.currentFrame() for AnimationObject in self.activeAnimations]
+		self.paint(console, self.engine.game_map, numpy.concatenate(frames))
+
+		#animations that showed their last frame are dropped after the loop, never mid iteration
+		finished = [
+			AnimationObject for AnimationObject in self.activeAnimations
+			if AnimationObject.frame >= AnimationObject.totalFrames - 1
+			]
+		for AnimationObject in finished:
+			del self.activeAnimations[AnimationObject]
+
+	@staticmethod
+	def paint(console, game_map, cells: numpy.ndarray) -> None:
+		if len(cells) == 0:
+			return
+		x, y = cells["x"], cells["y"]
+		inside = (0 <= x) & (x < game_map.width) & (0 <= y) & (y < game_map.height)
+		cells = cells[inside]
+		cells = cells[game_map.visible[cells["x"], cells["y"]]]
+		if len(cells) == 0:
+			return
+
+		tiles = console.tiles_rgb
+		for bit, channel in ((PAINT_BG, "bg"), (PAINT_FG, "fg"), (PAINT_CH, "ch")):
+			painted = cells[(cells["mask"] & bit) != 0]
+			if len(painted):
+				tiles[channel][painted["x"], painted["y"]] = painted[channel]
+
 
-	
 
 class AnimationObject():
-	def __init__():
-		self.animationList = []
+	frameRate = FRAME_RATE
+	started: Optional[float] = None #clock time of frame 0, set when first drawn
+
+	def __init__(self):
+		#one cell_dt array per frame, relative to 'origin'
+		self.animationList: Sequence[numpy.ndarray] = ()
+		self.origin = (0, 0)
 		self.frame = 0
 		self.totalFrames = 0
 
-	def stepFrame(self, console, engine):
-		for dict in self.animationList[self.frame]:
-			#console.tiles_rgb["bg"][x, y] = color.white
-			try:
-				if engine.game_map.visible[dict["cord"][0]][dict["cord"][1]]:
-					if dict["bg"] != None: console.tiles_rgb["bg"][dict["cord"]] = dict["bg"]
-					if dict["fg"] != None: console.tiles_rgb["fg"][dict["cord"]] = dict["fg"]
-					if dict["ch"] != None: console.tiles_rgb["ch"][dict["cord"]] = ord(dict["ch"])
-			except IndexError: pass
-		self.frame += 1
-		if self.frame == self.totalFrames:
-			return "done"
+	def useTemplate(self, key: tuple, origin: Tuple[int, int], build: Callable[[], List[numpy.ndarray]]) -> None:
+		self.animationList = templates.get((type(self).__name__,) + key, build)
+		self.origin = origin
+		self.frame = 0
+		self.totalFrames = len(self.animationList)
+
+	def advance(self, now: float) -> None:
+		#moves to the frame due at 'now', never past the last so it is always shown
+		if self.started is None:
+			self.started = now - self.frame / self.frameRate
+		due = int((now - self.started) * self.frameRate)
+		self.frame = max(self.frame, min(due, self.totalFrames - 1))
+
+	def currentFrame(self) -> numpy.ndarray:
+		if self.frame >= self.totalFrames:
+			return EMPTY_FRAME
+		frame = self.animationList[self.frame]
+		if self.origin == (0, 0) or len(frame) == 0:
+			return frame
+		frame = frame.copy()
+		frame["x"] += self.origin[0]
+		frame["y"] += self.origin[1]
+		return frame
+
+
+def pulse_frames(activeFrame: numpy.ndarray, duration: int, pulseLength: int) -> List[numpy.ndarray]:
+	#activeFrame for pulseLength+1 frames, then nothing for pulseLength frames, repeated for duration frames
+	animationList = []
+	i, ii, iii = 0, 1, 0
+	while i in range(duration):
+		if ii <= pulseLength:
+			animationList.append(activeFrame)
+			ii += 1
+		else:
+			animationList.append(EMPTY_FRAME)
+			iii += 1
+			if iii == pulseLength:
+				ii, iii = 1, 0
+
+		i += 1
+	return animationList
+
+
+def line_cords(dx: int, dy: int) -> List[Tuple[int, int]]:
+	#the bresenham line from the origin to dx, dy without its last cell
+	lineBres = los.bresenham((0, 0), (dx, dy))
+	lineBresList = []
+	for i in range(len(lineBres)-1):
+		lineBresList.append((lineBres[i][0],lineBres[i][1]))
+	return lineBresList
 
 
 class MuzzleFlash(AnimationObject):
 	def __init__(self, cordStart: Tuple[int, int], cordEnd: Tuple[int, int]):
 		self.cordStart = cordStart
 		self.cordEnd = cordEnd
-		self.frame = 0
+		dx, dy = cordEnd[0] - cordStart[0], cordEnd[1] - cordStart[1]
+		self.useTemplate((dx, dy), cordStart, lambda: self.build(dx, dy))
+
+	@staticmethod
+	def build(dx: int, dy: int) -> List[numpy.ndarray]:
 		animationList = []
-		lineBres = los.bresenham(cordStart, cordEnd)
-		lineBresList = []
-		for i in range(len(lineBres)-1):
-			lineBresList.append((lineBres[i][0],lineBres[i][1]))
+		lineBresList = line_cords(dx, dy)
 		lineBresList.pop(0)
 		while len(lineBresList) < 3:
-			lineBresList.append(cordEnd)
+			lineBresList.append((dx, dy))
 
-		animationList.append([{"cord":lineBresList[0],"bg":(255,255,255),"fg":None,"ch":" "}])
-		animationList.append([{"cord":lineBresList[0],"bg":(255,255,255),"fg":None,"ch":" "},
-			{"cord":lineBresList[1],"bg":(255,255,255),"fg":None,"ch":None}])
-		animationList.append([{"cord":lineBresList[1],"bg":(255,255,255),"fg":None,"ch":" "}])
-		self.animationList = animationList
-		self.totalFrames = len(animationList)
+		animationList.append(make_frame([lineBresList[0]], bg=(255,255,255), ch=" "))
+		animationList.append(numpy.concatenate((
+			make_frame([lineBresList[0]], bg=(255,255,255), ch=" "),
+			make_frame([lineBresList[1]], bg=(255,255,255)))))
+		animationList.append(make_frame([lineBresList[1]], bg=(255,255,255), ch=" "))
+		return animationList
 
 
 class Explosion(AnimationObject):
 	def __init__(self, cord: Tuple[int, int], radius: int, color: int, speedMod: int = 1):
 		self.cord = cord
 		self.radius = radius
-		self.frame = 0
-		animationList = []
-		x, y = cord
-
-		frame = []
-		#calculates the squares to be animated on.
+		color = tuple(color)
+		self.useTemplate((radius, color, speedMod), cord, lambda: self.build(radius, color, speedMod))
 
+	@staticmethod
+	def build(radius: int, color: Tuple[int, int, int], speedMod: int) -> List[numpy.ndarray]:
+		animationList = []
 
+		#calculates the squares to be animated on, a ring per step out from the center
 		for i in range(radius+1):
 			iMin = max(1,i)
-			frame = []
-			#calculates the squares to be animated on.
-			targetx, targety = x - i, y - i
-			for targetx in range(x - i, x + i + 1):
-				for targety in range(y - i, y + i + 1):
-					if i-2 < math.sqrt((targetx - x) ** 2 + (targety - y) ** 2) <= i:
-						frame.append({"cord":(targetx, targety),"bg":(color[0]/iMin,color[1]/iMin,color[2]/iMin),"fg":None,"ch":" "})
+			offsets = numpy.arange(-i, i + 1)
+			offsetX, offsetY = numpy.meshgrid(offsets, offsets, indexing="ij")
+			distance = numpy.sqrt(offsetX ** 2 + offsetY ** 2)
+			ring = (i-2 < distance) & (distance <= i)
+
+			frame = numpy.zeros(int(ring.sum()), dtype=cell_dt)
+			frame["x"] = offsetX[ring]
+			frame["y"] = offsetY[ring]
+			frame["bg"] = (color[0]/iMin, color[1]/iMin, color[2]/iMin)
+			frame["ch"] = ord(" ")
+			frame["mask"] = PAINT_BG | PAINT_CH
 			for ii in range(speedMod):
 				animationList.append(frame)
 
 		animationListReversed = animationList.copy()
 		animationListReversed.reverse()
-		animationList = animationListReversed + animationList
+		return animationListReversed + animationList
 
-		self.animationList = animationList
-		self.totalFrames = len(animationList)
 
-		
 
 class Highlight(AnimationObject):
 	def __init__(self,cord: Tuple[int, int], color: Tuple[int, int, int] = (255,255,255), duration: int = 9, pulseLength: int = 3):
@@ -111,23 +298,9 @@ class Highlight(AnimationObject):
 		self.color = color
 		self.duration = duration
 		self.pulseLength = pulseLength
-		self.frame = 0
-		animationList = []
-		i, ii, iii = 0, 1, 0
-		while i in range(duration):
-			if ii <= pulseLength:
-				animationList.append([{"cord":cord,"bg":color,"fg":None,"ch":None}])
-				ii += 1
-			else:
-				animationList.append([{"cord":cord,"bg":None,"fg":None,"ch":None}])
-				iii += 1
-				if iii == pulseLength:
-					ii, iii = 1, 0
-
-			i += 1
-
-		self.animationList = animationList
-		self.totalFrames = len(animationList)
+		color = tuple(color)
+		self.useTemplate((color, duration, pulseLength), cord,
+			lambda: pulse_frames(make_frame([(0, 0)], bg=color), duration, pulseLength))
 
 
 class Projectile(AnimationObject):
@@ -136,18 +309,19 @@ class Projectile(AnimationObject):
 		self.cordEnd = cordEnd
 		self.char = char
 		self.color = color
-		self.frame = 0
+		dx, dy = cordEnd[0] - cordStart[0], cordEnd[1] - cordStart[1]
+		color = tuple(color)
+		self.useTemplate((dx, dy, char, color, speedMod), cordStart, lambda: self.build(dx, dy, char, color, speedMod))
+
+	@staticmethod
+	def build(dx: int, dy: int, char: str, color: Tuple[int, int, int], speedMod: int) -> List[numpy.ndarray]:
 		animationList = []
-		lineBres = los.bresenham(cordStart, cordEnd)
-		lineBresList = []
-		for i in range(len(lineBres)-1):
-			lineBresList.append((lineBres[i][0],lineBres[i][1]))
-		lineBresList[-1:1]
+		lineBresList = line_cords(dx, dy)
 		for i in range(len(lineBresList)-1):
+			frame = make_frame([lineBresList[i]], fg=color, ch=char)
 			for ii in range(speedMod):
-				animationList.append([{"cord":lineBresList[i],"bg":None,"fg":color,"ch":char}])
-		self.animationList = animationList
-		self.totalFrames = len(animationList)
+				animationList.append(frame)
+		return animationList
 
 
 class FrameLight(AnimationObject):
@@ -158,31 +332,18 @@ class FrameLight(AnimationObject):
 		self.duration = duration
 		self.pulseLength = pulseLength
 		self.mapSizeTuple = mapSizeTuple
-		self.frame = 0
-		animationList = []
-		i, ii, iii = 0, 1, 0
-
-		activeFrame = []
-		inactiveFrame = [{"cord":(0,0),"bg":None,"fg":None,"ch":None}]
+		mapSizeTuple, color = tuple(mapSizeTuple), tuple(color)
+		self.useTemplate((mapSizeTuple, color, duration, pulseLength, tuple(sorted(sides.items()))), (0, 0),
+			lambda: pulse_frames(self.build(mapSizeTuple, color, sides), duration, pulseLength))
+
+	@staticmethod
+	def build(mapSizeTuple: Tuple[int, int], color: Tuple[int, int, int], sides: Dict[str, bool]) -> numpy.ndarray:
+		blanked = []
+		tinted = []
 		for x in range(mapSizeTuple[0]):
-			if sides["t"]: activeFrame.append({"cord":(x,0),"bg":color,"fg":None,"ch":" "})
-			if sides["b"]: activeFrame.append({"cord":(x,mapSizeTuple[1]-1),"bg":color,"fg":None,"ch":" "})
+			if sides["t"]: blanked.append((x,0))
+			if sides["b"]: blanked.append((x,mapSizeTuple[1]-1))
 		for y in range(mapSizeTuple[1]):
-			if sides["l"]: activeFrame.append({"cord":(0,y),"bg":color,"fg":None,"ch":None})
-			if sides["r"]: activeFrame.append({"cord":(mapSizeTuple[0]-1,y),"bg":color,"fg":None,"ch":" "})
-
-
-		while i in range(duration):
-			if ii <= pulseLength:
-				animationList.append(activeFrame)
-				ii += 1
-			else:
-				animationList.append(inactiveFrame)
-				iii += 1
-				if iii == pulseLength:
-					ii, iii = 1, 0
-
-			i += 1
-
-		self.animationList = animationList
-		self.totalFrames = len(animationList)
\ No newline at end of file
+			if sides["l"]: tinted.append((0,y))
+			if sides["r"]: blanked.append((mapSizeTuple[0]-1,y))
+		return numpy.concatenate((make_frame(blanked, bg=color, ch=" "), make_frame(tinted, bg=color)))
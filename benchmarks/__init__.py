@@ -0,0 +1,6 @@
+"""
+Seeded benchmarks for dungeon generation, enemy turns and rendering.
+
+Run them with `python -m benchmarks`, everything runs headless so no display
+or audio device is needed. See `python -m benchmarks --help` for options.
+"""
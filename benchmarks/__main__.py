@@ -0,0 +1,54 @@
+"""
+python -m benchmarks [--filter TEXT] [--scale N] [--json PATH] [--compare PATH]
+
+Runs the seeded benchmark scenarios headless and prints throughput and latency
+percentiles for each. --json writes the results to a file that later runs can
+--compare against.
+"""
+import argparse
+import json
+import os
+import sys
+
+#the game loads its tilesheet and sounds by relative path
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.getcwd())
+
+import headless
+headless.enable()
+
+from benchmarks import harness, scenarios
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+		formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--filter", default="", help="only run scenarios whose name contains this")
+	parser.add_argument("--scale", type=float, default=1.0, help="multiplies every scenarios turn/frame count")
+	parser.add_argument("--json", help="write the results to this file")
+	parser.add_argument("--compare", help="results file from an earlier run to compare against")
+	parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+	args = parser.parse_args()
+
+	names = [name for name in scenarios.SCENARIOS if args.filter in name]
+	if args.list:
+		print("\n".join(names))
+		return
+
+	results = {}
+	for name in names:
+		print(f"running {name}...", file=sys.stderr)
+		results[name] = scenarios.SCENARIOS[name](args.scale)
+
+	baseline = None
+	if args.compare:
+		with open(args.compare) as file:
+			baseline = json.load(file)["scenarios"]
+
+	harness.print_table(results, baseline)
+	if args.json:
+		harness.write_results(args.json, results)
+
+
+if __name__ == "__main__":
+	main()
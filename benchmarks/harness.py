@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+import math
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class Timer:
+	"""Collects one latency sample per timed operation."""
+	def __init__(self) -> None:
+		self.samples: List[float] = []
+
+	def time(self, operation: Callable[[], object]) -> None:
+		start = time.perf_counter()
+		operation()
+		self.samples.append(time.perf_counter() - start)
+
+	def __enter__(self) -> Timer:
+		self._start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.samples.append(time.perf_counter() - self._start)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+	#nearest rank percentile, samples dont need to be sorted
+	if not samples:
+		return 0.0
+	ordered = sorted(samples)
+	index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+	return ordered[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+	total = sum(samples)
+	return {
+		"ops": len(samples),
+		"total_s": total,
+		"ops_per_s": len(samples) / total if total else 0.0,
+		"mean_ms": total / len(samples) * 1000 if samples else 0.0,
+		"p50_ms": percentile(samples, 0.50) * 1000,
+		"p90_ms": percentile(samples, 0.90) * 1000,
+		"p99_ms": percentile(samples, 0.99) * 1000,
+		"max_ms": max(samples) * 1000 if samples else 0.0,
+	}
+
+
+def git_revision() -> Optional[str]:
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"],
+			capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def write_results(path: str, results: Dict[str, dict]) -> None:
+	document = {
+		"revision": git_revision(),
+		"python": platform.python_version(),
+		"machine": platform.machine(),
+		"scenarios": results,
+	}
+	with open(path, "w") as file:
+		json.dump(document, file, indent=1, sort_keys=True)
+
+
+def print_table(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None) -> None:
+	header = f"{'scenario':<34}{'ops':>7}{'ops/s':>11}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+	if baseline is not None: header += f"{'vs base':>10}"
+	print(header)
+	print("-" * len(header))
+	for name, result in results.items():
+		line = (f"{name:<34}{result['ops']:>7}{result['ops_per_s']:>11.1f}"
+			f"{result['p50_ms']:>10.3f}{result['p90_ms']:>10.3f}{result['p99_ms']:>10.3f}")
+		if baseline is not None:
+			old = baseline.get(name)
+			if old and old["p50_ms"]:
+				#above 1 means slower than the baseline
+				line += f"{result['p50_ms'] / old['p50_ms']:>9.2f}x"
+			else:
+				line += f"{'-':>10}"
+		print(line)
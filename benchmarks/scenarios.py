@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, List
+
+import animation_engine
+import entity_factories
+from actions import WaitAction
+from engine import Engine
+from main import MAP_SETTINGS, new_game
+from procgen import generate_dungeon
+
+from benchmarks.harness import Timer, summarize
+
+
+#every scenario takes a scale factor (1 is the default size) and returns its summary
+SCENARIOS: Dict[str, Callable[[float], dict]] = {}
+
+def scenario(name: str):
+	def register(function):
+		SCENARIOS[name] = function
+		return function
+	return register
+
+
+def immortal(engine: Engine) -> None:
+	#keeps long runs going, a dead player stops the enemies from doing anything
+	engine.player.fighter.max_hp = 10 ** 9
+	engine.player.fighter.hp = 10 ** 9
+
+
+def seeded_game(seed: int, **settings) -> Engine:
+	engine = new_game(headless_mode=True, seed=seed, **settings)
+	immortal(engine)
+	return engine
+
+
+def surround_player(engine: Engine, count: int, radius: int = 12) -> None:
+	#packs infected onto the free floor closest to the player
+	game_map = engine.game_map
+	player = engine.player
+	cells = [
+		(x, y)
+		for x in range(max(0, player.x - radius), min(game_map.width, player.x + radius + 1))
+		for y in range(max(0, player.y - radius), min(game_map.height, player.y + radius + 1))
+		if game_map.tiles["walkable"][x, y] and not game_map.get_blocking_entity_at_location(x, y)
+		]
+	cells.sort(key=lambda cell: (player.distance(*cell), cell))
+	for x, y in cells[:count]:
+		entity_factories.infected.spawn(game_map, x, y)
+
+
+def run_turns(engine: Engine, turns: int) -> dict:
+	timer = Timer()
+	for _ in range(turns):
+		with timer:
+			engine.handle_enemy_turns()
+			engine.update_fov()
+	return summarize(timer.samples)
+
+
+def run_frames(engine: Engine, frames: int, before_frame: Callable[[int], None] = None) -> dict:
+	#animations run on a simulated clock at FRAME_RATE, so they last as many frames as they would on screen
+	frame = 0
+	engine.animation_engine.clock = lambda: frame / animation_engine.FRAME_RATE
+	timer = Timer()
+	for frame in range(frames):
+		if before_frame is not None:
+			before_frame(frame)
+		timer.time(engine.render_offscreen)
+	return summarize(timer.samples)
+
+
+#dungeon generation#############################################
+GENERATION_SIZES = {"small": (80, 45, 15, 12), "medium": (160, 90, 50, 40), "large": (240, 135, 110, 90)}
+GENERATION_DENSITIES = {"sparse": (2, 4), "dense": (8, 10)}
+
+def generation_scenario(size: str, density: str) -> Callable[[float], dict]:
+	width, height, max_rooms, min_rooms = GENERATION_SIZES[size]
+	min_monsters, max_monsters = GENERATION_DENSITIES[density]
+
+	def run(scale: float) -> dict:
+		engine = new_game(headless_mode=True, seed=1)
+		timer = Timer()
+		for repeat in range(max(1, int(10 * scale))):
+			engine.rng.seed(100 + repeat)
+			timer.time(lambda: generate_dungeon(
+				max_rooms=max_rooms,
+				min_rooms=min_rooms,
+				room_min_size=MAP_SETTINGS["room_min_size"],
+				room_max_size=MAP_SETTINGS["room_max_size"],
+				map_width=width,
+				map_height=height,
+				max_monsters_per_room=max_monsters,
+				min_monsters_per_room=min_monsters,
+				max_items_per_room=MAP_SETTINGS["max_items_per_room"],
+				min_items_per_room=MAP_SETTINGS["min_items_per_room"],
+				engine=engine))
+		return summarize(timer.samples)
+	return run
+
+for _size in GENERATION_SIZES:
+	for _density in GENERATION_DENSITIES:
+		scenario(f"generate/{_size}/{_density}")(generation_scenario(_size, _density))
+
+
+#enemy turns####################################################
+@scenario("turns/default_map")
+def turns_default_map(scale: float) -> dict:
+	engine = seeded_game(2)
+	return run_turns(engine, int(200 * scale))
+
+@scenario("turns/large_map_dense")
+def turns_large_map_dense(scale: float) -> dict:
+	engine = seeded_game(3, map_width=200, map_height=120, max_rooms=60, min_rooms=50,
+		max_monsters_per_room=10, min_monsters_per_room=8)
+	return run_turns(engine, int(100 * scale))
+
+@scenario("turns/horde_chase")
+def turns_horde_chase(scale: float) -> dict:
+	#the worst case, lots of infected in view all chasing the player at once
+	engine = seeded_game(4)
+	surround_player(engine, 150)
+	engine.update_fov()
+	return run_turns(engine, int(100 * scale))
+
+
+#rendering######################################################
+@scenario("render/idle")
+def render_idle(scale: float) -> dict:
+	engine = seeded_game(5)
+	return run_frames(engine, int(500 * scale))
+
+@scenario("render/large_explosion")
+def render_large_explosion(scale: float) -> dict:
+	engine = new_game(headless_mode=True, seed=6, animation_mode=animation_engine.PLAY)
+	player = engine.player
+
+	def explode(frame: int) -> None:
+		#keeps a big blast going for the whole run
+		if not engine.animation_engine.activeAnimations:
+			engine.animation_engine.emitAnimation(animation_engine.Explosion(
+				cord=player.xy, radius=12, color=(255, 0, 100), speedMod=4))
+	return run_frames(engine, int(500 * scale), explode)
+
+@scenario("render/highlight_burst")
+def render_highlight_burst(scale: float) -> dict:
+	#click to move and grenade hits emit lots of small highlights at once
+	engine = new_game(headless_mode=True, seed=7, animation_mode=animation_engine.PLAY)
+	player = engine.player
+
+	def burst(frame: int) -> None:
+		if frame % 9 == 0:
+			for dx in range(-10, 11):
+				engine.animation_engine.emitAnimation(animation_engine.Highlight(
+					cord=(player.x + dx, player.y), color=(255, 200, 200)))
+	return run_frames(engine, int(500 * scale), burst)
+
+@scenario("render/long_message_history")
+def render_long_message_history(scale: float) -> dict:
+	engine = seeded_game(8)
+	text = "The Infected attacks Player for 3 damage. " * 3
+	for index in range(int(20000 * scale)):
+		engine.message_log.add_message(f"{index}: {text}", makePing=False)
+	return run_frames(engine, int(300 * scale))
+
+@scenario("render/corpse_pileup")
+def render_corpse_pileup(scale: float) -> dict:
+	#long games leave corpses and dropped items everywhere
+	engine = seeded_game(9)
+	surround_player(engine, 300, radius=16)
+	for actor in list(engine.game_map.actors):
+		if actor is not engine.player:
+			actor.fighter.die()
+	engine.update_fov()
+	return run_frames(engine, int(300 * scale))
+
+@scenario("render/corpse_field")
+def render_corpse_field(scale: float) -> dict:
+	#thousands of corpses and dropped items stacked around the player, frame cost should not grow with them
+	engine = seeded_game(10)
+	game_map = engine.game_map
+	player = engine.player
+	cells = [
+		(x, y)
+		for x in range(max(0, player.x - 16), min(game_map.width, player.x + 17))
+		for y in range(max(0, player.y - 16), min(game_map.height, player.y + 17))
+		if game_map.tiles["walkable"][x, y]
+		]
+	for index in range(int(5000 * scale)):
+		x, y = cells[index % len(cells)]
+		if index % 2:
+			entity_factories.infected.spawn(game_map, x, y).fighter.die()
+		else:
+			entity_factories.small_magazine.spawn(game_map, x, y)
+	engine.update_fov()
+	return run_frames(engine, int(300 * scale))
+
+
+def run(names: List[str], scale: float) -> Dict[str, dict]:
+	return {name: SCENARIOS[name](scale) for name in names}
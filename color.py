@@ -16,6 +16,7 @@ impossible = (0x80, 0x80, 0x80)
 error = (0xFF, 0x40, 0x40)
 
 welcome_text = (0x20, 0xA0, 0xFF)
+descend = (0x9F, 0x3F, 0xFF)
 health_recovered = (0x0, 0xFF, 0x0)
 tolerance_increased = (0xAB, 0x00, 0x00)
 tolerance_reduced = (0x0, 0xAB, 0x0)
@@ -1,10 +1,9 @@
 from __future__ import annotations
 
-from typing import List, Tuple, TYPE_CHECKING
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np # type: ignore
 import tcod
-import random
 
 from actions import Action, MeleeAction, MovementAction, WaitAction
 import tile_types
@@ -14,6 +13,10 @@ import animation_engine
 if TYPE_CHECKING:
 	from entity import Actor
 
+#how many cells ahead a kept path is checked for blockers, and how far a repair may search
+PATH_LOOKAHEAD = 3
+PATH_REPAIR_SPAN = 4
+
 
 class BaseAI(Action):
 
@@ -23,43 +26,24 @@ class BaseAI(Action):
 	def shouldPing(self) -> None:
 		raise NotImplementedError()
 
-	def get_path_to(self, dest_x: int, dest_y: int, blockCost: int = 0, corpseCost: int = 0, cheat: bool = True) -> List[Tuple[int, int]]:
+	def coarse_perform(self, steps: int) -> None:
+		#cheap update for when the actor is far from the player, defaults to a full turn
+		self.perform()
+
+	def get_path_to(self, dest_x: int, dest_y: int, blockCost: int = 0, corpseCost: int = 0, cheat: bool = True,
+		start: Optional[Tuple[int, int]] = None) -> List[Tuple[int, int]]:
 		"""Compute and retrun a path to the target position.
+		'start' defaults to where the entity is standing.
 
 		if there is no valid path then retrun an empty list.
 		"""
-		#makes a copy of the array of walkable places, only uses visible if cheating is false
-		if cheat: cost = np.array(self.entity.gamemap.tiles["walkable"], dtype=np.int8)
-		else: cost = np.where(self.entity.gamemap.explored, self.entity.gamemap.tiles["walkable"], 1)
-
-
-			
-
-
-		for entity in self.entity.gamemap.entities:
-			#check that an entity blocks movement and the cost isnt zero(blocking)
-			if entity.blocks_movement and cost[entity.x, entity.y]:
-				""" Add to the cost of a blocked position.
-				Low number will mean they will croud together to take shortest route
-				High number will encorage longer paths to surround the player
-				"""
-				cost[entity.x, entity.y] += blockCost
-			try:
-				if entity.is_alive == False and cost[entity.x, entity.y] and entity.could_live:
-					"""Adds to cost of position with a corpse.
-					Low corpse cost will have ai walk over corspes.
-					High cost will have ai avoid corpses, maybe avoiding traps."""
-					cost[entity.x, entity.y] += corpseCost
-			#if entity doesnt have this method
-			except AttributeError:
-				print(entity.name+" lacks a method - no biggie (ai.py)")
-
-		#create a graph from the cost array and pass that graph to a new pathfinder
-		graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
+		#the cost grid and graph are cached on the map, only the pathfinder is per search
+		graph = self.entity.gamemap.get_path_graph(blockCost, corpseCost, cheat)
 		pathfinder = tcod.path.Pathfinder(graph)
 
 
-		pathfinder.add_root((self.entity.x, self.entity.y)) #start position
+		if start is None: start = self.entity.locTuple
+		pathfinder.add_root(start) #start position
 
 		#computes path to destination and removes the starting point
 		path: List[List[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
@@ -67,6 +51,17 @@ class BaseAI(Action):
 		#convirt from list in a list full of ints to list with tuples
 		return [(index[0], index[1]) for index in path]
 
+	def get_chase_path(self, blockCost: int = 0, corpseCost: int = 0) -> List[Tuple[int, int]]:
+		"""Path to the player, walked downhill on the engines shared chase field.
+
+		if the player cant be reached then retrun an empty list.
+		"""
+		field = self.engine.get_chase_field(blockCost, corpseCost)
+		path: List[List[int]] = tcod.path.hillclimb2d(
+			field, (self.entity.x, self.entity.y), True, True)[1:].tolist()
+
+		return [(index[0], index[1]) for index in path]
+
 
 
 class HostileEnemy(BaseAI):
@@ -77,6 +72,9 @@ class HostileEnemy(BaseAI):
 		self.seenPlayer = False
 		self.blockCost, self.corpseCost = blockCost, corpseCost
 		self.lastLocation = self.entity.locTuple
+		#where the player was and the tiles version when self.path was planned, None if it isnt a chase
+		self.pathTarget: Optional[Tuple[int, int]] = None
+		self.pathTilesVersion = -1
 
 
 	def perform(self) -> None:
@@ -94,9 +92,8 @@ class HostileEnemy(BaseAI):
 			if distance <= 1:
 				return MeleeAction(self.entity, dx, dy).perform()
 
-			#otherwise path to player
-			self.path = self.get_path_to(
-				target.x, target.y, blockCost=self.blockCost, corpseCost=self.corpseCost)
+			#otherwise path to player, keeping the last one if it still holds up
+			self.update_chase_path(target.locTuple)
 
 		#If i am at the last place I saw the player
 		if self.seenPlayer and not self.path:
@@ -117,6 +114,7 @@ class HostileEnemy(BaseAI):
 			searchY -= changeY
 
 			if (searchX, searchY) != self.entity.locTuple:
+				self.pathTarget = None
 				self.path = self.get_path_to(
 					searchX, searchY, blockCost=self.blockCost, corpseCost=self.corpseCost)
 				#print(f"resolved - {(searchX, searchY)}")
@@ -136,28 +134,122 @@ class HostileEnemy(BaseAI):
 
 		#patrolling could be toggled here
 		if True:
-			#random patrols, but no big distances - iterations prevents hang
-			iterations = 0
-			while not self.path:
-				roomTarget = self.engine.game_map.rooms[
-				random.randint(0,len(self.engine.game_map.rooms)-1)]
-				(roomTargetX, roomTargetY) = roomTarget.center
-				roomDX = roomTargetX - self.entity.x
-				roomDY = roomTargetY - self.entity.y
-				roomDistance = max(abs(roomDX), abs(roomDY))
-				#if target is not spawn room, and is within 10
-				if roomDistance < 10 and roomTarget != self.engine.game_map.rooms[0]:
-					self.path = self.get_path_to(
-						roomTargetX, roomTargetY, blockCost=self.blockCost, corpseCost=self.corpseCost)
-				else:
-					iterations += 1
-					if iterations > 100:
-						break
+			self.pick_patrol_route()
 
 		
 		#if there is noting better to do, wait
 		return WaitAction(self.entity).perform()
 
+	def update_chase_path(self, target_xy: Tuple[int, int]) -> None:
+		"""
+		Keeps self.path pointed at the player without replanning every turn.
+		The path is kept as is while the player stays put and the route is clear,
+		a blocked stretch or a moved player gets a short local search spliced in,
+		and only when that fails is the whole path replanned.
+		"""
+		stats = self.engine.path_stats
+		game_map = self.engine.game_map
+		path = self.path
+
+		if not path or self.pathTarget is None or max(
+			abs(path[0][0] - self.entity.x), abs(path[0][1] - self.entity.y)) != 1:
+			return self.replan_chase_path(target_xy)
+
+		#first cell of the remaining route that became a wall or is stood on
+		blocked = None
+		if self.pathTilesVersion != game_map.tiles_version:
+			walkable = game_map.tiles["walkable"]
+			for index, (x, y) in enumerate(path):
+				if not walkable[x, y]:
+					blocked = index
+					break
+			self.pathTilesVersion = game_map.tiles_version
+		for index, (x, y) in enumerate(path[:PATH_LOOKAHEAD]):
+			if blocked is not None and index >= blocked:
+				break
+			if (x, y) != target_xy and game_map.get_blocking_entity_at_location(x, y):
+				blocked = index
+				break
+
+		if blocked is None and self.pathTarget == target_xy:
+			stats["hits"] += 1
+			return
+
+		if blocked is not None:
+			#search around the blocked stretch and rejoin the route a few cells later
+			rejoin = min(blocked + PATH_REPAIR_SPAN, len(path) - 1)
+			start = path[blocked - 1] if blocked > 0 else self.entity.locTuple
+			detour = self.get_path_to(*path[rejoin], blockCost=self.blockCost, corpseCost=self.corpseCost, start=start)
+			if not detour:
+				return self.replan_chase_path(target_xy)
+			path = path[:blocked] + detour + path[rejoin + 1:]
+
+		if self.pathTarget != target_xy:
+			#player moved, reroute from the cell of the route closest to where they are now
+			old_x, old_y = self.pathTarget
+			if max(abs(target_xy[0] - old_x), abs(target_xy[1] - old_y)) > PATH_REPAIR_SPAN:
+				return self.replan_chase_path(target_xy)
+			splice = min(
+				range(len(path)),
+				key=lambda index: max(abs(path[index][0] - target_xy[0]), abs(path[index][1] - target_xy[1])))
+			tail = self.get_path_to(*target_xy, blockCost=self.blockCost, corpseCost=self.corpseCost, start=path[splice])
+			if not tail and path[splice] != target_xy:
+				return self.replan_chase_path(target_xy)
+			path = path[:splice + 1] + tail
+
+		self.path = path
+		self.pathTarget = target_xy
+		stats["repairs"] += 1
+
+	def replan_chase_path(self, target_xy: Tuple[int, int]) -> None:
+		self.path = self.get_chase_path(blockCost=self.blockCost, corpseCost=self.corpseCost)
+		self.pathTarget = target_xy if self.path else None
+		self.pathTilesVersion = self.engine.game_map.tiles_version
+		self.engine.path_stats["replans"] += 1
+
+	def pick_patrol_route(self) -> None:
+		#random patrols, but no big distances - iterations prevents hang
+		self.pathTarget = None
+		iterations = 0
+		while not self.path:
+			roomTarget = self.engine.game_map.rooms[
+			self.engine.rng.randint(0,len(self.engine.game_map.rooms)-1)]
+			(roomTargetX, roomTargetY) = roomTarget.center
+			roomDX = roomTargetX - self.entity.x
+			roomDY = roomTargetY - self.entity.y
+			roomDistance = max(abs(roomDX), abs(roomDY))
+			#if target is not spawn room, and is within 10
+			if roomDistance < 10 and roomTarget != self.engine.game_map.rooms[0]:
+				self.path = self.get_path_to(
+					roomTargetX, roomTargetY, blockCost=self.blockCost, corpseCost=self.corpseCost)
+			else:
+				iterations += 1
+				if iterations > 100:
+					break
+
+	def coarse_perform(self, steps: int) -> None:
+		"""
+		Stand in for perform while the player is far away.
+		Walks up to 'steps' cells of the patrol in one go, since it only runs every few turns,
+		and skips the attacking, chasing and ailment upkeep a full turn does.
+		"""
+		if not self.path:
+			self.pick_patrol_route()
+
+		game_map = self.engine.game_map
+		for _ in range(steps):
+			if not self.path:
+				return
+			dest_x, dest_y = self.path[0]
+			if (not game_map.tiles["walkable"][dest_x, dest_y]
+			or game_map.get_blocking_entity_at_location(dest_x, dest_y)):
+				#route is blocked, a new one gets picked next time
+				self.path = []
+				return
+			self.path.pop(0)
+			self.lastLocation = self.entity.locTuple
+			self.entity.move(dest_x - self.entity.x, dest_y - self.entity.y)
+
 	def shouldPing(self) -> bool:
 		if self.engine.game_map.visible[self.entity.x, self.entity.y]:
 			if not self.justSeen:
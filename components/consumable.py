@@ -17,6 +17,9 @@ if TYPE_CHECKING:
 	from entity import Actor, Item
 	from ailments import Ailments
 
+#how far away sleeping actors hear a gun go off
+GUNSHOT_NOISE_RADIUS = 24
+
 
 class Consumable(BaseComponent):
 	parent: Item
@@ -83,16 +86,8 @@ class HomingGrenadeConsumable(Consumable):
 
 	def activate(self, action: actions.ItemAction) -> None:
 		consumer = action.entity
-		target = None
-		closest_distance = self.maximum_range + 1.0
-
-		for actor in self.engine.game_map.actors:
-			if actor is not consumer and self.parent.gamemap.visible[actor.x, actor.y]:
-				distance = consumer.distance(actor.x, actor.y)
-
-				if distance < closest_distance:
-					target = actor
-					closest_distance = distance
+		target = self.engine.game_map.get_nearest_visible_actor(
+			consumer.x, consumer.y, self.maximum_range, exclude=consumer)
 
 		if target:
 			self.engine.message_log.add_message(
@@ -100,6 +95,7 @@ class HomingGrenadeConsumable(Consumable):
 				color.player_atk,
 				makePing=False)
 			target.fighter.take_damage(self.damage)
+			self.engine.make_noise(*target.xy, radius=self.maximum_range * 2)
 			self.consume()
 		else:
 			raise Impossible("The homing grenade finds no target and returns to your hand.")
@@ -130,8 +126,8 @@ class GrenadeConsumable(Consumable):
 			raise Impossible("You cannot throw your grenade that far.")
 
 		targets_hit = False
-		for actor in self.engine.game_map.actors:
-			if actor.distance(*target_xy) <= self.radius:
+		for actor in self.engine.game_map.get_actors_in_radius(*target_xy, self.radius):
+			if actor.is_alive:
 				self.engine.message_log.add_message(
 					f"The {actor.name} is caught in the blast, taking {self.damage} damage!",
 					color.player_atk,
@@ -153,7 +149,9 @@ class GrenadeConsumable(Consumable):
 					self.engine.game_map.tiles[targetx, targety] == tile_types.wall):
 						self.engine.game_map.tiles[targetx, targety] = tile_types.floor
 				except IndexError: pass
+		self.engine.game_map.tiles_changed((x - radius, y - radius, x + radius + 1, y + radius + 1))
 		self.engine.animation_engine.emitAnimation(animation_engine.Explosion(cord=target_xy,radius=self.radius,color=self.parent.color, speedMod=self.speedMod))
+		self.engine.make_noise(*target_xy, radius=self.radius * 8)
 		self.consume()
 
 
@@ -190,6 +188,7 @@ class ZipGunConsumable(Consumable):
 			makePing=False)
 		target.fighter.take_damage(self.damage)
 		self.engine.animation_engine.emitAnimation(animation_engine.MuzzleFlash(cordStart=consumer.xy,cordEnd=target.xy))
+		self.engine.make_noise(*consumer.xy, radius=GUNSHOT_NOISE_RADIUS)
 		self.consume()
 		
 
@@ -239,6 +238,7 @@ class BallisticGun(Consumable):
 			target.fighter.take_damage(self.damage)
 			self.engine.sound_engine.emitSound("hand_gun")
 			self.engine.animation_engine.emitAnimation(animation_engine.MuzzleFlash(cordStart=consumer.xy,cordEnd=target.xy))
+			self.engine.make_noise(*consumer.xy, radius=GUNSHOT_NOISE_RADIUS)
 			#self.engine.animation_engine.emitAnimation(animation_engine.Projectile(cordStart=consumer.xy,cordEnd=target.xy,speedMod=2))
 
 		else:
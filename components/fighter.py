@@ -2,9 +2,8 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from random import choice as choice
-
 import color
+from entity_store import STORE
 from components.base_component import BaseComponent
 from input_handlers import GameOverEventHandler
 from render_order import RenderOrder
@@ -21,24 +20,36 @@ class Fighter(BaseComponent):
 
 	def __init__(self, hp: int, defense: int, power: int, hurtSound: sa.WaveObject, deathSound: sa.WaveObject):
 		self.max_hp = hp
-		self._hp = hp
-		self.defense = defense
+		#hp and defense live in the actors store row, attach writes them there
+		self.initial = (hp, defense)
 		self.power = power
 		self.hurtSound = hurtSound
 		self.deathSound = deathSound
 
 
+	def attach(self, parent: Actor) -> None:
+		self.parent = parent
+		STORE.hp[parent.id], STORE.defense[parent.id] = self.__dict__.pop("initial")
+
 	@property
 	def hp(self) -> int:
-		return self._hp
+		return STORE.hp.item(self.parent.id)
 	
 
 	@hp.setter
 	def hp(self, value: int) -> None:
-		self._hp = max(0, min(value, self.max_hp))
-		if self._hp <= 0 and self.parent.ai:
+		hp = STORE.hp[self.parent.id] = max(0, min(value, self.max_hp))
+		if hp <= 0 and self.parent.ai:
 			self.die()
 
+	@property
+	def defense(self) -> int:
+		return STORE.defense.item(self.parent.id)
+
+	@defense.setter
+	def defense(self, value: int) -> None:
+		STORE.defense[self.parent.id] = value
+
 	def die(self) -> None:
 		if self.engine.player is self.parent:
 			death_message = "You died! Will you be remembered?"
@@ -52,12 +63,15 @@ class Fighter(BaseComponent):
 		self.parent.color = (255, 0, 0)
 		self.parent.blocks_movement = False
 		self.parent.ai = None
+		self.gamemap.actor_died(self.parent)
 		self.parent.name = f"Remains of {self.parent.name}"
+		old_order = self.parent.render_order
 		self.parent.render_order= RenderOrder.CORPSE
+		self.gamemap.render_order_changed(self.parent, old_order)
 
 		self.parent.bleed(amount=2)
 
-		self.engine.sound_engine.emitSound(choice(self.deathSound))
+		self.engine.sound_engine.emitSound(self.engine.rng.choice(self.deathSound))
 
 
 		self.engine.message_log.add_message(death_message, death_message_color, makePing=False)
@@ -1,81 +1,265 @@
 #library imports######################################
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+import random
+
+import numpy as np
 ######################################################
 #tcod imports#########################################
 from tcod.context import Context
 from tcod.console import Console
-from tcod.map import compute_fov
 from tcod import FOV_RESTRICTIVE
+import tcod.path
 ######################################################
 #my code imports######################################
 import exceptions
 from input_handlers import MainGameEventHandler
 from message_log import MessageLog
-from render_functions import render_bar, render_names_at_mouse_location, render_enviroment_hud
+from render_functions import render_bar, render_names_at_mouse_location, EnviromentHud, render_perf_overlay
 import sound_engine
 import animation_engine
+import activity
+import headless as headless_mode
+import instrumentation
+from level_store import LevelStore
 ######################################################
 
 if TYPE_CHECKING:
-	from entity import Entity
+	from entity import Actor, Entity
 	from game_map import GameMap
 	from input_handlers import EventHandler
 	from ailments import Ailments
 
 
+#how far the player can see
+FOV_RADIUS = 17
+
+#size of the whole terminal the game is drawn on
+SCREEN_WIDTH = 96
+SCREEN_HEIGHT = 54
+
+
 class Engine:
 	game_map: GameMap
 
-	def __init__(self, player: Actor):
+	def __init__(
+		self,
+		player: Actor,
+		activity_config: activity.ActivityConfig = None,
+		headless: Optional[bool] = None,
+		animation_mode: Optional[str] = None,
+		seed: Optional[int] = None,
+		):
+		"""
+		'headless' swaps in a sound engine that only records and skips animations,
+		it defaults to the BIOWEAPONS_HEADLESS environment setting.
+		'animation_mode' overrides how animations play, see animation_engine.
+		'seed' seeds self.rng, which everything that changes the game state draws from,
+		a random one is picked if it isnt given.
+		"""
+		if seed is None: seed = random.randrange(2 ** 32)
+		self.seed = seed
+		self.rng = random.Random(seed)
+		#replay.Recorder when the session is being recorded
+		self.recorder = None
+
+		if headless is None: headless = headless_mode.is_headless()
+		if animation_mode is None:
+			animation_mode = animation_engine.SKIP if headless else animation_engine.PLAY
+		self.headless = headless
+
 		self.event_handler: EventHandler = MainGameEventHandler(self)
 		self.message_log = MessageLog(engine=self)
 		self.mouse_location = (0, 0)
 		self.player = player
-		self.sound_engine = sound_engine.SoundEngine()
-		self.animation_engine = animation_engine.AnimationEngine(engine=self)
+		if headless: self.sound_engine = sound_engine.NullSoundEngine()
+		else: self.sound_engine = sound_engine.SoundEngine()
+		self.animation_engine = animation_engine.AnimationEngine(engine=self, mode=animation_mode)
+		#console for render_offscreen, made when first needed
+		self.offscreen_console: Optional[Console] = None
+		self.show_perf_overlay = False
+		#the Enviroment panel for the current turn, None until the next frame works it out
+		self.enviroment_hud: Optional[EnviromentHud] = None
+		self.turn = 0
+		#how far down the player is, level_pipeline.LevelPipeline supplies the levels below
+		self.depth = 1
+		self.levels = None
+		#the levels the player has left, for coming back to them
+		self.level_store = LevelStore()
+		#savegame.Autosaver when the game should be saved as it goes
+		self.autosaver = None
+		#(blockCost, corpseCost) -> (player location, distance field), see get_chase_field
+		self.chase_fields: Dict[Tuple[int, int], Tuple[Tuple[int, int], np.ndarray]] = {}
+		#how often HostileEnemy kept, repaired or replanned its chase path
+		self.path_stats = {"hits": 0, "repairs": 0, "replans": 0}
+		#decides which actors get a full turn, a coarse one or none
+		self.activity = activity.ActivityScheduler(self, activity_config, fov_radius=FOV_RADIUS)
+		#(map, player x, y, transparency version) the visible area was last worked out for
+		self.fov_key: Optional[Tuple[GameMap, int, int, int]] = None
+		#living actors in view at the last fov update, None until the first on a map
+		self.actors_in_view: Optional[List[Actor]] = None
+
+	@property
+	def frame_rate(self) -> int:
+		#frames per second the screen needs right now, 0 when nothing moves and the loop can block
+		rate = self.event_handler.frameRate
+		if self.animation_engine.hasActive: rate = max(rate, self.animation_engine.frameRate)
+		return rate
 
 	@property
 	def locking(self):
-		if self.animation_engine.hasActive: return False
-		if self.event_handler.unlock: return False
-		return True
+		return self.frame_rate == 0
 	
 
+	def toggle_perf_overlay(self) -> None:
+		#timings are only collected while the overlay is up
+		self.show_perf_overlay = not self.show_perf_overlay
+		instrumentation.set_enabled(self.show_perf_overlay)
+
 	def handle_enemy_turns(self) -> None:
-		for entity in set(self.game_map.actors) - {self.player}:
+		with instrumentation.span("turn.enemies"):
+			self._handle_enemy_turns()
+
+	def _handle_enemy_turns(self) -> None:
+		self.turn += 1
+		#chase fields are built on demand, once per cost profile this turn
+		self.chase_fields.clear()
+		tiers = self.activity.schedule()
+		for entity in tiers[activity.ACTIVE]:
 			if entity.ai:
 				try:
 					entity.ai.perform()
 				except exceptions.Impossible:
 					pass
+		for entity in tiers[activity.COARSE]:
+			if entity.ai:
+				try:
+					entity.ai.coarse_perform(self.activity.config.coarse_interval)
+				except exceptions.Impossible:
+					pass
+
+	def descend(self) -> None:
+		self.change_level(self.depth + 1)
+
+	def ascend(self) -> None:
+		if self.depth <= 1:
+			raise exceptions.Impossible("There is no way back up.")
+		self.change_level(self.depth - 1)
+
+	def change_level(self, depth: int) -> None:
+		"""
+		Moves the player onto level 'depth', arriving on the stairs that lead back.
+		Levels visited before come out of self.level_store, new ones were generated
+		ahead of time by self.levels so they only need rebuilding from their spawn records.
+		"""
+		game_map = self.level_store.take(depth, self)
+		if game_map is None:
+			if self.levels is None:
+				raise exceptions.Impossible("There is nowhere to go down to.")
+			game_map = self.levels.take(depth).build(self)
+		else:
+			arrival = game_map.upstairs_location if depth > self.depth else game_map.downstairs_location
+			self.player.place(*arrival, game_map)
+
+		self.level_store.put(self.depth, self.game_map)
+		self.game_map = game_map
+		self.depth = depth
+		self.chase_fields.clear()
+		self.activity.reset()
+		self.enviroment_hud = None
+		self.actors_in_view = None
+		self.update_fov()
+
+	#wakes actors in earshot back up to full fidelity
+	def make_noise(self, x: int, y: int, radius: int) -> None:
+		self.activity.make_noise(x, y, radius)
+
+
+	def get_chase_field(self, blockCost: int = 0, corpseCost: int = 0) -> np.ndarray:
+		"""
+		Dijkstra distance from the player over the path costs of one profile.
+		Every agent with the same blockCost and corpseCost shares it, so chasing
+		the player costs one search per profile instead of one per agent.
+		"""
+		key = (blockCost, corpseCost)
+		cached = self.chase_fields.get(key)
+		if cached is not None and cached[0] == self.player.xy:
+			return cached[1]
+
+		cost = self.game_map.get_path_cost(blockCost, corpseCost)
+		field = tcod.path.maxarray(cost.shape, order="F")
+		field[self.player.x, self.player.y] = 0
+		tcod.path.dijkstra2d(field, cost, 2, 3, out=field)
+
+		self.chase_fields[key] = (self.player.xy, field)
+		return field
 
 
 	#recompute visible area based on players position and view
 	#determins if player should be alerted because they revealed somthing
 	def update_fov(self) -> None:
-		self.game_map.visible[:] = compute_fov(
-			self.game_map.tiles["transparent"],
-			(self.player.x, self.player.y),
-			radius=17,
-			algorithm=FOV_RESTRICTIVE
-		)
-		#if somthing is visible, add it to explored
-		self.game_map.explored |= self.game_map.visible
+		with instrumentation.span("turn.fov"):
+			self._update_fov()
+
+	def _update_fov(self) -> None:
+		game_map = self.game_map
+		fov_key = (game_map, self.player.x, self.player.y, game_map.transparency_version)
+		if fov_key == self.fov_key:
+			#waited or used something in place, so the same is visible as last turn
+			game_map.fov.skipped += 1
+		else:
+			self.fov_key = fov_key
+			(x0, y0, x1, y1), window = game_map.fov.get(
+				game_map.tiles["transparent"], game_map.transparency_version,
+				self.player.x, self.player.y, FOV_RADIUS, FOV_RESTRICTIVE,
+				)
+			visible = np.zeros((game_map.width, game_map.height), dtype=bool, order="F")
+			visible[x0:x1, y0:y1] = window
+			region = game_map.set_visible(visible, (x0, y0, x1, y1))
+			#if somthing is visible, add it to explored
+			if region is not None and (game_map.visible & ~game_map.explored).any():
+				game_map.explored |= game_map.visible
+				game_map.explored_changed(region)
+
+		self.enviroment_hud = None
 
 		#makes list of currently visible things, sorts by living ai
 		#if this is them being revealed, ping, and flash animation
-		for entity in set(self.game_map.actors) - {self.player}:
-			if entity.ai:
+		#the pings are merged into one louder one by the sound engine
+		in_view = [actor for actor, _ in self.game_map.get_visible_actors_in_radius(
+			self.player.x, self.player.y, exclude=self.player)]
+		with self.sound_engine.turn():
+			for entity in in_view:
 				if entity.ai.shouldPing():
-					self.sound_engine.queueSound("hostile_seen")
+					self.sound_engine.emitSound(sound_engine.hostile_seen)
 					self.animation_engine.emitAnimation(animation_engine.Highlight(cord=entity.xy,color=(255,255,230)))
-		self.sound_engine.pushQueue("hostile_seen")
+		#only actors that were in view can still think they are seen, they need telling otherwise
+		previous = self.game_map.actors if self.actors_in_view is None else self.actors_in_view
+		seen = set(in_view)
+		for entity in previous:
+			if entity not in seen and entity is not self.player and entity.ai and entity.parent is self.game_map:
+				entity.ai.shouldPing()
+		self.actors_in_view = in_view
+
+	def render_offscreen(self) -> Console:
+		#draws the current frame into a console that nothing presents, for headless runs
+		if self.offscreen_console is None:
+			self.offscreen_console = Console(SCREEN_WIDTH, SCREEN_HEIGHT, order="F")
+		self.offscreen_console.clear()
+		self.event_handler.on_render(console=self.offscreen_console)
+		return self.offscreen_console
 
 	def render(self, console: Console) -> None:
-		self.game_map.render(console)
-		self.animation_engine.animateFrame(console)
+		with instrumentation.span("frame.map"):
+			self.game_map.render(console)
+		with instrumentation.span("frame.animations"):
+			self.animation_engine.animateFrame(console)
+		with instrumentation.span("frame.hud"):
+			self.render_hud(console)
+		if self.show_perf_overlay:
+			render_perf_overlay(console=console, engine=self, x=58, y=0, width=22)
 
+	def render_hud(self, console: Console) -> None:
 		#ui and shizz
 		console.draw_frame(x=0, y=45, width=22, height=9, title="Condition", fg=(150,150,150), bg=(0,0,0))
 
@@ -90,7 +274,9 @@ class Engine:
 			string="├──────────────┤")
 
 
-		heatSig = len(set(self.game_map.actors)-{self.player})
+		if self.enviroment_hud is None:
+			self.enviroment_hud = EnviromentHud(self)
+		heatSig = self.enviroment_hud.heatSig
 		signatureEnding = ""
 		if heatSig != 1: signatureEnding = "s"
 		console.print(
@@ -131,15 +317,4 @@ class Engine:
 
 		render_names_at_mouse_location(console=console, engine=self, x=23, y=53, maxWidth=56)
 
-		visibleEntitiesWithDistance = []
-		visibleEntities = []
-		for actor in self.game_map.actors:
-			if actor != self.player:
-				if self.game_map.visible[actor.x, actor.y]:
-					visibleEntitiesWithDistance.append((actor, actor.distance(self.player.x, self.player.y)))
-
-		visibleEntitiesWithDistance.sort(key=lambda distance: distance[1])
-		for tuple in visibleEntitiesWithDistance:
-			visibleEntities.append(tuple[0])
-
-		render_enviroment_hud(console=console, actorsVisible=visibleEntities, engine=self, x=80, y=2, width=16, height=49)
+		self.enviroment_hud.render(console=console, engine=self, x=80, y=2, width=16, height=49)
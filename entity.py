@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import copy
+from enum import Enum
 import math
-import random
-from typing import Optional, Tuple, Type, TypeVar, TYPE_CHECKING, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, TypeVar, TYPE_CHECKING, Union
 
+from entity_store import STORE
 from render_order import RenderOrder
 
 import tile_types
@@ -19,13 +20,133 @@ if TYPE_CHECKING:
 
 T = TypeVar("T", bound="Entity")
 
+#attribute values a prototype can share with its copies, since nothing changes them in place
+SHARED_TYPES = (str, int, float, bool, tuple, type(None), Enum, type)
+
+
+class Prototype:
+	"""
+	A compiled constructor for copies of one prototype entity, instead of deepcopying it.
+	The store row is copied over in one go. Everything else that is only ever replaced,
+	never changed in place, is shared with the prototype: names, numbers and filled lists
+	like the death sounds. Empty lists and dicts are per instance state, like inventory
+	items or an ai path, so each copy gets its own, and the components are rebuilt
+	pointing back at the new entity.
+	Raises ValueError for an entity holding anything else, those have to be deepcopied.
+	"""
+	def __init__(self, entity: Entity) -> None:
+		self.cls = type(entity)
+		self.source = entity.id
+		#(attribute, class, shared attributes, attributes that get a fresh container, back references)
+		self.components: List[Tuple[str, type, Dict[str, Any], Tuple[str, ...], Tuple[str, ...]]] = []
+		fields = {}
+		for name in self.cls.FIELDS:
+			if not hasattr(entity, name):
+				continue
+			value = getattr(entity, name)
+			if hasattr(value, "__dict__") and not isinstance(value, SHARED_TYPES):
+				if not any(attribute is entity for attribute in vars(value).values()):
+					raise ValueError(f"{entity.name}.{name} is not a component")
+				self.components.append((name, type(value), *self._split(vars(value), entity)))
+			else:
+				fields[name] = value
+		self.fields, self.fresh, _ = self._split(fields, entity)
+
+	@staticmethod
+	def _split(fields: Dict[str, Any], entity: Entity) -> Tuple[Dict[str, Any], Tuple[str, ...], Tuple[str, ...]]:
+		shared, fresh, back = {}, [], []
+		for name, value in fields.items():
+			if value is entity:
+				back.append(name)
+			elif isinstance(value, (list, dict, set)):
+				if not value:
+					fresh.append(name)
+				elif not all(isinstance(item, SHARED_TYPES) for item in value):
+					raise ValueError(f"{entity.name}.{name} holds more than plain values")
+				shared[name] = value
+			elif isinstance(value, SHARED_TYPES):
+				shared[name] = value
+			else:
+				raise ValueError(f"{entity.name}.{name} cant be shared")
+		return shared, tuple(fresh), tuple(back)
+
+	def build(self) -> Entity:
+		#a new copy of the prototype, not on any map yet
+		entity = self.cls.__new__(self.cls)
+		entity.id = STORE.allocate()
+		STORE.copy_row(self.source, entity.id)
+		entity.constructor = None
+		for name, value in self.fields.items():
+			setattr(entity, name, value)
+		for name in self.fresh:
+			setattr(entity, name, type(self.fields[name])())
+		for name, cls, fields, fresh, back in self.components:
+			component = cls.__new__(cls)
+			component_state = component.__dict__
+			component_state.update(fields)
+			for field in fresh:
+				component_state[field] = type(fields[field])()
+			for field in back:
+				component_state[field] = entity
+			setattr(entity, name, component)
+		return entity
+
+
+class Column:
+	"""
+	An Entity attribute kept in a STORE column. Plain columns come back as python values,
+	'load' and 'dump' convert the others on the way out and in.
+	"""
+	def __init__(self, name: str, load: Callable[[Any], Any] = None, dump: Callable[[Any], Any] = None) -> None:
+		self.name = name
+		self.load = load
+		self.dump = dump
+
+	def __get__(self, entity: Optional[Entity], owner: type = None) -> Any:
+		if entity is None:
+			return self
+		if self.load is None:
+			return STORE.columns[self.name].item(entity.id)
+		return self.load(STORE.columns[self.name][entity.id])
+
+	def __set__(self, entity: Entity, value: Any) -> None:
+		STORE.columns[self.name][entity.id] = value if self.dump is None else self.dump(value)
+
+
+def spawn_batch(gamemap: GameMap, spawns: Iterable[Tuple[Entity, int, int]]) -> List[Entity]:
+	#spawns every (prototype, x, y) onto gamemap in one go
+	clones = []
+	for prototype, x, y in spawns:
+		clone = prototype.instantiate()
+		clone.x = x
+		clone.y = y
+		clone.parent = gamemap
+		clones.append(clone)
+	gamemap.add_entities(clones)
+	return clones
+
 
 class Entity:
 	"""
 	A genaric object to represent players, enemies, items - anything that can move -
+	The fields in entity_store.COLUMNS live in STORE under self.id, the rest in slots.
 	"""
+	__slots__ = ("id", "name", "parent", "could_live", "prototype_id", "constructor")
+	#attributes that arent store columns, in the order fields() lists them
+	FIELDS: Tuple[str, ...] = ("name", "parent", "could_live", "prototype_id")
 
 	parent: Union[GameMap, Inventory]
+	#name of the entity_factories prototype this was spawned from, copied along by spawn
+	prototype_id: Optional[str]
+	#set on the entity_factories prototypes, so spawning them skips deepcopy
+	constructor: Optional[Prototype]
+
+	x = Column("x")
+	y = Column("y")
+	char = Column("char", chr, ord)
+	color = Column("color", lambda value: tuple(value.tolist()))
+	blocks_movement = Column("blocks_movement")
+	render_order = Column("render_order", lambda value: RenderOrder(int(value)), lambda order: order.value)
 
 
 	def __init__(
@@ -39,6 +160,7 @@ class Entity:
 		blocks_movement: bool = False,
 		render_order: RenderOrder = RenderOrder.CORPSE
 		):
+		self.id = STORE.allocate()
 		self.x = x
 		self.y = y
 		self.char = char
@@ -47,11 +169,53 @@ class Entity:
 		self.blocks_movement = blocks_movement
 		self.render_order = render_order
 		self.could_live = False
+		self.prototype_id = None
+		self.constructor = None
 		if parent:
 			#if this is false, then it will be set later
 			self.parent = parent
-			parent.entities.add(self)
-
+			parent.add_entity(self)
+
+	def release(self) -> None:
+		"""
+		Hands the store row back, along with those of anything carried.
+		Only for entities leaving the game for good, nothing may use them afterwards.
+		"""
+		if self.id is not None:
+			STORE.release(self.id)
+			self.id = None
+
+	def __del__(self) -> None:
+		#fallback for entities dropped without release, if there ever was a row and the store is still around at exit
+		try:
+			if self.id is not None:
+				STORE.release(self.id)
+		except (AttributeError, TypeError):
+			pass
+
+	def fields(self) -> Dict[str, Any]:
+		#everything that makes up this entity: its store row as plain values, then the other attributes
+		fields = STORE.row(self.id)
+		for name in self.FIELDS:
+			if hasattr(self, name):
+				fields[name] = getattr(self, name)
+		return fields
+
+	def set_fields(self, fields: Dict[str, Any]) -> None:
+		for name, value in fields.items():
+			if name in STORE.columns:
+				STORE.columns[name][self.id] = value
+			else:
+				setattr(self, name, value)
+
+	#pickling and deepcopy go through fields, with a new row for the copy
+	def __getstate__(self) -> Dict[str, Any]:
+		return self.fields()
+
+	def __setstate__(self, state: Dict[str, Any]) -> None:
+		self.id = STORE.allocate()
+		self.constructor = None
+		self.set_fields(state)
 
 	@property
 	def is_alive(self):
@@ -66,27 +230,39 @@ class Entity:
 		return (self.x, self.y)
 	
 
+	def instantiate(self: T) -> T:
+		#a copy of this entity that isnt on any map, deepcopied unless it has a constructor
+		if self.constructor is not None:
+			return self.constructor.build()
+		return copy.deepcopy(self)
+
 	#makes copy of instance at given point
 	def spawn(self: T, gamemap: GameMap, x: int, y: int) -> T:
-		clone = copy.deepcopy(self)
+		clone = self.instantiate()
 		clone.x = x
 		clone.y = y
 		clone.parent = gamemap
-		gamemap.entities.add(clone)
+		gamemap.add_entity(clone)
 		return clone
 
 	#place this entity at new location, handles movine across GameMaps
 	def place(self, x: int, y: int, gamemap: Optional[GameMap] = None) -> None:
-		self.x = x
-		self.y = y
 		if gamemap:
 			#may be unintilized
 			if hasattr(self, "parent"):
 				if self.parent is self.gamemap:
-					self.gamemap.entities.remove(self)
+					self.gamemap.remove_entity(self)
 
+			self.x = x
+			self.y = y
 			self.parent = gamemap
-			gamemap.entities.add(self)
+			gamemap.add_entity(self)
+		else:
+			old_x, old_y = self.x, self.y
+			self.x = x
+			self.y = y
+			if hasattr(self, "parent") and self.parent is self.gamemap:
+				self.gamemap.move_entity(self, old_x, old_y)
 
 	#returns distance between self and x,y
 	def distance(self, x: int, y: int) -> float:
@@ -94,11 +270,17 @@ class Entity:
 
 	def move(self, dx: int, dy: int) -> None:
 		#moves by amount
+		old_x, old_y = self.x, self.y
 		self.x += dx
 		self.y += dy
+		if self.parent is self.gamemap:
+			self.gamemap.move_entity(self, old_x, old_y)
 
 
 class Actor(Entity):
+	__slots__ = ("_ai", "fighter", "inventory", "ailments")
+	FIELDS = Entity.FIELDS + ("ai", "fighter", "inventory", "ailments")
+
 	def __init__(
 		self,
 		*,
@@ -126,7 +308,7 @@ class Actor(Entity):
 		self.ai: Optional[BaseAI] = ai_cls(self, blockCost=aiConfig["blockCost"], corpseCost=aiConfig["corpseCost"])
 
 		self.fighter = fighter
-		self.fighter.parent = self
+		self.fighter.attach(self)
 
 		self.inventory = inventory
 		self.inventory.parent = self
@@ -136,10 +318,25 @@ class Actor(Entity):
 
 		self.could_live = True
 
+	def release(self) -> None:
+		for item in self.inventory.items:
+			item.release()
+		super().release()
+
+	@property
+	def ai(self) -> Optional[BaseAI]:
+		return self._ai
+
+	@ai.setter
+	def ai(self, ai: Optional[BaseAI]) -> None:
+		#the alive column follows the ai, so queries can tell the living without visiting them
+		self._ai = ai
+		STORE.alive[self.id] = bool(ai)
+
 	@property
 	def is_alive(self) -> bool:
 		#returns true as long as this actor can perform actions
-		return bool(self.ai)
+		return bool(self._ai)
 
 	@property
 	def locTuple(self) -> Tuple(self.x, self.y):
@@ -153,6 +350,7 @@ class Actor(Entity):
 			#makes sure there isnt already blood under actor, so it can go next to
 			if not self.gamemap.tiles[self.x, self.y] in [tile_types.bloodyFloor, tile_types.wall]:
 				self.gamemap.tiles[self.x, self.y] = tile_types.bloodyFloor
+				self.gamemap.tiles_changed((self.x, self.y, self.x+1, self.y+1))
 				amount -= 1
 
 		#iteration variable to prevent cpu overuse
@@ -160,13 +358,14 @@ class Actor(Entity):
 		#all the rest fo the blood
 		while amount > 0:
 			#picks random modifier
-			stainX = random.choice((+1,0,-1))
-			stainY = random.choice((+1,0,-1))
+			stainX = self.gamemap.engine.rng.choice((+1,0,-1))
+			stainY = self.gamemap.engine.rng.choice((+1,0,-1))
 
 			#tests if its a valid space for blood
 			if not self.gamemap.tiles[self.x+stainX, self.y+stainY] in [tile_types.bloodyFloor, tile_types.wall]:
 				#if it is, put blood, and reduce amount by 1
 				self.gamemap.tiles[self.x+stainX, self.y+stainY] = tile_types.bloodyFloor
+				self.gamemap.tiles_changed((self.x+stainX, self.y+stainY, self.x+stainX+1, self.y+stainY+1))
 				amount -= 1
 
 			iteration += 1
@@ -174,6 +373,9 @@ class Actor(Entity):
 
 
 class Item(Entity):
+	__slots__ = ("consumable",)
+	FIELDS = Entity.FIELDS + ("consumable",)
+
 	def __init__(
 		self,
 		*,
@@ -197,6 +399,13 @@ class Item(Entity):
 		self.consumable = consumable
 		self.consumable.parent = self
 
+	def release(self) -> None:
+		#a gun takes the magazine loaded into it along
+		mag = getattr(self.consumable, "mag", None)
+		if mag is not None:
+			mag.parent.release()
+		super().release()
+
 
 		
 	
\ No newline at end of file
@@ -1,9 +1,11 @@
+from typing import Dict
+
 from components.ai import HostileEnemy
 from components import consumable
 from components.fighter import Fighter
 from components.inventory import Inventory
 
-from entity import Actor, Item
+from entity import Actor, Entity, Item, Prototype
 from ailments import Ailments
 
 import sound_engine
@@ -129,4 +131,14 @@ standeredLootTable.extend([homing_grenade]*7)
 standeredLootTable.extend([nitroglyn_grenade]*3)
 standeredLootTable.extend([small_magazine]*20)
 standeredLootTable.extend([medium_magazine]*4)
-standeredLootTable.extend([large_magazine]*1)
\ No newline at end of file
+standeredLootTable.extend([large_magazine]*1)
+
+
+#every prototype by name, so levels can be described by spawn records and rebuilt elsewhere
+#each gets a compiled constructor, so spawning one doesnt deepcopy it
+PROTOTYPES: Dict[str, Entity] = {}
+for _name, _prototype in list(globals().items()):
+	if isinstance(_prototype, Entity):
+		_prototype.prototype_id = _name
+		_prototype.constructor = Prototype(_prototype)
+		PROTOTYPES[_name] = _prototype
@@ -0,0 +1,85 @@
+"""
+Struct-of-arrays storage for the entity fields that hot queries read.
+
+Every Entity gets an integer id, a row in STORE. Its position, alive flag,
+blocks_movement, render order, glyph and colour (and for actors hp and
+defense) live in one NumPy column each, Entity and Fighter only hold the id
+and read and write through to the columns. Anything that looks at many
+entities at once, rendering or "living actors in fov within r" say, can then
+index the columns with an array of ids instead of visiting every object.
+
+Rows are handed back when their entity is garbage collected and reused.
+The columns are replaced as they grow, so always reach them through STORE.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import numpy as np
+
+#name -> (dtype, shape of one value)
+COLUMNS = {
+	"x": (np.int32, ()),
+	"y": (np.int32, ()),
+	"alive": (np.bool_, ()),
+	"blocks_movement": (np.bool_, ()),
+	"render_order": (np.uint8, ()),
+	"char": (np.uint32, ()),
+	"color": (np.uint8, (3,)),
+	"hp": (np.int32, ()),
+	"defense": (np.int32, ()),
+	}
+
+
+class EntityStore:
+	def __init__(self, capacity: int = 1024) -> None:
+		self.capacity = capacity
+		self.columns: Dict[str, np.ndarray] = {
+			name: np.zeros((capacity, *shape), dtype=dtype) for name, (dtype, shape) in COLUMNS.items()
+			}
+		#rows given back, and the first row never handed out
+		self.free: List[int] = []
+		self.end = 0
+		self._bind()
+
+	def _bind(self) -> None:
+		#each column as an attribute too, STORE.x[ids] reads better than STORE.columns["x"][ids]
+		for name, column in self.columns.items():
+			setattr(self, name, column)
+
+	def __len__(self) -> int:
+		#rows in use
+		return self.end - len(self.free)
+
+	def allocate(self) -> int:
+		if self.free:
+			return self.free.pop()
+		if self.end == self.capacity:
+			self.capacity *= 2
+			for name, column in self.columns.items():
+				grown = np.zeros((self.capacity, *column.shape[1:]), dtype=column.dtype)
+				grown[:self.end] = column
+				self.columns[name] = grown
+			self._bind()
+		self.end += 1
+		return self.end - 1
+
+	def release(self, id: int) -> None:
+		for column in self.columns.values():
+			column[id] = 0
+		self.free.append(id)
+
+	def copy_row(self, source: int, dest: int) -> None:
+		for column in self.columns.values():
+			column[dest] = column[source]
+
+	def row(self, id: int) -> Dict[str, Any]:
+		#the row as plain python values, tuples for the colour
+		row = {}
+		for name, column in self.columns.items():
+			value = column[id].tolist()
+			row[name] = tuple(value) if isinstance(value, list) else value
+		return row
+
+
+STORE = EntityStore()
@@ -0,0 +1,63 @@
+"""
+Field of view, worked out only over the window it can reach and cached.
+
+A field of view only depends on where it is seen from and which tiles are
+transparent, so results are kept by (x, y, radius, algorithm, transparency
+version) and standing still or walking back over the same cells reuses them.
+Nothing beyond 'radius' can be seen, so each result is only computed over
+the square window around its origin, which gives the same cells as
+computing it over the whole map.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+from tcod.map import compute_fov
+
+#fields of view kept per FovCache
+FOV_CACHE_SIZE = 64
+
+#a window as (x0, y0, x1, y1), x1 and y1 exclusive, same as game_map.Region
+Region = Tuple[int, int, int, int]
+
+
+class FovCache:
+	"""
+	Fields of view as (window, visible cells in the window), least recently used dropped past 'capacity'.
+	hits and misses count lookups since the cache was made, clear leaves them be, and skipped
+	the updates its owner did without a lookup since nothing had changed.
+	"""
+	def __init__(self, capacity: int = FOV_CACHE_SIZE) -> None:
+		self.capacity = capacity
+		self.results: OrderedDict[tuple, Tuple[Region, np.ndarray]] = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.skipped = 0
+
+	def get(
+		self, transparent: np.ndarray, version: int, x: int, y: int, radius: int, algorithm: int,
+		) -> Tuple[Region, np.ndarray]:
+		#'version' must change whenever 'transparent' does, the result is shared so it must not be written to
+		key = (x, y, radius, algorithm, version)
+		result = self.results.get(key)
+		if result is not None:
+			self.hits += 1
+			self.results.move_to_end(key)
+			return result
+
+		self.misses += 1
+		width, height = transparent.shape
+		x0, y0 = max(0, x - radius), max(0, y - radius)
+		x1, y1 = min(width, x + radius + 1), min(height, y + radius + 1)
+		visible = compute_fov(transparent[x0:x1, y0:y1], (x - x0, y - y0), radius=radius, algorithm=algorithm)
+		visible.flags.writeable = False
+		result = self.results[key] = ((x0, y0, x1, y1), visible)
+		if len(self.results) > self.capacity:
+			self.results.popitem(last=False)
+		return result
+
+	def clear(self) -> None:
+		#drops the results, for when they are of a map the player has left
+		self.results.clear()
@@ -1,34 +1,98 @@
 from __future__ import annotations
 
-from typing import Iterable, Iterator, Optional, TYPE_CHECKING
+import math
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np
 from tcod.console import Console
+import tcod
 
 from entity import Actor, Item
+from entity_store import STORE
+from fov import FovCache
+from render_order import RenderOrder
 import tile_types
 
 if TYPE_CHECKING:
 	from engine import Engine
 	from entity import Entity
 
+#side length of the squares living actors are hashed into for radius queries
+BUCKET_SIZE = 8
+
+#a rectangle of cells as (x0, y0, x1, y1), x1 and y1 exclusive
+Region = Tuple[int, int, int, int]
+
+
+def changed_region(changed: np.ndarray) -> Optional[Region]:
+	#the bounding box of the true cells in 'changed', None if there are none
+	columns, rows = np.any(changed, axis=1), np.any(changed, axis=0)
+	if not columns.any():
+		return None
+	x0, x1 = np.argmax(columns), len(columns) - np.argmax(columns[::-1])
+	y0, y1 = np.argmax(rows), len(rows) - np.argmax(rows[::-1])
+	return int(x0), int(y0), int(x1), int(y1)
+
+
 class GameMap:
 	def __init__(
 		self, engine: Engine, width: int, height: int, entities: Iterable[Entity] = ()
 		):
 		self.engine = engine
 		self.width, self.height = width, height
-		self.entities = set(entities)
+		#a dict used as an ordered set, so iterating it is the same every run
+		self.entities: Dict[Entity, None] = {}
 		self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
 		self.rooms = None
+		self.downstairs_location = (0, 0)
+		#where the stairs back up are, None on the first level
+		self.upstairs_location: Optional[Tuple[int, int]] = None
 
 		self.visible = np.full(
 		(width, height), fill_value=False, order="F"
 		) #Tiles player can see
+		#a region holding every visible tile, None while nothing is, keeps visible actor queries near the player
+		self.visible_bounds: Optional[Region] = None
 		self.explored = np.full(
 		(width, height), fill_value=False, order="F"
 		) #Tiles player has seen
 
+		#bumped whenever tiles, explored or the blocking entities/corpses change
+		self.tiles_version = 0
+		self.explored_version = 0
+		self.entities_version = 0
+		#bumped only when tiles_changed finds the transparent tiles changed, keys the fov cache
+		self.transparency_version = 0
+		self._transparent = np.array(self.tiles["transparent"], order="F")
+		#fields of view seen on this map, see Engine.update_fov
+		self.fov = FovCache()
+
+		#how many blocking entities and corpses sit on each cell, feeds the path costs
+		self._blocker_count = np.zeros((width, height), dtype=np.int32, order="F")
+		self._corpse_count = np.zeros((width, height), dtype=np.int32, order="F")
+		#(cheat) -> (version, cost) and (blockCost, corpseCost, cheat) -> [version, cost, graph]
+		self._base_costs: Dict[bool, Tuple[Tuple[int, int], np.ndarray]] = {}
+		self._cost_overlays: Dict[Tuple[int, int, bool], list] = {}
+
+		#the tiles as drawn, recomposited only inside _map_dirty when tiles, visible or explored change
+		self._map_layer = np.full((width, height), fill_value=tile_types.SHROUD, order="F")
+		self._map_dirty: Optional[Region] = (0, 0, width, height)
+
+		#entities by render order, drawn lowest first, each with cached (x, y, ch, fg) arrays or None once changed
+		self._render_buckets: Dict[RenderOrder, Dict[Entity, None]] = {order: {} for order in RenderOrder}
+		self._render_arrays: Dict[RenderOrder, Optional[Tuple[np.ndarray, ...]]] = {order: None for order in RenderOrder}
+
+		#self.entities as a list and their store ids, for the queries that go through the store columns
+		self._entity_list: List[Entity] = []
+		self._ids: Optional[np.ndarray] = None
+
+		#spatial index - every entity by the cell its on, and living actors by bucket
+		self._cells: Dict[Tuple[int, int], List[Entity]] = {}
+		self._actor_buckets: Dict[Tuple[int, int], Dict[Actor, None]] = {}
+		for entity in entities:
+			entity.parent = self
+			self.add_entity(entity)
+
 	@property
 	def gamemap(self) -> GameMap:
 		return self
@@ -37,40 +101,306 @@ class GameMap:
 	#iterates over maps living actors
 	@property
 	def actors(self) -> Iterator[Actor]:
-		yield from (
-			entity
-			for entity in self.entities
-			if isinstance(entity, Actor) and entity.is_alive)
+		living = np.flatnonzero(STORE.alive[self._get_ids()]).tolist()
+		entities = self._entity_list
+		#checked again, in case one dies while this is being iterated
+		yield from (entities[index] for index in living if entities[index].is_alive)
 		
+	@property
+	def living_actor_count(self) -> int:
+		return sum(len(bucket) for bucket in self._actor_buckets.values())
+
 	@property
 	def items(self) -> Iterator[Item]:
 		yield from (entity for entity in self.entities if isinstance(entity, Item))
 	
 
+	#spatial index upkeep######################################
+	"""
+	Entity.place, Entity.move, Entity.spawn, spawn_batch and Fighter.die keep the index current,
+	anything else that adds, removes or moves an entity on a map must go through these.
+	"""
+	def add_entity(self, entity: Entity) -> None:
+		self.entities[entity] = None
+		self._index(entity)
+		self._render_buckets[entity.render_order][entity] = None
+		self._render_arrays[entity.render_order] = None
+		self._ids = None
+
+	def add_entities(self, entities: Iterable[Entity]) -> None:
+		#add_entity for a batch, the render arrays are only invalidated once per order
+		orders = set()
+		for entity in entities:
+			self.entities[entity] = None
+			self._index(entity)
+			self._render_buckets[entity.render_order][entity] = None
+			orders.add(entity.render_order)
+		for order in orders:
+			self._render_arrays[order] = None
+		self._ids = None
+
+	def remove_entity(self, entity: Entity) -> None:
+		del self.entities[entity]
+		self._unindex(entity, entity.x, entity.y)
+		del self._render_buckets[entity.render_order][entity]
+		self._render_arrays[entity.render_order] = None
+		self._ids = None
+
+	def release_entities(self) -> None:
+		#hands back the store rows of everything on this map but the player, for when the map is dropped for good
+		player = self.engine.player
+		for entity in self.entities:
+			if entity is not player:
+				entity.release()
+
+	def move_entity(self, entity: Entity, old_x: int, old_y: int) -> None:
+		#call after the entitys x and y have changed
+		self._unindex(entity, old_x, old_y)
+		self._index(entity)
+		self._render_arrays[entity.render_order] = None
+
+	def render_order_changed(self, entity: Entity, old_order: RenderOrder) -> None:
+		#call after the entitys render_order, char or color have changed
+		del self._render_buckets[old_order][entity]
+		self._render_arrays[old_order] = None
+		self._render_buckets[entity.render_order][entity] = None
+		self._render_arrays[entity.render_order] = None
+
+	def actor_died(self, actor: Actor) -> None:
+		#corpses stay in their cell, but leave the living actor buckets
+		bucket = self._actor_buckets.get(self._bucket_of(actor.x, actor.y))
+		if bucket is not None:
+			bucket.pop(actor, None)
+		#it stopped blocking and became a corpse
+		self._blocker_count[actor.x, actor.y] -= 1
+		self._corpse_count[actor.x, actor.y] += 1
+		self._entity_costs_changed(actor.x, actor.y)
+
+	def _index(self, entity: Entity) -> None:
+		self._cells.setdefault((entity.x, entity.y), []).append(entity)
+		if entity.is_alive:
+			self._actor_buckets.setdefault(self._bucket_of(entity.x, entity.y), {})[entity] = None
+		self._count_costs(entity, entity.x, entity.y, 1)
+
+	def _unindex(self, entity: Entity, x: int, y: int) -> None:
+		cell = self._cells.get((x, y))
+		if cell is not None:
+			cell.remove(entity)
+			if not cell:
+				del self._cells[x, y]
+		bucket = self._actor_buckets.get(self._bucket_of(x, y))
+		if bucket is not None:
+			bucket.pop(entity, None)
+			if not bucket:
+				del self._actor_buckets[self._bucket_of(x, y)]
+		self._count_costs(entity, x, y, -1)
+
+	def _count_costs(self, entity: Entity, x: int, y: int, amount: int) -> None:
+		counted = False
+		if entity.blocks_movement:
+			self._blocker_count[x, y] += amount
+			counted = True
+		if not entity.is_alive and entity.could_live:
+			self._corpse_count[x, y] += amount
+			counted = True
+		if counted:
+			self._entity_costs_changed(x, y)
+
+	@staticmethod
+	def _bucket_of(x: int, y: int) -> Tuple[int, int]:
+		return x // BUCKET_SIZE, y // BUCKET_SIZE
+
+	def _get_ids(self) -> np.ndarray:
+		#store ids of self.entities in order, gathered again only after one was added or removed
+		if self._ids is None:
+			self._entity_list = list(self.entities)
+			self._ids = np.fromiter(
+				(entity.id for entity in self._entity_list), dtype=np.intp, count=len(self._entity_list))
+		return self._ids
+	###########################################################
+
+	def get_entities_at_location(self, x: int, y: int) -> List[Entity]:
+		return list(self._cells.get((x, y), ()))
+
+	def get_items_at_location(self, x: int, y: int) -> List[Item]:
+		return [entity for entity in self._cells.get((x, y), ()) if isinstance(entity, Item)]
+
 	def get_blocking_entity_at_location(
 		self, location_x: int, location_y: int,
 		) -> Optional[Entity]:
 
-		for entity in self.entities:
-			if (entity.blocks_movement
-			and entity.x == location_x
-			and entity.y == location_y):
+		for entity in self._cells.get((location_x, location_y), ()):
+			if entity.blocks_movement:
 				return entity
 
 		return None
 
 	def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
-		for actor in self.actors:
-			if actor.x == x and actor.y == y:
-				return actor
+		for entity in self._cells.get((x, y), ()):
+			if isinstance(entity, Actor) and entity.is_alive:
+				return entity
+
+		return None
+
+	def _living_in_radius(
+		self, x: int, y: int, radius: float, bounds: Optional[Region] = None,
+		) -> Tuple[List[Actor], np.ndarray, np.ndarray]:
+		"""
+		Living actors at most radius from x, y, with their store ids and distances.
+		Only the buckets overlapping the radius (and 'bounds', if given) are looked at,
+		the distances are then worked out for their actors in one go.
+		"""
+		x0, y0, x1, y1 = bounds or (0, 0, self.width, self.height)
+		bucket_x1, bucket_y1 = self._bucket_of(int(max(x - radius, x0)), int(max(y - radius, y0)))
+		bucket_x2, bucket_y2 = self._bucket_of(int(min(x + radius, x1 - 1)), int(min(y + radius, y1 - 1)))
+
+		candidates: List[Actor] = []
+		for bucket_x in range(bucket_x1, bucket_x2 + 1):
+			for bucket_y in range(bucket_y1, bucket_y2 + 1):
+				candidates.extend(self._actor_buckets.get((bucket_x, bucket_y), ()))
+		ids = np.fromiter((actor.id for actor in candidates), dtype=np.intp, count=len(candidates))
+		dx, dy = STORE.x[ids] - x, STORE.y[ids] - y
+		distance = np.sqrt(dx * dx + dy * dy)
+		found = np.flatnonzero(distance <= radius)
+		return [candidates[index] for index in found.tolist()], ids[found], distance[found]
+
+	def get_actors_in_radius(self, x: int, y: int, radius: float) -> List[Actor]:
+		#living actors whose distance from x, y is at most radius
+		return self._living_in_radius(x, y, radius)[0]
 
+	def get_visible_actors_in_radius(
+		self, x: int, y: int, radius: float = math.inf, exclude: Optional[Entity] = None
+		) -> List[Tuple[Actor, float]]:
+		#living actors in fov at most radius from x, y with their distances, nearest first
+		if self.visible_bounds is None:
+			return []
+		actors, ids, distance = self._living_in_radius(x, y, radius, self.visible_bounds)
+		shown = np.flatnonzero(self.visible[STORE.x[ids], STORE.y[ids]])
+		order = shown[np.argsort(distance[shown], kind="stable")]
+		return [(actors[index], far) for index, far in zip(order.tolist(), distance[order].tolist()) if actors[index] is not exclude]
+
+	def get_nearest_visible_actor(
+		self, x: int, y: int, maximum_range: float, exclude: Optional[Entity] = None
+		) -> Optional[Actor]:
+		#closest living actor in fov within maximum_range, ties go to whoever was found first
+		for actor, distance in self.get_visible_actors_in_radius(x, y, maximum_range + 1.0, exclude):
+			if distance < maximum_range + 1.0:
+				return actor
 		return None
 
 
+	#pathfinding costs##########################################
+	def tiles_changed(self, region: Optional[Region] = None) -> None:
+		#call after writing to self.tiles so cached path costs and the map layer get rebuilt, None is the whole map
+		self.tiles_version += 1
+		x0, y0, x1, y1 = (0, 0, self.width, self.height) if region is None else region
+		area = np.s_[max(x0, 0):min(x1, self.width), max(y0, 0):min(y1, self.height)]
+		transparent = self.tiles["transparent"][area]
+		if not np.array_equal(transparent, self._transparent[area]):
+			self._transparent[area] = transparent
+			self.transparency_version += 1
+		self.mark_dirty(region)
+
+	def clear_caches(self) -> None:
+		#drops the path costs, graphs and fields of view, they are rebuilt when next needed
+		self._base_costs.clear()
+		self._cost_overlays.clear()
+		self.fov.clear()
+
+	def explored_changed(self, region: Optional[Region] = None) -> None:
+		self.explored_version += 1
+		self.mark_dirty(region)
+
+	def set_visible(self, visible: np.ndarray, bounds: Optional[Region] = None) -> Optional[Region]:
+		#replaces what the player can see, returns the region that changed. 'bounds' holds all of visible if known
+		self.visible_bounds = changed_region(visible) if bounds is None else bounds
+		region = changed_region(visible != self.visible)
+		if region is not None:
+			self.visible[:] = visible
+			self.mark_dirty(region)
+		return region
+
+	def get_base_cost(self, cheat: bool = True) -> np.ndarray:
+		"""
+		Walkable tiles as path costs, 1 to walk and 0 for blocked.
+		Without cheating anything not yet explored is assumed to be walkable.
+		Shared between callers, so it must not be written to.
+		"""
+		version = (self.tiles_version, 0 if cheat else self.explored_version)
+		cached = self._base_costs.get(cheat)
+		if cached is not None and cached[0] == version:
+			return cached[1]
+
+		if cheat: cost = np.array(self.tiles["walkable"], dtype=np.int32, order="F")
+		else: cost = np.asfortranarray(np.where(self.explored, self.tiles["walkable"], 1).astype(np.int32))
+
+		self._base_costs[cheat] = (version, cost)
+		return cost
+
+	def get_path_cost(self, blockCost: int = 0, corpseCost: int = 0, cheat: bool = True) -> np.ndarray:
+		"""
+		Path cost with the blockCost and corpseCost of every entity added on.
+		Built once per profile then kept in step as entities move, it is only rebuilt
+		when the tiles (or for non cheating paths, the explored area) change.
+		"""
+		return self._get_cost_overlay(blockCost, corpseCost, cheat)[1]
+
+	def get_path_graph(self, blockCost: int = 0, corpseCost: int = 0, cheat: bool = True) -> tcod.path.SimpleGraph:
+		#the graph reads its cost array in place, so it stays valid as the overlay is patched
+		overlay = self._get_cost_overlay(blockCost, corpseCost, cheat)
+		if overlay[2] is None:
+			overlay[2] = tcod.path.SimpleGraph(cost=overlay[1], cardinal=2, diagonal=3)
+		return overlay[2]
+
+	def _get_cost_overlay(self, blockCost: int, corpseCost: int, cheat: bool) -> list:
+		key = (blockCost, corpseCost, cheat)
+		version = (self.tiles_version, 0 if cheat else self.explored_version)
+		overlay = self._cost_overlays.get(key)
+		if overlay is not None and overlay[0] == version:
+			return overlay
+
+		base = self.get_base_cost(cheat)
+		""" Add to the cost of a blocked position.
+		Low number will mean they will croud together to take shortest route
+		High number will encorage longer paths to surround the player
+		Low corpse cost will have ai walk over corspes.
+		High cost will have ai avoid corpses, maybe avoiding traps."""
+		cost = np.where(
+			base > 0, base + self._blocker_count * blockCost + self._corpse_count * corpseCost, 0
+			).astype(np.int32, order="F")
+
+		overlay = [version, cost, None]
+		self._cost_overlays[key] = overlay
+		return overlay
+
+	def _entity_costs_changed(self, x: int, y: int) -> None:
+		#patch the one cell in every cached overlay rather than rebuilding them
+		self.entities_version += 1
+		for (blockCost, corpseCost, cheat), overlay in self._cost_overlays.items():
+			base = self._base_costs[cheat][1]
+			if base[x, y] > 0:
+				overlay[1][x, y] = (base[x, y]
+					+ self._blocker_count[x, y] * blockCost
+					+ self._corpse_count[x, y] * corpseCost)
+	###########################################################
+
 	def in_bounds(self, x: int, y: int) -> bool:
 		#true if x and y are in bounds of map
 		return 0 <= x < self.width and 0 <= y < self.height
 
+	#rendering##################################################
+	def mark_dirty(self, region: Optional[Region] = None) -> None:
+		#the map layer is recomposited inside region on the next render, None is the whole map
+		if region is None:
+			region = (0, 0, self.width, self.height)
+		x0, y0, x1, y1 = max(region[0], 0), max(region[1], 0), min(region[2], self.width), min(region[3], self.height)
+		if x0 >= x1 or y0 >= y1:
+			return
+		if self._map_dirty is not None:
+			dx0, dy0, dx1, dy1 = self._map_dirty
+			x0, y0, x1, y1 = min(x0, dx0), min(y0, dy0), max(x1, dx1), max(y1, dy1)
+		self._map_dirty = (x0, y0, x1, y1)
+
 	def render(self, console: Console) -> None:
 		"""
 		Renders the map.
@@ -78,19 +408,33 @@ class GameMap:
 		If a title is in the visible array then draw it with the light colors
 		If it isnt but is in the explored array, draw it dark - 
 		Otherwise, draw it with shroud.
+		Only the dirty region of the map layer is worked out again, the rest is copied as is.
 		"""
-		console.tiles_rgb[0 : self.width, 0 : self.height] = np.select(
-			condlist=[self.visible, self.explored],
-			choicelist=[self.tiles["light"], self.tiles["dark"]],
-			default=tile_types.SHROUD,
-		)
-
-		entities_sorted_for_rendering = sorted(
-			self.entities, key=lambda x: x.render_order.value)
-
-		#renders each entity
-		for entity in entities_sorted_for_rendering:
-			#only print entities in FOV(Make true for ai debug)
-			if self.visible[entity.x, entity.y]:
-				console.print(
-					x=entity.x, y=entity.y, string=entity.char, fg=entity.color)
\ No newline at end of file
+		if self._map_dirty is not None:
+			x0, y0, x1, y1 = self._map_dirty
+			area = np.s_[x0:x1, y0:y1]
+			self._map_layer[area] = np.select(
+				condlist=[self.visible[area], self.explored[area]],
+				choicelist=[self.tiles["light"][area], self.tiles["dark"][area]],
+				default=tile_types.SHROUD,
+			)
+			self._map_dirty = None
+
+		console.tiles_rgb[0 : self.width, 0 : self.height] = self._map_layer
+
+		#renders each entity, corpses then items then actors, only in FOV(Make true for ai debug)
+		tiles = console.tiles_rgb
+		for order in RenderOrder:
+			x, y, ch, fg = self._get_render_arrays(order)
+			shown = self.visible[x, y]
+			tiles["ch"][x[shown], y[shown]] = ch[shown]
+			tiles["fg"][x[shown], y[shown]] = fg[shown]
+
+	def _get_render_arrays(self, order: RenderOrder) -> Tuple[np.ndarray, ...]:
+		#positions, glyphs and colors of a render order bucket, gathered from the store again only after it changed
+		arrays = self._render_arrays[order]
+		if arrays is None:
+			bucket = self._render_buckets[order]
+			ids = np.fromiter((entity.id for entity in bucket), dtype=np.intp, count=len(bucket))
+			arrays = self._render_arrays[order] = (STORE.x[ids], STORE.y[ids], STORE.char[ids], STORE.color[ids])
+		return arrays
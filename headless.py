@@ -0,0 +1,18 @@
+"""
+Headless mode runs the game with no window, no audio and no animation playback,
+for driving the Engine from scripts, tests, bots and benchmarks.
+
+It is on when BIOWEAPONS_HEADLESS is set to anything but 0, or after enable() is called.
+"""
+import os
+
+_headless = os.environ.get("BIOWEAPONS_HEADLESS", "0") not in ("", "0")
+
+
+def enable(on: bool = True) -> None:
+	global _headless
+	_headless = on
+
+
+def is_headless() -> bool:
+	return _headless
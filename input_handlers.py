@@ -3,18 +3,21 @@ from __future__ import annotations
 from typing import Callable, Tuple, Optional, TYPE_CHECKING
 import tcod
 import math
+import time
 
 import actions
 from actions import (
 	Action,
 	BumpAction,
 	PickupAction,
+	TakeStairsAction,
 	WaitAction,
 	QuickAccess
 	)
 
 import color
 import exceptions
+import instrumentation
 import sound_engine
 import animation_engine
 
@@ -70,9 +73,10 @@ CONFIRM_KEYS = {
 
 
 class EventHandler(tcod.event.EventDispatch[Action]):
+	frameRate = 0 #frames per second this handler animates at, 0 if it only changes on input
+
 	def __init__(self, engine: Engine):
 		self. engine = engine
-		self.unlock = False
 
 	def handle_events(self, event: tcod.event.Event) -> None:
 		self.handle_action(self.dispatch(event))
@@ -83,19 +87,27 @@ class EventHandler(tcod.event.EventDispatch[Action]):
 		if action is None:
 			return False
 
-		try:
-			action.perform()
-		except exceptions.Impossible as exc:
-			self.engine.message_log.add_message(exc.args[0], color.impossible, makePing=False)
-			self.engine.sound_engine.emitSound(sound_engine.error_sound)
-			return False
+		if self.engine.recorder is not None:
+			self.engine.recorder.record_action(action, self.engine)
 
-		if action.freeAction:
-			return False
+		#everything heard this turn is played together once it resolves
+		with self.engine.sound_engine.turn():
+			try:
+				with instrumentation.span("turn.player"):
+					action.perform()
+			except exceptions.Impossible as exc:
+				self.engine.message_log.add_message(exc.args[0], color.impossible, makePing=False)
+				self.engine.sound_engine.emitSound(sound_engine.error_sound)
+				return False
+
+			if action.freeAction:
+				return False
 
-		self.engine.handle_enemy_turns()
+			self.engine.handle_enemy_turns()
 
-		self.engine.update_fov()
+			self.engine.update_fov()
+		if self.engine.autosaver is not None:
+			self.engine.autosaver.turn_ended()
 		return True
 
 	def ev_mousemotion(self, event: tcod.event.MouseMotion) -> None:
@@ -242,6 +254,8 @@ class QuickAccessHandler(InventoryEventHandler):
 	FOREGROUND = (240, 255, 240)
 
 	def on_item_selected(self, item: Item) -> None:
+		if self.engine.recorder is not None:
+			self.engine.recorder.record_bind(item, self.engine)
 		self.engine.player.inventory.quickAccess = item
 		self.engine.event_handler = MainGameEventHandler(self.engine)
 		self.engine.message_log.add_message(f"{item.name} bound to F key.")
@@ -253,27 +267,31 @@ class QuickAccessHandler(InventoryEventHandler):
 
 class SelectIndexHandler(AskUserEventHandler):
 	"""handles asking user for index (location) on map"""
+	frameRate = 30
+	PULSE_LOW, PULSE_HIGH = 230, 255
+	PULSE_SPEED = 60
+	pulseOffset = 0 #starts bright and dims
 
 	def __init__(self, engine: Engine):
 		"""sets cursor to player when handler is made"""
 		super().__init__(engine)
 		player = self.engine.player
 		engine.mouse_location = player.x, player.y
-		self.color = 255
-		self.flipColor = True
-		self.unlock = True
+		self.pulseStart = time.perf_counter()
+
+	def pulse_color(self) -> int:
+		#bounces between PULSE_LOW and PULSE_HIGH by PULSE_SPEED steps a second, starting at pulseOffset
+		span = self.PULSE_HIGH - self.PULSE_LOW
+		step = (int((time.perf_counter() - self.pulseStart) * self.PULSE_SPEED) + self.pulseOffset) % (2 * span)
+		return self.PULSE_HIGH - step if step <= span else self.PULSE_LOW + step - span
 
 	def on_render(self, console: tcod.Console) -> None:
 		#highlight cursor tile
 		super().on_render(console)
 		x, y = self.engine.mouse_location
-		clampColor = max(min(self.color, 255), 0)
+		clampColor = self.pulse_color()
 		console.tiles_rgb["bg"][x, y] = (clampColor,clampColor,clampColor)
 		console.tiles_rgb["fg"][x, y] = color.black
-		if self.flipColor: self.color -= 1
-		else: self.color += 1
-		if self.color >= 255: self.flipColor = True
-		if self.color <= 230: self.flipColor = False
 
 	def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[Actions]:
 		#check for key movement or confermation keys
@@ -332,6 +350,8 @@ class SingleRangedAttackHandler(SelectIndexHandler):
 
 class AreaRangedAttackHandler(SelectIndexHandler):
 	"""Handles targeting area with given radius - anthing in the area is affected."""
+	PULSE_SPEED = 120
+	pulseOffset = 25 #starts dim and brightens
 	def __init__(
 		self,
 		engine: Engine,
@@ -342,15 +362,12 @@ class AreaRangedAttackHandler(SelectIndexHandler):
 
 		self.radius = radius
 		self.callback = callback
-		self.color = 230
-		self.flipColor = True
-		self.unlock = True
 
 	def on_render(self, console: tcod.Console) -> None:
 		super().on_render(console)
 
 		x, y = self.engine.mouse_location
-		clampColor = max(min(self.color, 255), 0)
+		clampColor = self.pulse_color()
 
 		#draw the effected area with pulsing red so player can see what is affected
 		radius = self.radius
@@ -363,10 +380,6 @@ class AreaRangedAttackHandler(SelectIndexHandler):
 						console.tiles_rgb["fg"][targetx, targety] = color.black
 		console.tiles_rgb["bg"][x, y] = color.white
 		console.tiles_rgb["fg"][x, y] = color.black
-		if self.flipColor: self.color -= 1
-		else: self.color += 1
-		if self.color >= 255: self.flipColor = True
-		if self.color <= 230: self.flipColor = False
 
 
 	def on_index_selected(self, x: int, y: int) -> Optional[Action]:
@@ -386,6 +399,8 @@ class MainGameEventHandler(EventHandler):
 		if key in MOVE_KEYS:
 			dx, dy = MOVE_KEYS[key]
 			action = BumpAction(player, dx, dy)
+		elif key in (tcod.event.K_PERIOD, tcod.event.K_COMMA) and event.mod & (tcod.event.KMOD_LSHIFT | tcod.event.KMOD_RSHIFT):
+			action = TakeStairsAction(player) # > and < keys
 		elif key in WAIT_KEYS:
 			action = WaitAction(player)
 		elif key == tcod.event.K_ESCAPE:
@@ -405,6 +420,8 @@ class MainGameEventHandler(EventHandler):
 			action = QuickAccess(player.inventory.quickAccess, self.engine)
 		elif key == tcod.event.K_r:
 			self.engine.event_handler = QuickAccessHandler(self.engine)
+		elif key == tcod.event.K_F3:
+			self.engine.toggle_perf_overlay()
 
 
 		#no vaild key is pressed
@@ -469,29 +486,36 @@ class HistoryViewer(EventHandler):
 
 	def __init__(self, engine: Engine):
 		super().__init__(engine)
-		self.log_length = len(engine.message_log.messages)
+		self.log_length = engine.message_log.total
 		self.cursor = self.log_length - 1
+		#the history is drawn into its own console, again only when the cursor moves
+		self.log_console: Optional[tcod.Console] = None
+		self.rendered_cursor: Optional[int] = None
 
 	def on_render(self, console: tcod.Console) -> None:
 		super().on_render(console) #draw main state as background
 
-		log_console = tcod.Console(console.width - 6, console.height - 6)
-
-		#draw the frame with custom banner title
-		log_console.draw_frame(0, 0, log_console.width, log_console.height)
-		log_console.print_box(
-			0, 0, log_console.width, 1, "┤Message History├", alignment=tcod.CENTER
-			)
-
-		#render the message log with the cursor
-		self.engine.message_log.render_messages(
-			log_console,
-			1,
-			1,
-			log_console.width - 2,
-			log_console.height - 2,
-			self.engine.message_log.messages[: self.cursor + 1],
-			)
+		if self.log_console is None:
+			self.log_console = tcod.Console(console.width - 6, console.height - 6)
+		log_console = self.log_console
+
+		if self.rendered_cursor != self.cursor:
+			#draw the frame with custom banner title
+			log_console.draw_frame(0, 0, log_console.width, log_console.height)
+			log_console.print_box(
+				0, 0, log_console.width, 1, "┤Message History├", alignment=tcod.CENTER
+				)
+
+			#render the message log with the cursor, paging older messages in from the journal
+			self.engine.message_log.render_messages(
+				log_console,
+				1,
+				1,
+				log_console.width - 2,
+				log_console.height - 2,
+				self.engine.message_log.history(self.cursor),
+				)
+			self.rendered_cursor = self.cursor
 		log_console.blit(console, 3, 3)
 
 	def ev_keydown(self, event: tcod.event.KeyDown) -> None:
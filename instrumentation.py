@@ -0,0 +1,104 @@
+"""
+Lightweight timing spans for the performance overlay.
+
+	with instrumentation.span("frame.map"):
+		...
+
+While disabled span() hands back one shared do-nothing context manager,
+so leaving spans in hot code costs next to nothing.
+"""
+from __future__ import annotations
+
+from collections import deque
+import time
+from typing import Deque, Dict, Optional
+
+#how many samples each span keeps for its rolling average
+WINDOW = 60
+
+enabled = False
+timings: Dict[str, Deque[float]] = {}
+_frame_times: Deque[float] = deque(maxlen=WINDOW)
+_frame_cpu: Deque[float] = deque(maxlen=WINDOW)
+
+
+class _Span:
+	__slots__ = ("name", "start")
+
+	def __init__(self, name: str) -> None:
+		self.name = name
+
+	def __enter__(self) -> _Span:
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		record(self.name, time.perf_counter() - self.start)
+
+
+class _NullSpan:
+	__slots__ = ()
+
+	def __enter__(self) -> _NullSpan:
+		return self
+
+	def __exit__(self, *exc) -> None:
+		pass
+
+_NULL_SPAN = _NullSpan()
+
+
+def set_enabled(on: bool) -> None:
+	global enabled
+	enabled = on
+	if not on:
+		timings.clear()
+		_frame_times.clear()
+		_frame_cpu.clear()
+
+
+def span(name: str):
+	if not enabled:
+		return _NULL_SPAN
+	return _Span(name)
+
+
+def record(name: str, seconds: float) -> None:
+	if not enabled:
+		return
+	samples = timings.get(name)
+	if samples is None:
+		samples = timings[name] = deque(maxlen=WINDOW)
+	samples.append(seconds)
+
+
+def last(name: str) -> Optional[float]:
+	samples = timings.get(name)
+	return samples[-1] if samples else None
+
+
+def average(name: str) -> Optional[float]:
+	samples = timings.get(name)
+	return sum(samples) / len(samples) if samples else None
+
+
+def mark_frame() -> None:
+	#call once per presented frame, frames_per_second is worked out from these
+	if enabled:
+		_frame_times.append(time.perf_counter())
+		_frame_cpu.append(time.process_time())
+
+
+def frames_per_second() -> float:
+	if len(_frame_times) < 2:
+		return 0.0
+	elapsed = _frame_times[-1] - _frame_times[0]
+	return (len(_frame_times) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+def cpu_usage() -> float:
+	#share of one core the process used over the last frames, 1.0 is a core flat out
+	if len(_frame_times) < 2:
+		return 0.0
+	elapsed = _frame_times[-1] - _frame_times[0]
+	return (_frame_cpu[-1] - _frame_cpu[0]) / elapsed if elapsed > 0 else 0.0
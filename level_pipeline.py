@@ -0,0 +1,177 @@
+"""
+Generates upcoming dungeon levels ahead of time.
+
+Level n of a game is always generated from derive_seed(game seed, n), so it
+comes out the same wherever it is made. LevelPipeline keeps the next few
+levels generating in worker processes, each sends back a LevelData: the
+tiles as indices into a small palette plus one spawn record per entity.
+Descending then only has to rebuild the GameMap from that, which is quick
+no matter how long the level took to generate.
+"""
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import random
+import time
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+import headless
+
+if TYPE_CHECKING:
+	from engine import Engine
+	from game_map import GameMap
+
+#how many levels below the current one are kept generating
+LEVEL_LOOKAHEAD = 2
+
+spawn_dt = np.dtype([("prototype", np.uint16), ("x", np.int16), ("y", np.int16)])
+
+
+def derive_seed(seed: int, depth: int) -> int:
+	#string seeds are hashed the same way every run, unlike tuples
+	return random.Random(f"{seed}/{depth}").getrandbits(32)
+
+
+class LevelData:
+	"""A generated level without the player, small enough to send between processes."""
+	def __init__(
+		self,
+		depth: int,
+		seed: int,
+		palette: np.ndarray,
+		tile_index: np.ndarray,
+		rooms: np.ndarray,
+		prototypes: List[str],
+		spawns: np.ndarray,
+		player_xy: Tuple[int, int],
+		downstairs_location: Tuple[int, int],
+		):
+		self.depth = depth
+		self.seed = seed
+		self.palette = palette #every distinct tile on the level
+		self.tile_index = tile_index #uint8 index into palette per cell
+		self.rooms = rooms #x1, y1, x2, y2 per room
+		self.prototypes = prototypes #entity_factories names used by the spawns
+		self.spawns = spawns #spawn_dt record per entity
+		self.player_xy = player_xy
+		self.downstairs_location = downstairs_location
+
+	@classmethod
+	def from_game_map(cls, game_map: GameMap, player_xy: Tuple[int, int], depth: int, seed: int) -> LevelData:
+		palette, tile_index = np.unique(game_map.tiles, return_inverse=True)
+		tile_index = tile_index.reshape(game_map.tiles.shape).astype(np.uint8)
+
+		rooms = np.array([(room.x1, room.y1, room.x2, room.y2) for room in game_map.rooms or ()], dtype=np.int16)
+
+		player = game_map.engine.player
+		prototypes: Dict[str, int] = {}
+		entities = [entity for entity in game_map.entities if entity is not player]
+		spawns = np.zeros(len(entities), dtype=spawn_dt)
+		for index, entity in enumerate(entities):
+			if entity.prototype_id is None:
+				raise ValueError(f"{entity.name} was not spawned from a prototype.")
+			spawns[index] = (prototypes.setdefault(entity.prototype_id, len(prototypes)), entity.x, entity.y)
+
+		return cls(depth, seed, palette, tile_index, rooms, list(prototypes), spawns, player_xy, game_map.downstairs_location)
+
+	def build(self, engine: Engine) -> GameMap:
+		#a GameMap of this level with the engines player moved onto it
+		from entity import spawn_batch
+		from entity_factories import PROTOTYPES
+		from game_map import GameMap
+		from procgen import RectangularRoom
+		import tile_types
+
+		width, height = self.tile_index.shape
+		game_map = GameMap(engine, width, height)
+		game_map.tiles[:] = self.palette[self.tile_index]
+		game_map.rooms = [RectangularRoom(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in self.rooms.tolist()]
+		game_map.downstairs_location = self.downstairs_location
+		if self.depth > 1:
+			#the way back up is where the player arrives
+			game_map.upstairs_location = self.player_xy
+			game_map.tiles[self.player_xy] = tile_types.up_stairs
+
+		prototypes = [PROTOTYPES[name] for name in self.prototypes]
+		spawn_batch(game_map, [(prototypes[prototype], x, y) for prototype, x, y in self.spawns.tolist()])
+
+		engine.player.place(*self.player_xy, game_map)
+		game_map.tiles_changed()
+		return game_map
+
+
+def generate_level(seed: int, depth: int, settings: dict) -> LevelData:
+	"""Generates level 'depth' with its own headless engine, this is what the worker processes run."""
+	from engine import Engine
+	import entity_factories
+	from procgen import generate_dungeon
+
+	level_seed = derive_seed(seed, depth)
+	engine = Engine(player=entity_factories.player.instantiate(), headless=True, seed=level_seed)
+	game_map = generate_dungeon(**settings, engine=engine)
+	level = LevelData.from_game_map(game_map, engine.player.xy, depth, level_seed)
+	#only the spawn records are kept, when run in this process the entities rows are wanted back
+	game_map.release_entities()
+	engine.player.release()
+	return level
+
+
+class LevelPipeline:
+	"""
+	Keeps the 'lookahead' levels below the current one generating in the background.
+	With 'workers' 0 levels are generated in this process when they are taken instead.
+	"""
+	def __init__(self, seed: int, settings: dict, lookahead: int = LEVEL_LOOKAHEAD, workers: Optional[int] = None) -> None:
+		self.seed = seed
+		self.settings = settings
+		self.lookahead = lookahead
+		self.workers = lookahead if workers is None else workers
+		self.executor: Optional[ProcessPoolExecutor] = None
+		self.pending: Dict[int, Future] = {}
+		#levels taken, how many had to be waited for and how long in total
+		self.stats = {"taken": 0, "waited": 0, "wait_seconds": 0.0}
+
+	def prefetch(self, depth: int) -> None:
+		#starts generating the levels below 'depth' that arent already
+		if self.workers <= 0:
+			return
+		if self.executor is None:
+			#spawned rather than forked, so workers dont inherit the window or the mixer
+			self.executor = ProcessPoolExecutor(
+				max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=headless.enable)
+		for next_depth in range(depth + 1, depth + self.lookahead + 1):
+			if next_depth not in self.pending:
+				self.pending[next_depth] = self.executor.submit(generate_level, self.seed, next_depth, self.settings)
+
+	def ready(self, depth: int) -> bool:
+		future = self.pending.get(depth)
+		return future is not None and future.done()
+
+	def take(self, depth: int) -> LevelData:
+		#level 'depth', waiting for it only if it isnt generated yet
+		start = time.perf_counter()
+		future = self.pending.pop(depth, None)
+		if future is None:
+			self.stats["waited"] += 1
+			level = generate_level(self.seed, depth, self.settings)
+		else:
+			if not future.done():
+				self.stats["waited"] += 1
+			level = future.result()
+		self.stats["wait_seconds"] += time.perf_counter() - start
+		self.stats["taken"] += 1
+
+		#levels above this one will never be asked for
+		for stale in [pending for pending in self.pending if pending <= depth]:
+			self.pending.pop(stale).cancel()
+		self.prefetch(depth)
+		return level
+
+	def close(self) -> None:
+		if self.executor is not None:
+			self.executor.shutdown(wait=False, cancel_futures=True)
+			self.executor = None
+		self.pending.clear()
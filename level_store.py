@@ -0,0 +1,354 @@
+"""
+Keeps the levels the player has left, cheaper the longer ago they were left.
+
+The HOT_LEVELS most recently left levels are kept as they are. Older ones are
+packed into a PackedLevel: the tiles as indices into a palette, the explored
+mask bit-packed, and the entities as a table of prototype and position with
+the positions delta-encoded, plus whatever state each entity no longer shares
+with its prototype, all zlib compressed. Beyond WARM_LEVELS packed levels the
+oldest are written out to disk. Going back to a level unpacks it into a fresh
+GameMap, so memory stays flat however deep the player goes.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import io
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
+import zlib
+
+import numpy as np
+
+from entity import Entity
+
+if TYPE_CHECKING:
+	from engine import Engine
+	from game_map import GameMap
+
+#levels kept as they are, and how many more are kept packed in memory before spilling to disk
+HOT_LEVELS = 2
+WARM_LEVELS = 6
+
+#components an entity may carry, diffed against the prototypes one by one
+COMPONENTS = ("ai", "fighter", "inventory", "ailments", "consumable")
+#back references that are rebuilt rather than stored
+SKIPPED = ("parent", "entity", "x", "y")
+
+#prototype index of an entity that wasnt spawned from one, its state is the whole entity
+NO_PROTOTYPE = 0xFFFF
+
+entity_dt = np.dtype([("prototype", np.uint16), ("dx", np.int16), ("dy", np.int16)])
+
+
+def _attributes(obj: Any) -> Dict[str, Any]:
+	#an entitys store row comes along as plain values, so its set back with set_fields
+	fields = obj.fields() if isinstance(obj, Entity) else vars(obj)
+	return {name: value for name, value in fields.items() if name not in SKIPPED and name not in COMPONENTS}
+
+
+def _diff(obj: Any, prototype: Any) -> Dict[str, Any]:
+	#attributes of obj that differ from prototype
+	base = _attributes(prototype)
+	changed = {}
+	for name, value in _attributes(obj).items():
+		if name not in base or base[name] != value:
+			changed[name] = value
+	return changed
+
+
+def entity_delta(entity: Entity, prototype: Entity) -> Optional[Dict[str, Dict[str, Any]]]:
+	"""
+	What sets 'entity' apart from a fresh spawn of 'prototype', or None if nothing does.
+	Keyed by component name, "" for the entity itself.
+	"""
+	delta = {}
+	changed = _diff(entity, prototype)
+	for name in COMPONENTS:
+		component, base = getattr(entity, name, None), getattr(prototype, name, None)
+		if component is None and base is None:
+			continue
+		if component is None or base is None or type(component) is not type(base):
+			#swapped or removed outright, like the ai of the dead
+			changed[name] = component
+			continue
+		component_changed = _diff(component, base)
+		if component_changed:
+			delta[name] = component_changed
+	if changed:
+		delta[""] = changed
+	return delta or None
+
+
+class _StatePickler(pickle.Pickler):
+	#refers to the map, the player and the levels entities and their components by token instead of pickling them
+	def __init__(self, file: io.BytesIO, game_map: GameMap, indices: Dict[Entity, int]) -> None:
+		super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.game_map = game_map
+		self.indices = indices
+		self.components = {
+			id(getattr(entity, name)): (index, name)
+			for entity, index in indices.items() for name in COMPONENTS if getattr(entity, name, None) is not None
+			}
+
+	def persistent_id(self, obj: Any) -> Optional[Tuple]:
+		if obj is self.game_map:
+			return ("map",)
+		if obj is self.game_map.engine:
+			return ("engine",)
+		if isinstance(obj, Entity):
+			if obj is self.game_map.engine.player:
+				return ("player",)
+			index = self.indices.get(obj)
+			if index is not None:
+				return ("entity", index)
+		component = self.components.get(id(obj))
+		if component is not None:
+			return ("component", *component)
+		return None
+
+
+class _StateUnpickler(pickle.Unpickler):
+	def __init__(self, file: io.BytesIO, game_map: GameMap, entities: List[Optional[Entity]]) -> None:
+		super().__init__(file)
+		self.game_map = game_map
+		self.entities = entities
+
+	def persistent_load(self, pid: Tuple) -> Any:
+		kind = pid[0]
+		if kind == "map":
+			return self.game_map
+		if kind == "engine":
+			return self.game_map.engine
+		if kind == "player":
+			return self.game_map.engine.player
+		if kind == "component":
+			return getattr(self.entities[pid[1]], pid[2])
+		return self.entities[pid[1]]
+
+
+class PackedLevel:
+	"""A left level squeezed down to compressed buffers, unpack turns it back into a GameMap."""
+	def __init__(self, game_map: GameMap) -> None:
+		from entity_factories import PROTOTYPES
+
+		self.width, self.height = game_map.width, game_map.height
+		palette, tile_index = np.unique(game_map.tiles, return_inverse=True)
+		self.palette = palette
+		self.tiles = zlib.compress(tile_index.reshape(game_map.tiles.shape).astype(np.uint8).tobytes(order="F"))
+		self.explored = zlib.compress(np.packbits(game_map.explored.ravel(order="F")).tobytes())
+		self.rooms = np.array([(room.x1, room.y1, room.x2, room.y2) for room in game_map.rooms or ()], dtype=np.int16)
+		self.downstairs_location = game_map.downstairs_location
+		self.upstairs_location = game_map.upstairs_location
+
+		player = game_map.engine.player
+		entities = [entity for entity in game_map.entities if entity is not player]
+		#entities kept whole are pickled as they are rather than referred to
+		indices = {entity: index for index, entity in enumerate(entities) if entity.prototype_id in PROTOTYPES}
+		prototypes: Dict[str, int] = {}
+		table = np.zeros(len(entities), dtype=entity_dt)
+		deltas: List[Any] = []
+		last_x = last_y = 0
+		for index, entity in enumerate(entities):
+			prototype = PROTOTYPES.get(entity.prototype_id)
+			if prototype is None:
+				table[index] = (NO_PROTOTYPE, entity.x - last_x, entity.y - last_y)
+				deltas.append(entity)
+			else:
+				table[index] = (prototypes.setdefault(entity.prototype_id, len(prototypes)), entity.x - last_x, entity.y - last_y)
+				deltas.append(entity_delta(entity, prototype))
+			last_x, last_y = entity.x, entity.y
+		self.prototypes = list(prototypes)
+		self.entities = zlib.compress(table.tobytes())
+
+		buffer = io.BytesIO()
+		_StatePickler(buffer, game_map, indices).dump(deltas)
+		self.state = zlib.compress(buffer.getvalue())
+
+	@classmethod
+	def restore(cls, **fields: Any) -> PackedLevel:
+		#a PackedLevel from the attributes of one, as savegame reads them back
+		level = cls.__new__(cls)
+		vars(level).update(fields)
+		return level
+
+	@property
+	def nbytes(self) -> int:
+		return len(self.tiles) + len(self.explored) + len(self.entities) + len(self.state) + self.palette.nbytes + self.rooms.nbytes
+
+	def unpack(self, engine: Engine) -> GameMap:
+		from entity_factories import PROTOTYPES
+		from game_map import GameMap
+		from procgen import RectangularRoom
+
+		game_map = GameMap(engine, self.width, self.height)
+		tile_index = np.frombuffer(zlib.decompress(self.tiles), dtype=np.uint8).reshape((self.width, self.height), order="F")
+		game_map.tiles[:] = self.palette[tile_index]
+		explored = np.unpackbits(np.frombuffer(zlib.decompress(self.explored), dtype=np.uint8), count=self.width * self.height)
+		game_map.explored[:] = explored.reshape((self.width, self.height), order="F")
+		game_map.rooms = [RectangularRoom(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in self.rooms.tolist()]
+		game_map.downstairs_location = self.downstairs_location
+		game_map.upstairs_location = self.upstairs_location
+
+		table = np.frombuffer(zlib.decompress(self.entities), dtype=entity_dt)
+		xs = np.cumsum(table["dx"], dtype=np.int64).tolist()
+		ys = np.cumsum(table["dy"], dtype=np.int64).tolist()
+		prototypes = [PROTOTYPES[name] for name in self.prototypes]
+		#copied first so the state can refer to any of them, and only added to the map once its applied
+		entities: List[Optional[Entity]] = [
+			None if prototype == NO_PROTOTYPE else prototypes[prototype].instantiate()
+			for prototype in table["prototype"].tolist()
+			]
+
+		deltas = _StateUnpickler(io.BytesIO(zlib.decompress(self.state)), game_map, entities).load()
+		for index, delta in enumerate(deltas):
+			entity = entities[index]
+			if entity is None:
+				#kept whole
+				entity = entities[index] = delta
+			elif delta is not None:
+				for name, changed in delta.items():
+					if name == "":
+						entity.set_fields(changed)
+						continue
+					target = getattr(entity, name)
+					for attribute, value in changed.items():
+						setattr(target, attribute, value)
+		for entity, x, y in zip(entities, xs, ys):
+			entity.x, entity.y = x, y
+			entity.parent = game_map
+		game_map.add_entities(entities)
+
+		game_map.tiles_changed()
+		return game_map
+
+
+class LevelStore:
+	"""
+	The levels the player has left by depth, most recently left last.
+	Each is a GameMap, a PackedLevel or the path of a spilled one.
+	"""
+	def __init__(self, hot: int = HOT_LEVELS, warm: int = WARM_LEVELS) -> None:
+		self.hot = hot
+		self.warm = warm
+		self.levels: OrderedDict[int, Union[GameMap, PackedLevel, str]] = OrderedDict()
+		#made when the first level spills
+		self.spill_dir: Optional[tempfile.TemporaryDirectory] = None
+		#spilled files an autosave is still reading, and the ones among them taken back meanwhile
+		self.pinned: Dict[str, int] = {}
+		self.released: List[str] = []
+		self.lock = threading.Lock()
+		#hot levels packed for a save, kept until they are taken back since nothing changes on them meanwhile
+		self.packed: Dict[int, PackedLevel] = {}
+		self.stats = {"packed": 0, "spilled": 0, "hot_hits": 0, "warm_hits": 0, "cold_hits": 0}
+
+	def __contains__(self, depth: int) -> bool:
+		return depth in self.levels
+
+	def counts(self) -> Tuple[int, int, int]:
+		#how many levels are hot, packed and on disk
+		hot = sum(1 for level in self.levels.values() if not isinstance(level, (PackedLevel, str)))
+		cold = sum(1 for level in self.levels.values() if isinstance(level, str))
+		return hot, len(self.levels) - hot - cold, cold
+
+	def put(self, depth: int, game_map: GameMap) -> None:
+		#keeps a level the player just left, cooling off older ones
+		game_map.clear_caches()
+		self.levels[depth] = game_map
+		self.levels.move_to_end(depth)
+		self._cool()
+
+	def restore(self, depth: int, level: PackedLevel) -> None:
+		#puts back a level read from a save, oldest first, spilling past 'warm' the same as put
+		self.levels[depth] = level
+		self.levels.move_to_end(depth)
+		self._cool()
+
+	def _cool(self) -> None:
+		#packs the levels past 'hot' and spills the packed ones past 'warm', most recently left kept warmest
+		hot = warm = 0
+		for stored, level in reversed(list(self.levels.items())):
+			if isinstance(level, str):
+				continue
+			if not isinstance(level, PackedLevel):
+				hot += 1
+				if hot <= self.hot:
+					continue
+				packed = self.packed.pop(stored, None)
+				self.levels[stored] = packed if packed is not None else PackedLevel(level)
+				#only the packed copy is kept, so the maps entities leave the game
+				level.release_entities()
+				level = self.levels[stored]
+				self.stats["packed"] += 1
+			warm += 1
+			if warm > self.warm:
+				self.levels[stored] = self.spill(stored, level)
+
+	def spill(self, depth: int, level: PackedLevel) -> str:
+		if self.spill_dir is None:
+			self.spill_dir = tempfile.TemporaryDirectory(prefix="bioweapons-levels-")
+		#numbered, so a file still pinned by an autosave is never overwritten
+		path = os.path.join(self.spill_dir.name, f"level{depth}-{self.stats['spilled']}.bin")
+		with open(path, "wb") as file:
+			pickle.dump(level, file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.stats["spilled"] += 1
+		return path
+
+	def take(self, depth: int, engine: Engine) -> Optional[GameMap]:
+		#level 'depth' as a GameMap ready to play on, None if it was never left
+		level = self.levels.pop(depth, None)
+		self.packed.pop(depth, None)
+		if level is None:
+			return None
+		if isinstance(level, str):
+			with open(level, "rb") as file:
+				packed = pickle.load(file)
+			with self.lock:
+				if level in self.pinned:
+					self.released.append(level)
+				else:
+					os.remove(level)
+			self.stats["cold_hits"] += 1
+			return packed.unpack(engine)
+		if isinstance(level, PackedLevel):
+			self.stats["warm_hits"] += 1
+			return level.unpack(engine)
+		self.stats["hot_hits"] += 1
+		return level
+
+	def snapshot(self) -> Dict[int, Union[PackedLevel, str]]:
+		#every stored level as a PackedLevel or the path it spilled to, for savegame
+		levels: Dict[int, Union[PackedLevel, str]] = {}
+		for depth, level in self.levels.items():
+			if not isinstance(level, (PackedLevel, str)):
+				packed = self.packed.get(depth)
+				if packed is None:
+					packed = self.packed[depth] = PackedLevel(level)
+				level = packed
+			levels[depth] = level
+		return levels
+
+	def pin(self, paths: List[str]) -> None:
+		#keeps spilled files around until unpin, even if their levels are taken back
+		with self.lock:
+			for path in paths:
+				self.pinned[path] = self.pinned.get(path, 0) + 1
+
+	def unpin(self, paths: List[str]) -> None:
+		with self.lock:
+			for path in paths:
+				self.pinned[path] -= 1
+				if not self.pinned[path]:
+					del self.pinned[path]
+					if path in self.released:
+						self.released.remove(path)
+						os.remove(path)
+
+	def close(self) -> None:
+		self.levels.clear()
+		self.packed.clear()
+		if self.spill_dir is not None:
+			self.spill_dir.cleanup()
+			self.spill_dir = None
@@ -1,39 +1,113 @@
  #!/usr/bin/env python3
 #library import##################
 import tcod
-import copy
+import os
+import random
 import traceback
 import time
+from typing import Optional
 ###############################
 #more of my code imports
 ###################################################
-from engine import Engine
+from engine import Engine, SCREEN_WIDTH, SCREEN_HEIGHT
 import entity_factories
 from procgen import generate_dungeon
 from sound_engine import error_sound
 import color
+import headless
+import instrumentation
+import replay
+import savegame
+from level_pipeline import LevelPipeline, LEVEL_LOOKAHEAD
 
 import animation_engine
 
 ###################################################
 
-def main() -> None:
-	#game settings
-	screen_width = 96 
-	screen_height = 54 
+#game settings
+MAP_SETTINGS = dict(
+	map_width = 80,
+	map_height = 45,
+
+	room_max_size = 10,
+	room_min_size = 6,
+	max_rooms = 15,
+	min_rooms = 12,
+
+	max_monsters_per_room = 4, #4
+	min_monsters_per_room = 2, #2
+	max_items_per_room = 3, #2 3
+	min_items_per_room = 0,
+)
+
+def new_game(
+	headless_mode: bool = None, seed: int = None, record_path: str = None, animation_mode: str = None,
+	level_workers: int = None, **settings
+	) -> Engine:
+	"""
+	Makes an engine with a freshly generated dungeon.
+	'settings' override MAP_SETTINGS, 'headless_mode', 'animation_mode' and 'seed' are passed on to Engine.
+	If 'record_path' is given the session is recorded there for replay.py.
+	'level_workers' is how many processes generate the levels below, headless games default to none
+	and generate each level when it is reached.
+	"""
+	settings = {**MAP_SETTINGS, **settings}
+
+	player = entity_factories.player.instantiate()
+
+	engine = Engine(player=player, headless=headless_mode, animation_mode=animation_mode, seed=seed)
+	if record_path:
+		engine.recorder = replay.Recorder(record_path, seed=engine.seed, settings=settings)
 
-	map_width = 80
-	map_height = 45
+	engine.game_map = generate_dungeon(
+		max_rooms=settings["max_rooms"],
+		min_rooms=settings["min_rooms"],
+		room_min_size=settings["room_min_size"],
+		room_max_size=settings["room_max_size"],
+		map_width=settings["map_width"],
+		map_height=settings["map_height"],
+		max_monsters_per_room=settings["max_monsters_per_room"],
+		min_monsters_per_room=settings["min_monsters_per_room"],
+		max_items_per_room=settings["max_items_per_room"],
+		min_items_per_room=settings["min_monsters_per_room"],
+		engine=engine
+		)
 
-	room_max_size = 10
-	room_min_size = 6
-	max_rooms = 15
-	min_rooms = 12
+	if level_workers is None: level_workers = 0 if engine.headless else LEVEL_LOOKAHEAD
+	engine.levels = LevelPipeline(engine.seed, settings, lookahead=LEVEL_LOOKAHEAD, workers=level_workers)
+	engine.levels.prefetch(engine.depth)
 
-	max_monsters_per_room = 4 #4
-	min_monsters_per_room = 2 #2
-	max_items_per_room = 3 #2 3
-	min_items_per_room = 0
+	engine.update_fov()
+
+	engine.message_log.add_message(
+		"This is pre alpha gameplay, and subject to change. Welcome!", color.welcome_text, makePing = False)
+
+	return engine
+
+def run_headless(turns: int) -> None:
+	"""
+	Plays 'turns' turns with a player that wanders at random, drawing each one offscreen.
+	Needs no display or audio device, mostly useful to check the game runs and how fast.
+	"""
+	from actions import BumpAction
+
+	engine = new_game(headless_mode=True)
+	start = time.perf_counter()
+	for turn in range(turns):
+		if not engine.player.is_alive:
+			break
+		engine.event_handler.handle_action(
+			BumpAction(engine.player, random.choice((-1, 0, 1)), random.choice((-1, 0, 1))))
+		engine.render_offscreen()
+	elapsed = time.perf_counter() - start
+	print(f"{turn + 1} turns in {elapsed:.2f}s ({(turn + 1) / elapsed:.0f} turns/s)")
+
+def main() -> None:
+	if headless.is_headless():
+		return run_headless(int(os.environ.get("BIOWEAPONS_HEADLESS_TURNS", "1000")))
+
+	screen_width = SCREEN_WIDTH
+	screen_height = SCREEN_HEIGHT
 
 	#TARGET_FPS = 600
 
@@ -43,28 +117,18 @@ def main() -> None:
 		"dejavu16x16_gs_tc.png", 32, 8, tcod.tileset.CHARMAP_TCOD
 	)
 
-	player = copy.deepcopy(entity_factories.player)
-
-	engine = Engine(player=player)
-
-	engine.game_map = generate_dungeon(
-		max_rooms=max_rooms,
-		min_rooms=min_rooms,
-		room_min_size=room_min_size,
-		room_max_size=room_max_size,
-		map_width=map_width,
-		map_height=map_height,
-		max_monsters_per_room=max_monsters_per_room,
-		min_monsters_per_room=min_monsters_per_room,
-		max_items_per_room=max_items_per_room,
-		min_items_per_room=min_monsters_per_room,
-		engine=engine
-		)
-
-	engine.update_fov()
-
-	engine.message_log.add_message(
-		"This is pre alpha gameplay, and subject to change. Welcome!", color.welcome_text, makePing = False)
+	#carry on from the autosave if there is one, recordings always start a new game
+	record_path = os.environ.get("BIOWEAPONS_RECORD")
+	engine = None
+	if not record_path and os.path.exists(savegame.SAVE_PATH):
+		try:
+			engine = savegame.load(savegame.SAVE_PATH)
+			engine.message_log.add_message("Welcome back.", color.welcome_text, makePing=False)
+		except (savegame.SaveError, OSError, ValueError, KeyError) as exc:
+			print(f"Could not load {savegame.SAVE_PATH}: {exc}")
+	if engine is None:
+		engine = new_game(record_path=record_path)
+	engine.autosaver = savegame.Autosaver(engine)
 
 
 	with tcod.context.new_terminal(
@@ -79,28 +143,58 @@ def main() -> None:
 
 
 
-		while True:
+		try:
+			deadline = time.perf_counter()
+			while True:
+
+				root_console.clear()
+				engine.event_handler.on_render(console=root_console)
+				with instrumentation.span("frame.present"):
+					context.present(root_console)
+				instrumentation.mark_frame()
+
+				#wait for input, or while something animates until the next frame is due
+				frame_rate = engine.frame_rate
+				if frame_rate:
+					deadline = max(deadline + 1 / frame_rate, time.perf_counter())
+					pump_events(context, engine, deadline)
+				else:
+					pump_events(context, engine, None)
+		finally:
+			#dont leave level generation running behind a closed window, or spilled levels on disk
+			engine.autosaver.close()
+			engine.levels.close()
+			engine.level_store.close()
+			#a gzipped recording only gets its end of stream marker on close
+			if engine.recorder is not None:
+				engine.recorder.close()
+
+
+def pump_events(context: tcod.context.Context, engine: Engine, deadline: Optional[float]) -> None:
+	"""
+	Handles events until 'deadline' (a time.perf_counter time) passes.
+	With no deadline it blocks for the first batch of events and returns after handling it.
+	"""
+	while True:
+		timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+		eventHolder = tcod.event.wait(timeout)
 
-			root_console.clear()
-			engine.event_handler.on_render(console=root_console)
-			context.present(root_console)
+		try:
+			for event in eventHolder:
+				context.convert_event(event)
+				engine.event_handler.handle_events(event)
+		except Exception:
+			traceback.print_exc()
+			#makes error noise
+			engine.sound_engine.emitSound(error_sound)
+			#print the error to the message log
+			engine.message_log.add_message(traceback.format_exc(), color.error, makePing = False)
 
-			if engine.locking: eventHolder = tcod.event.wait()
-			else: eventHolder = tcod.event.get()
+		if deadline is None or time.perf_counter() >= deadline:
+			return
 
-			try:
-				for event in eventHolder: #used to be wait instead of get
-					context.convert_event(event)
-					engine.event_handler.handle_events(event)
-			except Exception:
-				traceback.print_exc()
-				#makes error noise
-				engine.sound_engine.emitSound(error_sound)
-				#print the error to the message log
-				engine.message_log.add_message(traceback.format_exc(), color.error, makePing = False)
 
 
-			
 
 #bottem of program
 if __name__ == "__main__":
@@ -108,4 +202,4 @@ if __name__ == "__main__":
 
 
 #shops between levels, ranged enemie, reduce enemies?, all shopkeepers are same person, optional dialoge.
-#slow regen for enemies? on last floor enemies can res.
\ No newline at end of file
+#slow regen for enemies? on last floor enemies can res.
@@ -0,0 +1,63 @@
+"""
+Append-only on-disk journal of the message log.
+
+Every message is one JSON line, [text, [r, g, b], count], written once its
+stack count can no longer change. The byte offset of each line is kept in an
+index so any message can be read back with one seek, which lets the history
+viewer page through tens of thousands of messages while only a recent window
+of them stays in memory.
+
+Without a path the journal is an anonymous temporary file, gone once closed.
+"""
+from __future__ import annotations
+
+from array import array
+from collections import OrderedDict
+import json
+import tempfile
+from typing import IO, Optional, Tuple
+
+#how many messages read back from disk are kept decoded
+READ_CACHE_SIZE = 256
+
+
+class MessageJournal:
+	def __init__(self, path: Optional[str] = None) -> None:
+		self.path = path
+		self.file: IO[bytes] = open(path, "w+b") if path else tempfile.TemporaryFile("w+b")
+		#byte offset of every written message, by message number
+		self.offsets = array("q")
+		self.end = 0
+		self.unflushed = False
+		self.read_cache: OrderedDict = OrderedDict()
+
+	def __len__(self) -> int:
+		return len(self.offsets)
+
+	def append(self, text: str, fg: Tuple[int, int, int], count: int) -> None:
+		line = json.dumps([text, list(fg), count], separators=(",", ":")).encode() + b"\n"
+		self.file.seek(self.end)
+		self.file.write(line)
+		self.offsets.append(self.end)
+		self.end += len(line)
+		self.unflushed = True
+
+	def read(self, index: int) -> Tuple[str, Tuple[int, int, int], int]:
+		#(text, fg, count) of message number 'index'
+		cached = self.read_cache.get(index)
+		if cached is not None:
+			self.read_cache.move_to_end(index)
+			return cached
+
+		if self.unflushed:
+			self.file.flush()
+			self.unflushed = False
+		self.file.seek(self.offsets[index])
+		text, fg, count = json.loads(self.file.readline())
+		cached = self.read_cache[index] = (text, tuple(fg), count)
+		if len(self.read_cache) > READ_CACHE_SIZE:
+			self.read_cache.popitem(last=False)
+		return cached
+
+	def close(self) -> None:
+		self.file.close()
@@ -1,4 +1,5 @@
-from typing import Iterable, List, Reversible, Tuple
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Reversible, Tuple
 import textwrap
 
 import tcod
@@ -8,12 +9,18 @@ import color
 import sound_engine
 
 import animation_engine
+from message_journal import MessageJournal
+
+#how many recent messages the log keeps in memory, older ones are only in the journal
+MESSAGE_LOG_CAPACITY = 1000
 
 class Message:
 	def __init__(self, text: str, fg: Tuple[int, int, int]):
 		self.plain_text = text
 		self.fg = fg
 		self.count = 1
+		#width -> (count when wrapped, wrapped lines)
+		self._wrapped: Dict[int, Tuple[int, List[str]]] = {}
 
 	@property
 	def full_text(self) -> str:
@@ -21,12 +28,50 @@ class Message:
 		if self.count > 1:
 			return f"{self.plain_text} (x{self.count})"
 		return self.plain_text
+
+	def wrapped(self, width: int) -> List[str]:
+		#full_text wrapped to width, only wrapped again when the stack count changes
+		cached = self._wrapped.get(width)
+		if cached is None or cached[0] != self.count:
+			cached = self._wrapped[width] = (self.count, list(MessageLog.wrap(self.full_text, width)))
+		return cached[1]
 	
+class MessageHistory:
+	#messages up to and including number 'end', read newest first when reversed like render_messages does
+	def __init__(self, log: "MessageLog", end: int) -> None:
+		self.log = log
+		self.end = end
+
+	def __reversed__(self) -> Iterator[Message]:
+		for index in range(self.end, -1, -1):
+			yield self.log.get_message(index)
+
 class MessageLog:
-	def __init__(self, engine) -> None:
-		self.messages: List[Message] = []
+	def __init__(self, engine, capacity: int = MESSAGE_LOG_CAPACITY, journal_path: Optional[str] = None) -> None:
+		#a ring of the recent messages, adding past capacity drops the oldest one
+		self.messages: Deque[Message] = deque(maxlen=capacity)
+		#every message but the last, which can still stack, see message_journal
+		self.journal = MessageJournal(journal_path)
 		self.parent = engine
 
+	@property
+	def total(self) -> int:
+		#how many messages there have been, including the ones only in the journal
+		return len(self.journal) + (1 if self.messages else 0)
+
+	def get_message(self, index: int) -> Message:
+		#message number 'index', from memory if it is recent enough, else from the journal
+		start = self.total - len(self.messages)
+		if index >= start:
+			return self.messages[index - start]
+		text, fg, count = self.journal.read(index)
+		message = Message(text, fg)
+		message.count = count
+		return message
+
+	def history(self, end: int) -> MessageHistory:
+		return MessageHistory(self, end)
+
 	def add_message(
 		self, text: str, fg: Tuple[int, int, int] = color.white, *, stack: bool = True, makePing: bool = True,
 		) -> None:
@@ -38,6 +83,9 @@ class MessageLog:
 		if stack and self.messages and text == self.messages[-1].plain_text:
 			self.messages[-1].count += 1
 		else:
+			if self.messages:
+				last = self.messages[-1]
+				self.journal.append(last.plain_text, last.fg, last.count)
 			self.messages.append(Message(text, fg))
 
 		#self.parent.animation_engine.emitAnimation(animation_engine.FrameLight(color=fg, sides={"t":False,"b":False,"l":True,"r":True}))
@@ -46,6 +94,16 @@ class MessageLog:
 		if makePing:
 			self.parent.sound_engine.emitSound(sound_engine.new_message)
 
+	def restore(self, messages: Iterable[Tuple[str, Tuple[int, int, int], int]]) -> None:
+		#puts back saved (text, fg, count) messages oldest first, journalled the same way add_message does
+		for text, fg, count in messages:
+			if self.messages:
+				last = self.messages[-1]
+				self.journal.append(last.plain_text, last.fg, last.count)
+			message = Message(text, tuple(fg))
+			message.count = count
+			self.messages.append(message)
+
 	def render(
 		self, console: tcod.Console, x: int, y: int, width: int, height: int,
 		) -> None:
@@ -79,7 +137,7 @@ class MessageLog:
 		y_offset = height - 1
 
 		for message in reversed(messages):
-			for line in reversed(list(cls.wrap(message.full_text, width))):
+			for line in reversed(message.wrapped(width)):
 				console.print(x=x, y=y + y_offset, string=line, fg=message.fg)
 				y_offset -= 1
 				if y_offset < 0:
@@ -4,6 +4,7 @@ import random
 from typing import Iterator, Tuple, TYPE_CHECKING
 
 import entity_factories
+from entity import spawn_batch
 from game_map import GameMap
 import tile_types
 from tile_types import new_tile
@@ -46,54 +47,62 @@ class RectangularRoom:
 def place_entities(
 	room: RectangularRoom, dungeon: GameMap,  maximum_monsters: int,  maximum_items: int, minimum_items: int = 0, minimum_monsters: int = 0, forceSpawn: List[Items] = None
 	) -> None:
-	number_of_monsters = random.randint(minimum_monsters, maximum_monsters)
-	number_of_items = random.randint(minimum_items, maximum_items)
+	rng = dungeon.engine.rng
+	number_of_monsters = rng.randint(minimum_monsters, maximum_monsters)
+	number_of_items = rng.randint(minimum_items, maximum_items)
+
+	#everything is picked first and spawned in one batch, 'taken' keeps the picks off each other
+	spawns = []
+	taken = set()
 
 	i = 0
 	while i in range(number_of_monsters):
-		x = random.randint(room.x1 + 1, room.x2 -1)
-		y = random.randint(room.y1 + 1, room.y2 - 1)
+		x = rng.randint(room.x1 + 1, room.x2 -1)
+		y = rng.randint(room.y1 + 1, room.y2 - 1)
 
-		if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
-			if random.random() < 0.8:
-				entity_factories.infected.spawn(dungeon, x, y)
-				i += 1
+		if (x, y) not in taken and not dungeon.get_entities_at_location(x, y):
+			if rng.random() < 0.8:
+				spawns.append((entity_factories.infected, x, y))
 			else:
-				entity_factories.infectedGunner.spawn(dungeon, x, y)
-				i += 1
+				spawns.append((entity_factories.infectedGunner, x, y))
+			taken.add((x, y))
+			i += 1
 	i = 0
 	while i in range(number_of_items):
-		x = random.randint(room.x1 + 1, room.x2 -1)
-		y = random.randint(room.y1 + 1, room.y2 - 1)
-		if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
-			random.choice(entity_factories.standeredLootTable).spawn(dungeon, x, y)
+		x = rng.randint(room.x1 + 1, room.x2 -1)
+		y = rng.randint(room.y1 + 1, room.y2 - 1)
+		if (x, y) not in taken and not dungeon.get_entities_at_location(x, y):
+			spawns.append((rng.choice(entity_factories.standeredLootTable), x, y))
+			taken.add((x, y))
 			i += 1
 
-	if forceSpawn == None: return
-
-	for Item in forceSpawn:
+	for Item in forceSpawn or ():
 		spawned = False
 		while spawned == False:
-			x = random.randint(room.x1 + 1, room.x2 -1)
-			y = random.randint(room.y1 + 1, room.y2 - 1)
-			if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
-				Item.spawn(dungeon, x, y)
+			x = rng.randint(room.x1 + 1, room.x2 -1)
+			y = rng.randint(room.y1 + 1, room.y2 - 1)
+			if (x, y) not in taken and not dungeon.get_entities_at_location(x, y):
+				spawns.append((Item, x, y))
+				taken.add((x, y))
 				spawned = True
 
+	spawn_batch(dungeon, spawns)
+
 def blood_stains(new_room: RectangularRoom, dungeon: GameMap):
+	rng = dungeon.engine.rng
 
 	#rolls to add bloodstains to rooms floor
-	if random.randint(0,6) == 0:
+	if rng.randint(0,6) == 0:
 
-		stainX = random.randint(new_room.x1+1, new_room.x2-1)
-		stainY = random.randint(new_room.y1+1, new_room.y2-1)
+		stainX = rng.randint(new_room.x1+1, new_room.x2-1)
+		stainY = rng.randint(new_room.y1+1, new_room.y2-1)
 
 		dungeon.tiles[stainX, stainY] = tile_types.bloodyFloor
 
 		bloodSplatter = 0
-		while bloodSplatter in range(0,random.randint(2,4)):
-			stainModX = random.choice((+1,0,-1))
-			stainModY = random.choice((+1,0,-1))
+		while bloodSplatter in range(0,rng.randint(2,4)):
+			stainModX = rng.choice((+1,0,-1))
+			stainModY = rng.choice((+1,0,-1))
 			if not dungeon.tiles[stainX+stainModX,stainY+stainModY] in [tile_types.bloodyFloor, tile_types.wall]:
 				dungeon.tiles[stainX+stainModX,stainY+stainModY] = tile_types.bloodyFloor
 				bloodSplatter += 1
@@ -101,15 +110,15 @@ def blood_stains(new_room: RectangularRoom, dungeon: GameMap):
 
 def tunnel_between(
 	start: Tuple[int, int], end: Tuple[int, int],
-	size = "1x", order = "ran"
+	size = "1x", order = "ran", rng: random.Random = random
 ) -> Iterator[Tuple[int, int]]:
 	#if size is random, pick a random size
 	if size == "ra":
-		size = random.choice(("1x","2xT","2xB","3x"))
+		size = rng.choice(("1x","2xT","2xB","3x"))
 
 	#if order is random, pick one
 	if order == "ran":
-		order = random.choice(("htv", "vth"))
+		order = rng.choice(("htv", "vth"))
 
 
 	x1, y1 = start
@@ -212,6 +221,7 @@ def generate_dungeon(
 	engine: Engine,
 	) -> GameMap:
 	#makes a dungeon map
+	rng = engine.rng
 	player = engine.player
 	dungeon = GameMap(engine, map_width, map_height, entities=[player])
 
@@ -220,11 +230,11 @@ def generate_dungeon(
 	bonusAttempts = 0
 	r = 0
 	while r in range(max_rooms) or len(rooms) < min_rooms:
-		room_width = random.randint(room_min_size, room_max_size)
-		room_height = random.randint(room_min_size, room_max_size)
+		room_width = rng.randint(room_min_size, room_max_size)
+		room_height = rng.randint(room_min_size, room_max_size)
 
-		x = random.randint(0, dungeon.width - room_width - 1)
-		y = random.randint(0, dungeon.height - room_height - 1)
+		x = rng.randint(0, dungeon.width - room_width - 1)
+		y = rng.randint(0, dungeon.height - room_height - 1)
 
 		#our rect room class to make this easy
 		new_room = RectangularRoom(x, y, room_width, room_height)
@@ -246,7 +256,7 @@ def generate_dungeon(
 
 		else:
 			#dig a tunnel between this room and last one
-			for x, y in tunnel_between(rooms[-1].center, new_room.center, "ra"):
+			for x, y in tunnel_between(rooms[-1].center, new_room.center, "ra", rng=rng):
 				dungeon.tiles[x, y] = tile_types.floor
 
 			#rolls to add bloodstains
@@ -273,4 +283,8 @@ def generate_dungeon(
 	# 		light=(ord(chr(65 + i)), (255, 255, 255), (160, 172, 172)))
 
 	dungeon.rooms = rooms
+	#the way down is in the last room dug
+	dungeon.downstairs_location = rooms[-1].center
+	dungeon.tiles[dungeon.downstairs_location] = tile_types.down_stairs
+	dungeon.tiles_changed()
 	return dungeon
\ No newline at end of file
@@ -1,14 +1,18 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import Optional, Tuple, TYPE_CHECKING
+import tcod
 
+import animation_engine
 import color
+import instrumentation
 
 import render_order
 
 if TYPE_CHECKING:
 	from tcod import Console
 	from engine import engine
+	from entity import Actor
 	from game_map import GameMap
 
 def get_names_at_location(x: int, y: int, game_map: GameMap) -> str:
@@ -16,7 +20,7 @@ def get_names_at_location(x: int, y: int, game_map: GameMap) -> str:
 		return ""
 
 	names = ", ".join(
-		entity.name for entity in game_map.entities if entity.x == x and entity.y == y
+		entity.name for entity in game_map.get_entities_at_location(x, y)
 		)
 
 	return names#.capitalize()
@@ -60,17 +64,97 @@ def render_names_at_mouse_location(
 	console.print(x=x, y=y, string=names_at_mouse_location, fg=(0,0,0), bg=(200,200,200))
 
 def render_enviroment_hud(
-	console: Console, actorsVisible, engine: Engine, x: int, y: int, width: int, height: int):
+	console: Console, actorsVisible, hovered: Optional[Actor], x: int, y: int, width: int, height: int):
 		yy = y
-		for actor in actorsVisible:
+		for actor, statLine in actorsVisible:
 			if yy+4 in range(y, y+height):
-				mouse_x, mouse_y = engine.mouse_location
-				if engine.game_map.get_actor_at_location(mouse_x, mouse_y) == actor:
+				if hovered == actor:
 					console.draw_frame(x, yy, width=width, height=4, title=actor.name, fg=(200,255,200), bg=(0,0,0))
 				else:
 					console.draw_frame(x, yy, width=width, height=4, title=actor.name, fg=(200,200,200), bg=(0,0,0))
 				render_bar(
 					console=console, current_value=actor.fighter.hp, maximum_value=actor.fighter.max_hp,total_width=width-2,x=x+1,y=yy+1)
-				console.print(x+1, yy+2, f"{actor.fighter.power} pwr {actor.fighter.defense} dfnse", fg=(200,200,200))
-
-				yy+=4
\ No newline at end of file
+				console.print(x+1, yy+2, statLine, fg=(200,200,200))
+
+				yy+=4
+
+class EnviromentHud:
+	"""
+	What the Enviroment panel shows, worked out once per turn: the visible actors nearest first
+	with their stat lines, and the heat signature count.
+	The actor frames are drawn into their own console, only again when the hovered actor changes.
+	"""
+	def __init__(self, engine: Engine):
+		player = engine.player
+		game_map = engine.game_map
+
+		#already nearest first
+		visibleEntitiesWithDistance = game_map.get_visible_actors_in_radius(player.x, player.y, exclude=player)
+
+		self.actorsVisible = [
+			(actor, f"{actor.fighter.power} pwr {actor.fighter.defense} dfnse")
+			for actor, distance in visibleEntitiesWithDistance
+			]
+		self.heatSig = game_map.living_actor_count - (1 if player.is_alive and player.gamemap is game_map else 0)
+		self.mouse_location: Optional[Tuple[int, int]] = None
+		self.hovered: Optional[Actor] = None
+		self.panel: Optional[Console] = None
+
+	def render(self, console: Console, engine: Engine, x: int, y: int, width: int, height: int) -> None:
+		if engine.mouse_location != self.mouse_location:
+			self.mouse_location = engine.mouse_location
+			hovered = engine.game_map.get_actor_at_location(*self.mouse_location)
+			if self.panel is None or hovered is not self.hovered:
+				self.hovered = hovered
+				self.panel = None
+
+		if self.panel is None:
+			self.panel = tcod.Console(width, height, order="F")
+			render_enviroment_hud(self.panel, self.actorsVisible, self.hovered, 0, 0, width, height)
+
+		#only the rows with actor frames, the rest of the panel is left as drawn
+		shown = min(len(self.actorsVisible), (height - 1) // 4)
+		if shown:
+			self.panel.blit(console, dest_x=x, dest_y=y, width=width, height=shown * 4)
+
+#(label, span name) rows of the performance overlay
+PERF_OVERLAY_ROWS = (
+	("Turn", None),
+	(" enemies", "turn.enemies"),
+	(" fov", "turn.fov"),
+	(" player", "turn.player"),
+	("Frame", None),
+	(" map", "frame.map"),
+	(" animations", "frame.animations"),
+	(" hud", "frame.hud"),
+	(" present", "frame.present"),
+)
+
+def render_perf_overlay(console: Console, engine: Engine, x: int, y: int, width: int) -> None:
+	#rolling timings from the instrumentation spans, in milliseconds (last/average)
+	height = len(PERF_OVERLAY_ROWS) + 11
+	console.draw_frame(x, y, width=width, height=height, title="Performance", fg=(150,150,150), bg=(0,0,0))
+
+	yy = y + 1
+	for label, name in PERF_OVERLAY_ROWS:
+		if name is None:
+			console.print(x+1, yy, label, fg=(200,200,200))
+		else:
+			last, average = instrumentation.last(name), instrumentation.average(name)
+			timing = "-" if last is None else f"{last*1000:.1f}/{average*1000:.1f}"
+			console.print(x+1, yy, f"{label:<12}{timing:>{width-14}}", fg=(255,255,255))
+		yy += 1
+
+	console.print(x+1, yy+1, f"{'fps':<12}{instrumentation.frames_per_second():>{width-14}.0f}", fg=(255,255,255))
+	console.print(x+1, yy+2, f"{'cpu %':<12}{instrumentation.cpu_usage()*100:>{width-14}.0f}", fg=(255,255,255))
+	console.print(x+1, yy+3, f"{'animations':<12}{len(engine.animation_engine.activeAnimations):>{width-14}}", fg=(255,255,255))
+	console.print(x+1, yy+4, f"{'entities':<12}{len(engine.game_map.entities):>{width-14}}", fg=(255,255,255))
+	templates = animation_engine.templates
+	console.print(x+1, yy+5, f"{'anim cache':<12}{f'{templates.hits}/{templates.misses}':>{width-14}}", fg=(255,255,255))
+	sounds = engine.sound_engine.stats
+	voices = f"{sounds['played']}/{sounds['coalesced']}/{sounds['dropped']}"
+	console.print(x+1, yy+6, f"{'voices':<12}{voices:>{width-14}}", fg=(255,255,255))
+	levels = "/".join(str(count) for count in engine.level_store.counts())
+	console.print(x+1, yy+7, f"{'levels':<12}{levels:>{width-14}}", fg=(255,255,255))
+	fov = engine.game_map.fov
+	console.print(x+1, yy+8, f"{'fov cache':<12}{f'{fov.hits}/{fov.misses}/{fov.skipped}':>{width-14}}", fg=(255,255,255))
@@ -0,0 +1,162 @@
+"""
+Session recording and max speed replay.
+
+A recording is a JSON lines file (gzipped if the name ends in .gz). The first line
+holds the rng seed and map settings, every line after it is one player action:
+	["b", dx, dy]           BumpAction (also "m" MeleeAction, "v" MovementAction)
+	["w"]                   WaitAction
+	["p"]                   PickupAction
+	["s"]                   TakeStairsAction
+	["i", item, x, y]       ItemAction, item is the inventory index
+	["d", item]             DropItem
+	["l", item, firearm]    LoadItem, firearm is the inventory index of the gun
+	["q", item]             item bound to the quick access key
+
+Run `python replay.py recording.jsonl` to replay one headless as fast as possible.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import sys
+import time
+import traceback
+from typing import IO, Iterator, Optional, TYPE_CHECKING
+
+import actions
+
+if TYPE_CHECKING:
+	from engine import Engine
+	from entity import Item
+
+RECORDING_VERSION = 1
+
+#action classes with a direction, by their code in the log
+DIRECTION_ACTIONS = {"b": actions.BumpAction, "m": actions.MeleeAction, "v": actions.MovementAction}
+
+
+def open_log(path: str, mode: str) -> IO[str]:
+	if path.endswith(".gz"):
+		return gzip.open(path, mode + "t")
+	return open(path, mode)
+
+
+class Recorder:
+	def __init__(self, path: str, seed: int, settings: dict) -> None:
+		self.path = path
+		self.file = open_log(path, "w")
+		self.write({"version": RECORDING_VERSION, "seed": seed, "settings": settings})
+
+	def write(self, entry) -> None:
+		self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+		#flushed every line so a crash still leaves a usable recording, see read_entries
+		self.file.flush()
+
+	def record_action(self, action: actions.Action, engine: Engine) -> None:
+		#only the players actions are recorded, everything else follows from them
+		if getattr(action, "entity", None) is not engine.player:
+			return
+		entry = encode_action(action, engine)
+		if entry is not None:
+			self.write(entry)
+
+	def record_bind(self, item: Item, engine: Engine) -> None:
+		self.write(["q", engine.player.inventory.items.index(item)])
+
+	def close(self) -> None:
+		self.file.close()
+
+
+def read_entries(file: IO[str]) -> Iterator[list]:
+	#the entries after the header, a gzipped recording cut off by a crash has every line but no end of stream marker
+	try:
+		for line in file:
+			yield json.loads(line)
+	except EOFError:
+		return
+
+
+def encode_action(action: actions.Action, engine: Engine) -> Optional[list]:
+	items = engine.player.inventory.items
+	#subclasses before their parents
+	if isinstance(action, actions.DropItem):
+		return ["d", items.index(action.item)]
+	if isinstance(action, actions.LoadItem):
+		return ["l", items.index(action.item), items.index(action.targetItem.parent)]
+	if isinstance(action, actions.ItemAction):
+		return ["i", items.index(action.item), *action.target_xy]
+	if isinstance(action, actions.PickupAction):
+		return ["p"]
+	if isinstance(action, actions.WaitAction):
+		return ["w"]
+	if isinstance(action, actions.TakeStairsAction):
+		return ["s"]
+	for code, action_cls in DIRECTION_ACTIONS.items():
+		if type(action) is action_cls:
+			return [code, action.dx, action.dy]
+	#free actions like QuickAccess dont change the game by themselves
+	return None
+
+
+def decode_action(entry: list, engine: Engine) -> actions.Action:
+	player = engine.player
+	items = player.inventory.items
+	code = entry[0]
+	if code in DIRECTION_ACTIONS:
+		return DIRECTION_ACTIONS[code](player, entry[1], entry[2])
+	if code == "w":
+		return actions.WaitAction(player)
+	if code == "p":
+		return actions.PickupAction(player)
+	if code == "s":
+		return actions.TakeStairsAction(player)
+	if code == "i":
+		return actions.ItemAction(player, items[entry[1]], (entry[2], entry[3]))
+	if code == "d":
+		return actions.DropItem(player, items[entry[1]])
+	if code == "l":
+		return actions.LoadItem(player, items[entry[1]], targetItem=items[entry[2]].consumable)
+	raise ValueError(f"Unknown action in recording: {entry!r}")
+
+
+def replay(path: str, headless_mode: bool = True) -> Engine:
+	"""
+	Rebuilds the recorded game and feeds every action through EventHandler.handle_action.
+	Nothing is drawn and, headless, nothing is heard, so it runs as fast as the cpu allows.
+	"""
+	from main import new_game
+
+	with open_log(path, "r") as file:
+		header = json.loads(file.readline())
+		if header.get("version") != RECORDING_VERSION:
+			raise ValueError(f"Recording version {header.get('version')} is not supported.")
+
+		engine = new_game(headless_mode=headless_mode, seed=header["seed"], **header["settings"])
+		for entry in read_entries(file):
+			if entry[0] == "q":
+				engine.player.inventory.quickAccess = engine.player.inventory.items[entry[1]]
+				continue
+			try:
+				engine.event_handler.handle_action(decode_action(entry, engine))
+			except Exception:
+				#the game loop logs errors and carries on, so the replay does too
+				traceback.print_exc()
+	return engine
+
+
+def main() -> None:
+	import headless
+	headless.enable()
+
+	if len(sys.argv) != 2:
+		print(__doc__)
+		raise SystemExit(1)
+
+	start = time.perf_counter()
+	engine = replay(sys.argv[1])
+	elapsed = time.perf_counter() - start
+	print(f"replayed to turn {engine.turn} in {elapsed:.2f}s, player hp {engine.player.fighter.hp}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,408 @@
+"""
+Versioned binary save files, and the autosave that writes them.
+
+A save starts with MAGIC, the format VERSION and the length of a JSON header,
+padded out to ALIGNMENT. Then come raw buffers, each aligned, that the header
+lists by name as [offset, dtype, shape]:
+	tiles, visible, explored  the current GameMap arrays as they are in memory
+	entities                  one entity_dt row per entity on the map, in an
+	                          inventory or loaded into a gun
+	fighters, inventories,    one row per component, pointing at its entity row
+	ailments, ais, consumables
+	rng                       the Mersenne Twister state of engine.rng
+	level<n>/...              the levels in the LevelStore, as PackedLevel buffers
+Entities are rebuilt from their entity_factories prototype with the saved state
+written over it. load maps the file to read the buffers straight out of it,
+copies them and closes it again, so nothing holds the save open while the
+autosave replaces it.
+"""
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import mmap
+import os
+import pickle
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+import color
+from entity_store import STORE
+from level_store import PackedLevel
+
+if TYPE_CHECKING:
+	from engine import Engine
+	from entity import Entity
+
+MAGIC = b"BWSAVE"
+VERSION = 1
+ALIGNMENT = 64
+SAVE_PATH = "savegame.bws"
+#turns between autosaves
+AUTOSAVE_INTERVAL = 20
+
+#where an entity row is kept
+ON_MAP, IN_INVENTORY, IN_GUN = 0, 1, 2
+
+entity_dt = np.dtype([
+	("prototype", np.uint16),
+	("slot", np.uint8), #ON_MAP, IN_INVENTORY or IN_GUN
+	("owner", np.int32), #row of the actor or gun holding it, -1 on the map
+	("x", np.int16),
+	("y", np.int16),
+	("char", np.uint32),
+	("color", np.uint8, 3),
+	("name", np.int32), #index into the headers names
+	("blocks_movement", np.bool_),
+	("render_order", np.uint8),
+	("alive", np.bool_), #has its ai
+	])
+fighter_dt = np.dtype([("entity", np.int32), ("max_hp", np.int32), ("hp", np.int32), ("defense", np.int32), ("power", np.int32)])
+inventory_dt = np.dtype([("entity", np.int32), ("capacity", np.int32), ("quick_access", np.int32)])
+ailments_dt = np.dtype([("entity", np.int32), ("tolerance", np.int32), ("countdown", np.int32)])
+ai_dt = np.dtype([("entity", np.int32), ("seen_player", np.bool_), ("just_seen", np.bool_), ("last_x", np.int16), ("last_y", np.int16)])
+#ammo is -1 for anything but magazines, mag the row of the magazine a gun is loaded with
+consumable_dt = np.dtype([("entity", np.int32), ("ammo", np.int32), ("loaded", np.bool_), ("mag", np.int32)])
+
+#entity_dt fields read straight from the entity store columns of the same name
+STORE_FIELDS = ("x", "y", "char", "color", "blocks_movement", "render_order", "alive")
+
+#PackedLevel attributes stored as buffers, the rest go in the header
+LEVEL_BUFFERS = ("palette", "tiles", "explored", "rooms", "entities", "state")
+
+
+class SaveError(Exception):
+	pass
+
+
+def _entity_rows(engine: Engine) -> List[Tuple[Entity, int, int]]:
+	#(entity, slot, owner row) for everything a save holds, in map order with inventories after their owners
+	rows: List[Tuple[Entity, int, int]] = []
+
+	def add(entity: Entity, slot: int, owner: int) -> None:
+		row = len(rows)
+		rows.append((entity, slot, owner))
+		inventory = getattr(entity, "inventory", None)
+		if inventory is not None:
+			for item in inventory.items:
+				add(item, IN_INVENTORY, row)
+		mag = getattr(getattr(entity, "consumable", None), "mag", None)
+		if mag is not None:
+			add(mag.parent, IN_GUN, row)
+
+	for entity in engine.game_map.entities:
+		add(entity, ON_MAP, -1)
+	return rows
+
+
+class Snapshot:
+	"""
+	Everything a save holds, copied out of the engine on the main thread
+	so that write can run on another one while the game goes on.
+	"""
+	def __init__(self, engine: Engine) -> None:
+		game_map = engine.game_map
+		self.store = engine.level_store
+		self.buffers: Dict[str, np.ndarray] = {
+			"tiles": game_map.tiles.copy(order="F"),
+			"visible": game_map.visible.copy(order="F"),
+			"explored": game_map.explored.copy(order="F"),
+			"rooms": np.array([(room.x1, room.y1, room.x2, room.y2) for room in game_map.rooms or ()], dtype=np.int16),
+			}
+
+		rows = _entity_rows(engine)
+		index = {entity: row for row, (entity, _, _) in enumerate(rows)}
+		prototypes: Dict[str, int] = {}
+		names: Dict[str, int] = {}
+		entities = np.zeros(len(rows), dtype=entity_dt)
+		ids = np.array([entity.id for entity, _, _ in rows], dtype=np.intp)
+		#the fields kept in the entity store are copied column by column
+		for name in STORE_FIELDS:
+			entities[name] = STORE.columns[name][ids]
+		fighters, inventories, ailments, ais, consumables = [], [], [], [], []
+		for row, (entity, slot, owner) in enumerate(rows):
+			if entity.prototype_id is None:
+				raise SaveError(f"{entity.name} was not spawned from a prototype.")
+			entities[row]["prototype"] = prototypes.setdefault(entity.prototype_id, len(prototypes))
+			entities[row]["slot"], entities[row]["owner"] = slot, owner
+			entities[row]["name"] = names.setdefault(entity.name, len(names))
+			fighter = getattr(entity, "fighter", None)
+			if fighter is not None:
+				fighters.append((row, fighter.max_hp, 0, 0, fighter.power))
+			inventory = getattr(entity, "inventory", None)
+			if inventory is not None:
+				inventories.append((row, inventory.capacity, index.get(inventory.quickAccess, -1)))
+			if getattr(entity, "ailments", None) is not None:
+				ailments.append((row, entity.ailments.tolerance, entity.ailments.toleranceCountdown))
+			ai = getattr(entity, "ai", None)
+			if ai is not None:
+				ais.append((row, ai.seenPlayer, ai.justSeen, *ai.lastLocation))
+			consumable = getattr(entity, "consumable", None)
+			if consumable is not None:
+				mag = getattr(consumable, "mag", None)
+				consumables.append((
+					row, getattr(consumable, "ammo", -1), getattr(consumable, "loaded", False),
+					-1 if mag is None else index[mag.parent],
+					))
+		self.buffers["entities"] = entities
+		fighters = np.array(fighters, dtype=fighter_dt)
+		fighters["hp"] = STORE.hp[ids[fighters["entity"]]]
+		fighters["defense"] = STORE.defense[ids[fighters["entity"]]]
+		self.buffers["fighters"] = fighters
+		self.buffers["inventories"] = np.array(inventories, dtype=inventory_dt)
+		self.buffers["ailments"] = np.array(ailments, dtype=ailments_dt)
+		self.buffers["ais"] = np.array(ais, dtype=ai_dt)
+		self.buffers["consumables"] = np.array(consumables, dtype=consumable_dt)
+
+		rng_version, rng_state, gauss_next = engine.rng.getstate()
+		self.buffers["rng"] = np.array(rng_state, dtype=np.uint32)
+
+		#spilled levels are read on the writing thread
+		self.levels: Dict[int, PackedLevel] = {}
+		self.spilled: Dict[int, str] = {}
+		for depth, level in self.store.snapshot().items():
+			if isinstance(level, str):
+				self.spilled[depth] = level
+			else:
+				self.levels[depth] = level
+		self.store.pin(list(self.spilled.values()))
+
+		self.header: Dict[str, Any] = {
+			"version": VERSION,
+			"seed": engine.seed,
+			"turn": engine.turn,
+			"depth": engine.depth,
+			"settings": None if engine.levels is None else engine.levels.settings,
+			"rng": [rng_version, gauss_next],
+			"width": game_map.width,
+			"height": game_map.height,
+			"downstairs_location": game_map.downstairs_location,
+			"upstairs_location": game_map.upstairs_location,
+			"player": index[engine.player],
+			"prototypes": list(prototypes),
+			"names": list(names),
+			"messages": [[message.plain_text, message.fg, message.count] for message in engine.message_log.messages],
+			"levels": {},
+			}
+
+	def write(self, path: str) -> int:
+		"""Writes the save to 'path', through a temporary file so a crash never leaves half of one. Returns its size."""
+		try:
+			levels = dict(self.levels)
+			for depth, spilled in self.spilled.items():
+				with open(spilled, "rb") as file:
+					levels[depth] = pickle.load(file)
+		finally:
+			self.store.unpin(list(self.spilled.values()))
+
+		buffers = dict(self.buffers)
+		header = dict(self.header, levels={})
+		for depth, level in levels.items():
+			fields = dict(vars(level))
+			for name in LEVEL_BUFFERS:
+				value = fields.pop(name)
+				buffers[f"level{depth}/{name}"] = np.frombuffer(value, dtype=np.uint8) if isinstance(value, bytes) else value
+			header["levels"][depth] = fields
+
+		layout = {}
+		offset = 0
+		for name, array in buffers.items():
+			layout[name] = [offset, np.lib.format.dtype_to_descr(array.dtype), list(array.shape)]
+			offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+		header["buffers"] = layout
+
+		encoded = json.dumps(header, separators=(",", ":")).encode()
+		prefix = len(MAGIC) + 8 + len(encoded)
+		padding = -prefix % ALIGNMENT
+		temporary = f"{path}.tmp"
+		with open(temporary, "wb") as file:
+			file.write(MAGIC)
+			file.write(struct.pack("<II", VERSION, len(encoded)))
+			file.write(encoded)
+			file.write(bytes(padding))
+			for name, array in buffers.items():
+				data = array.tobytes(order="F")
+				file.write(data)
+				file.write(bytes(-len(data) % ALIGNMENT))
+		os.replace(temporary, path)
+		return prefix + padding + offset
+
+
+def save(engine: Engine, path: str = SAVE_PATH) -> int:
+	return Snapshot(engine).write(path)
+
+
+def load(
+	path: str = SAVE_PATH, headless_mode: bool = None, animation_mode: str = None, level_workers: int = None,
+	) -> Engine:
+	"""
+	Makes an engine from the save at 'path', the other arguments are as for main.new_game.
+	Raises SaveError if it isnt a save this version can read.
+	"""
+	from engine import Engine
+	from entity_factories import PROTOTYPES
+	from game_map import GameMap
+	from level_pipeline import LevelPipeline, LEVEL_LOOKAHEAD
+	from procgen import RectangularRoom
+
+	with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+		if data[:len(MAGIC)] != MAGIC:
+			raise SaveError(f"{path} is not a save")
+		version, header_length = struct.unpack("<II", data[len(MAGIC):len(MAGIC) + 8])
+		if version != VERSION:
+			raise SaveError(f"{path} is a version {version} save, this game reads version {VERSION}")
+		start = len(MAGIC) + 8
+		header = json.loads(data[start:start + header_length])
+		base = start + header_length
+		base += -base % ALIGNMENT
+
+		#copied out, a view would keep the file mapped and on windows the autosave couldnt replace it
+		buffers: Dict[str, np.ndarray] = {}
+		for name, (offset, descr, shape) in header["buffers"].items():
+			dtype = np.lib.format.descr_to_dtype(descr)
+			buffers[name] = np.ndarray(tuple(shape), dtype=dtype, buffer=data, offset=base + offset, order="F").copy(order="F")
+
+	#entities first, the player has to exist before the engine
+	entities = buffers["entities"]
+	prototypes = [PROTOTYPES[name] for name in header["prototypes"]]
+	names = header["names"]
+	built: List[Entity] = [prototypes[prototype].instantiate() for prototype in entities["prototype"].tolist()]
+	ids = np.array([entity.id for entity in built], dtype=np.intp)
+	for name in STORE_FIELDS:
+		STORE.columns[name][ids] = entities[name]
+	for entity, name, alive in zip(built, entities["name"].tolist(), entities["alive"].tolist()):
+		entity.name = names[name]
+		if not alive and getattr(entity, "ai", None) is not None:
+			entity.ai = None
+
+	fighters = buffers["fighters"]
+	for row, max_hp, power in zip(fighters["entity"].tolist(), fighters["max_hp"].tolist(), fighters["power"].tolist()):
+		built[row].fighter.max_hp, built[row].fighter.power = max_hp, power
+	STORE.hp[ids[fighters["entity"]]] = fighters["hp"]
+	STORE.defense[ids[fighters["entity"]]] = fighters["defense"]
+	for row, tolerance, countdown in buffers["ailments"].tolist():
+		built[row].ailments.tolerance, built[row].ailments.toleranceCountdown = tolerance, countdown
+	for row, seen_player, just_seen, last_x, last_y in buffers["ais"].tolist():
+		ai = built[row].ai
+		ai.seenPlayer, ai.justSeen, ai.lastLocation = seen_player, just_seen, (last_x, last_y)
+	for row, ammo, loaded, mag in buffers["consumables"].tolist():
+		consumable = built[row].consumable
+		if ammo >= 0:
+			consumable.ammo = ammo
+		if hasattr(consumable, "loaded"):
+			consumable.loaded = loaded
+			consumable.mag = None if mag < 0 else built[mag].consumable
+
+	engine = Engine(
+		player=built[header["player"]], headless=headless_mode, animation_mode=animation_mode, seed=header["seed"])
+	rng_version, gauss_next = header["rng"]
+	engine.rng.setstate((rng_version, tuple(buffers["rng"].tolist()), gauss_next))
+	engine.turn = header["turn"]
+	engine.depth = header["depth"]
+
+	game_map = GameMap(engine, header["width"], header["height"])
+	game_map.tiles = buffers["tiles"]
+	game_map.visible = buffers["visible"]
+	game_map.explored = buffers["explored"]
+	game_map.rooms = [RectangularRoom(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in buffers["rooms"].tolist()]
+	game_map.downstairs_location = tuple(header["downstairs_location"])
+	if header["upstairs_location"] is not None:
+		game_map.upstairs_location = tuple(header["upstairs_location"])
+	engine.game_map = game_map
+
+	for (slot, owner), entity in zip(zip(entities["slot"].tolist(), entities["owner"].tolist()), built):
+		if slot == ON_MAP:
+			entity.parent = game_map
+			game_map.add_entity(entity)
+		elif slot == IN_INVENTORY:
+			entity.parent = built[owner].inventory
+			built[owner].inventory.items.append(entity)
+		else:
+			entity.parent = built[owner].parent
+	for row, capacity, quick_access in buffers["inventories"].tolist():
+		built[row].inventory.capacity = capacity
+		built[row].inventory.quickAccess = None if quick_access < 0 else built[quick_access]
+	game_map.tiles_changed()
+
+	for depth, fields in header["levels"].items():
+		for name in LEVEL_BUFFERS:
+			value = buffers[f"level{depth}/{name}"]
+			fields[name] = value.tobytes() if value.dtype == np.uint8 and value.ndim == 1 else value
+		for name in ("downstairs_location", "upstairs_location"):
+			if fields[name] is not None:
+				fields[name] = tuple(fields[name])
+		engine.level_store.restore(int(depth), PackedLevel.restore(**fields))
+
+	engine.message_log.restore(header["messages"])
+
+	if header["settings"] is not None:
+		if level_workers is None: level_workers = 0 if engine.headless else LEVEL_LOOKAHEAD
+		engine.levels = LevelPipeline(engine.seed, header["settings"], lookahead=LEVEL_LOOKAHEAD, workers=level_workers)
+		#the levels already visited come out of the level store
+		engine.levels.prefetch(max([engine.depth, *engine.level_store.levels]))
+
+	engine.update_fov()
+	return engine
+
+
+class Autosaver:
+	"""
+	Saves the game every 'interval' turns. The engine is only copied into a Snapshot
+	on the main thread, the file is written by a background one. If the last save
+	is still being written when the next is due that one is skipped.
+	"""
+	def __init__(self, engine: Engine, path: str = SAVE_PATH, interval: int = AUTOSAVE_INTERVAL) -> None:
+		self.engine = engine
+		self.path = path
+		self.interval = interval
+		self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autosave")
+		self.pending: Optional[Future] = None
+		self.stats = {"saves": 0, "skipped": 0, "snapshot_seconds": 0.0, "write_seconds": 0.0}
+
+	def turn_ended(self) -> None:
+		if not self.engine.player.is_alive:
+			#no coming back from death
+			self.discard()
+			return
+		if self.engine.turn % self.interval:
+			return
+		if self.pending is not None:
+			if not self.pending.done():
+				self.stats["skipped"] += 1
+				return
+			self.check()
+		start = time.perf_counter()
+		snapshot = Snapshot(self.engine)
+		self.stats["snapshot_seconds"] += time.perf_counter() - start
+		self.pending = self.writer.submit(self._write, snapshot)
+
+	def _write(self, snapshot: Snapshot) -> None:
+		start = time.perf_counter()
+		snapshot.write(self.path)
+		self.stats["write_seconds"] += time.perf_counter() - start
+		self.stats["saves"] += 1
+
+	def check(self) -> None:
+		#tells the player if the last autosave failed
+		pending, self.pending = self.pending, None
+		if pending is not None and pending.exception() is not None:
+			self.engine.message_log.add_message(f"Autosave failed: {pending.exception()}", color.error, makePing=False)
+
+	def discard(self) -> None:
+		if self.pending is not None:
+			self.pending.exception()
+			self.pending = None
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+	def close(self) -> None:
+		#saves one last time unless the player died, waiting for it this time
+		if self.pending is not None:
+			self.pending.exception()
+			self.pending = None
+		if self.engine.player.is_alive:
+			save(self.engine, self.path)
+		self.writer.shutdown()
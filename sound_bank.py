@@ -0,0 +1,104 @@
+"""
+Pre-decoded PCM bank of the game's sounds.
+
+	python sound_bank.py [bank file]
+
+decodes every sound registered in sound_engine into the mixers sample format
+and packs them into one file (sounds.bank by default). The file starts with
+MAGIC, a 4 byte little endian header length and a JSON header:
+	{"format": [frequency, size, channels], "sounds": {name: [offset, length, volume]}}
+followed by the raw samples. SoundEngine memory maps the bank at startup if
+it exists and its format matches the mixer, so loading a sound is a copy
+out of the map instead of decoding a wav file.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Optional, Tuple
+
+MAGIC = b"BWSOUNDBANK1"
+SOUND_BANK_PATH = "sounds.bank"
+
+
+class SoundBank:
+	def __init__(self, path: str) -> None:
+		with open(path, "rb") as file:
+			self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		if self.data[:len(MAGIC)] != MAGIC:
+			raise ValueError(f"{path} is not a sound bank")
+		start = len(MAGIC) + 4
+		(header_length,) = struct.unpack("<I", self.data[len(MAGIC):start])
+		header = json.loads(self.data[start:start + header_length])
+		self.format: Tuple[int, int, int] = tuple(header["format"])
+		self.base = start + header_length
+		self.sounds: Dict[str, Tuple[int, int, float]] = {
+			name: tuple(entry) for name, entry in header["sounds"].items()
+			}
+
+	def __contains__(self, name: str) -> bool:
+		return name in self.sounds
+
+	def samples(self, name: str) -> memoryview:
+		#the raw samples of 'name', straight out of the map
+		offset, length, volume = self.sounds[name]
+		return memoryview(self.data)[self.base + offset:self.base + offset + length]
+
+	def volume(self, name: str) -> float:
+		return self.sounds[name][2]
+
+
+def open_bank(path: str = SOUND_BANK_PATH, mixer_format: Optional[Tuple[int, int, int]] = None) -> Optional[SoundBank]:
+	#the bank at path, or None if there is none or it was built for another mixer format
+	if not os.path.exists(path):
+		return None
+	try:
+		bank = SoundBank(path)
+	except (OSError, ValueError):
+		return None
+	if mixer_format is not None and bank.format != tuple(mixer_format):
+		return None
+	return bank
+
+
+def build(path: str = SOUND_BANK_PATH) -> int:
+	"""
+	Decodes every registered sound and writes them into a bank at 'path'.
+	Returns how many bytes of samples were written.
+	"""
+	from pygame import mixer
+	import sound_engine
+
+	sound_engine.init_mixer()
+	header = {"format": list(mixer.get_init()), "sounds": {}}
+	chunks = []
+	offset = 0
+	for name, (location, volume) in sound_engine.soundFiles.items():
+		samples = mixer.Sound(location).get_raw()
+		header["sounds"][name] = [offset, len(samples), volume]
+		chunks.append(samples)
+		offset += len(samples)
+
+	encoded = json.dumps(header, separators=(",", ":")).encode()
+	with open(path, "wb") as file:
+		file.write(MAGIC)
+		file.write(struct.pack("<I", len(encoded)))
+		file.write(encoded)
+		for samples in chunks:
+			file.write(samples)
+	return offset
+
+
+def main() -> None:
+	#run from the repo so the sound paths resolve
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+	path = sys.argv[1] if len(sys.argv) > 1 else SOUND_BANK_PATH
+	size = build(path)
+	print(f"packed {size / 2**20:.1f}MiB of samples into {path}")
+
+
+if __name__ == "__main__":
+	main()
@@ -1,36 +1,193 @@
 #import simpleaudio as sa
 #import wave
 #import pydub
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import math
+from typing import Dict, List, Optional
+
 from pygame import mixer as mixer
 
+import sound_bank
 
-mixer.init(
-	frequency=44100,
-	size=-16, channels=2,
-	buffer=512,
-	allowedchanges=0)
+#mixer settings, a sound bank only works for the format it was built with
+FREQUENCY = 44100
+SAMPLE_SIZE = -16
+CHANNELS = 2
+#length of the click played while a sound is still being decoded
+PLACEHOLDER_SECONDS = 0.02
 
-mixer.set_num_channels(16)
+#mixer channels, each plays one voice at a time
+VOICES = 16
+#at most this many different sounds start per turn, the lowest priority ones are dropped
+MAX_VOICES_PER_TURN = 8
+#the same sound requested n times in a turn plays once, louder the larger n is
+SINGLE_VOICE_GAIN = .75
+GAIN_PER_DOUBLING = .1
 
-class SoundEngine:
-	def __init__(self) -> None:
-		mixer.init()
-		self.queue = {}
 
-	def emitSound(self, soundName: str, loops: int = 0) -> None:
-		soundDict[soundName].play(loops=loops)
+def init_mixer() -> None:
+	#opens the mixer the first time, later calls do nothing
+	if mixer.get_init() is None:
+		mixer.init(
+			frequency=FREQUENCY,
+			size=SAMPLE_SIZE, channels=CHANNELS,
+			buffer=512,
+			allowedchanges=0)
+
 
-	def queueSound(self, queueId: str) -> None:
-		if queueId in self.queue:
-			self.queue[queueId] += 1
+class SoundEngine:
+	"""
+	Plays sounds by name, decoding each one the first time it is asked for.
+	Decoding happens on a background thread, a short placeholder click plays
+	for a sound that is not ready yet. Sounds come out of the sound bank if
+	one was built (see sound_bank), otherwise from their wav files.
+
+	Sounds emitted inside turn() are collected and played together when it ends,
+	duplicates merged into one louder voice and the highest priorities first.
+	When every channel is busy a voice takes the channel of a lower priority one.
+	"""
+	def __init__(self, bank_path: str = sound_bank.SOUND_BANK_PATH) -> None:
+		#the mixer is only opened once a real sound engine is made, so importing this is free
+		init_mixer()
+		mixer.set_num_channels(VOICES)
+		self.channels = [mixer.Channel(index) for index in range(VOICES)]
+		self.channel_priority: List[int] = [0] * VOICES
+
+		self.bank = sound_bank.open_bank(bank_path, mixer.get_init())
+		self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sound_loader")
+		self.loading: Dict[str, Future] = {}
+		self.placeholder: Optional[mixer.Sound] = None
+		self.init_voices()
+
+	def init_voices(self) -> None:
+		#sound name -> how many times it was asked for this turn, None outside of a turn
+		self.pending: Optional[Counter] = None
+		self.turn_depth = 0
+		self.stats = Counter(requested=0, played=0, coalesced=0, dropped=0, stolen=0)
+
+	def load(self, soundName: str) -> mixer.Sound:
+		#decodes one sound, runs on the loader thread
+		if self.bank is not None and soundName in self.bank:
+			sound = mixer.Sound(buffer=self.bank.samples(soundName))
+			sound.set_volume(self.bank.volume(soundName))
 		else:
-			self.queue[queueId] = 0
+			location, volume = soundFiles[soundName]
+			sound = mixer.Sound(location)
+			sound.set_volume(volume)
+		return sound
+
+	def get_sound(self, soundName: str) -> Optional[mixer.Sound]:
+		#the decoded sound, or None after starting to decode it in the background
+		sound = soundDict.get(soundName)
+		if sound is not None:
+			return sound
+
+		future = self.loading.get(soundName)
+		if future is None:
+			if soundName not in soundFiles:
+				raise KeyError(soundName)
+			future = self.loading[soundName] = self.loader.submit(self.load, soundName)
+		if not future.done():
+			return None
+
+		del self.loading[soundName]
+		sound = soundDict[soundName] = future.result()
+		return sound
+
+	def get_placeholder(self) -> mixer.Sound:
+		#a quiet click made from scratch, only used until real sounds are decoded
+		if self.placeholder is None:
+			frequency, size, channels = mixer.get_init()
+			frames = int(frequency * PLACEHOLDER_SECONDS)
+			click = b"".join(
+				(800 if (frame // 20) % 2 else -800).to_bytes(abs(size) // 8, "little", signed=True) * channels
+				for frame in range(frames)
+				)
+			self.placeholder = mixer.Sound(buffer=click)
+			self.placeholder.set_volume(.2)
+		return self.placeholder
+
+	def emitSound(self, soundName: str, loops: int = 0) -> None:
+		#'loops' extra requests are counted as duplicates of this one
+		self.stats["requested"] += loops + 1
+		if self.pending is not None:
+			self.pending[soundName] += loops + 1
+		elif not self.play(soundName, loops + 1):
+			self.stats["dropped"] += 1
+
+	@contextmanager
+	def turn(self):
+		#collects the sounds of a turn and plays them all at the end, can be nested
+		if self.turn_depth == 0:
+			self.pending = Counter()
+		self.turn_depth += 1
+		try:
+			yield self
+		finally:
+			self.turn_depth -= 1
+			if self.turn_depth == 0:
+				pending, self.pending = self.pending, None
+				self.flush(pending)
+
+	def flush(self, pending: Counter) -> None:
+		#highest priority first, ties in the order they were first asked for
+		voices = sorted(pending.items(), key=lambda voice: -soundPriorities[voice[0]])
+		for index, (soundName, count) in enumerate(voices):
+			self.stats["coalesced"] += count - 1
+			if index >= MAX_VOICES_PER_TURN or not self.play(soundName, count):
+				self.stats["dropped"] += 1
+
+	@staticmethod
+	def gain(count: int) -> float:
+		return min(1.0, SINGLE_VOICE_GAIN + GAIN_PER_DOUBLING * math.log2(count))
+
+	def play(self, soundName: str, count: int) -> bool:
+		#starts one voice for 'count' requests of soundName, False if no channel could be had
+		priority = soundPriorities[soundName]
+		sound = self.get_sound(soundName)
+		if sound is None:
+			sound = self.get_placeholder()
+
+		channel = self.find_voice(priority)
+		if channel is None:
+			return False
+		channel.set_volume(self.gain(count))
+		channel.play(sound)
+		self.channel_priority[self.channels.index(channel)] = priority
+		self.stats["played"] += 1
+		return True
+
+	def find_voice(self, priority: int) -> Optional[mixer.Channel]:
+		#a free channel, or the lowest priority busy one below 'priority', stopped
+		lowest = None
+		for index, channel in enumerate(self.channels):
+			if not channel.get_busy():
+				return channel
+			if self.channel_priority[index] < priority and (
+				lowest is None or self.channel_priority[index] < self.channel_priority[lowest]):
+				lowest = index
+		if lowest is None:
+			return None
+		self.channels[lowest].stop()
+		self.stats["stolen"] += 1
+		return self.channels[lowest]
+
+
+class NullSoundEngine(SoundEngine):
+	"""
+	Stands in for SoundEngine in headless mode, it never touches the mixer
+	and just counts the voices that would have been played.
+	"""
+	def __init__(self) -> None:
+		self.played = Counter()
+		self.init_voices()
 
-	def pushQueue(self, queueId: str, soundName: str = None):
-		if soundName == None: soundName = queueId
-		if queueId in self.queue:
-			self.emitSound(soundName, self.queue[queueId])
-			self.queue.pop(queueId)
+	def play(self, soundName: str, count: int) -> bool:
+		self.played[soundName] += 1
+		self.stats["played"] += 1
+		return True
 		
 
 
@@ -38,38 +195,43 @@ class SoundEngine:
 
 
 
+#name -> (file, volume), decoded into soundDict the first time each is played
+soundFiles = {}
 soundDict = {}
+#name -> priority, higher priorities get channels first
+soundPriorities = {}
 
 
-def waveLoader(location: str, name: str, volume=1):
-	soundDict[name] = mixer.Sound(location)
-	soundDict[name].set_volume(volume)
+def waveLoader(location: str, name: str, volume=1, priority: int = 1):
+	soundFiles[name] = (location, volume)
+	soundPriorities[name] = priority
 	return name
 
 
+#priorities: 5 player and ui feedback, 4 weapons and explosions, 3 deaths and items, 2 enemies, 1 chatter
 #easy sounds for items
-zip_gun = waveLoader('sounds/Weapons/Single_Shot_Sounds/sfx_weapon_singleshot7.wav', "zip_gun")
-zip_cannon = waveLoader('sounds/Weapons/Cannon/sfx_wpn_cannon2.wav', "zip_cannon")
-hand_gun = waveLoader('sounds/Weapons/Single_Shot_Sounds/sfx_weapon_singleshot3.wav', "hand_gun")
-stim_stick = waveLoader("sounds/General_Sounds/Weird_Sounds/sfx_sound_noise.wav", "stim_stick")
-homing_grenade = waveLoader("sounds/Explosions/Short/sfx_exp_short_hard3.wav", "homing_grenade")
-hand_grenade = waveLoader("sounds/Explosions/Short/sfx_exp_short_hard13.wav", "hand_grenade")
-nitroglyn_grenade = waveLoader("sounds/Explosions/Medium_Length/sfx_exp_medium8.wav", "nitroglyn_grenad")
-item_pickup = waveLoader("sounds/General_Sounds/Coins/sfx_coin_cluster3.wav", "item_pickup")
+zip_gun = waveLoader('sounds/Weapons/Single_Shot_Sounds/sfx_weapon_singleshot7.wav', "zip_gun", priority=4)
+zip_cannon = waveLoader('sounds/Weapons/Cannon/sfx_wpn_cannon2.wav', "zip_cannon", priority=4)
+hand_gun = waveLoader('sounds/Weapons/Single_Shot_Sounds/sfx_weapon_singleshot3.wav', "hand_gun", priority=4)
+stim_stick = waveLoader("sounds/General_Sounds/Weird_Sounds/sfx_sound_noise.wav", "stim_stick", priority=4)
+homing_grenade = waveLoader("sounds/Explosions/Short/sfx_exp_short_hard3.wav", "homing_grenade", priority=4)
+hand_grenade = waveLoader("sounds/Explosions/Short/sfx_exp_short_hard13.wav", "hand_grenade", priority=4)
+nitroglyn_grenade = waveLoader("sounds/Explosions/Medium_Length/sfx_exp_medium8.wav", "nitroglyn_grenad", priority=4)
+item_pickup = waveLoader("sounds/General_Sounds/Coins/sfx_coin_cluster3.wav", "item_pickup", priority=3)
 
 #easy sounds for actors
-playerHurt = waveLoader("sounds/General_Sounds/Negative_Sounds/sfx_sounds_damage1.wav", "playerHurt", volume = .6)
-playerDead = [waveLoader("sounds/General_Sounds/Weird_Sounds/sfx_sound_shutdown1.wav", "playerDead")]
-infectedHurt = waveLoader("sounds/General_Sounds/Impacts/sfx_sounds_impact3.wav", "infectedHurt")
+playerHurt = waveLoader("sounds/General_Sounds/Negative_Sounds/sfx_sounds_damage1.wav", "playerHurt", volume = .6, priority=5)
+playerDead = [waveLoader("sounds/General_Sounds/Weird_Sounds/sfx_sound_shutdown1.wav", "playerDead", priority=5)]
+infectedHurt = waveLoader("sounds/General_Sounds/Impacts/sfx_sounds_impact3.wav", "infectedHurt", priority=2)
 infectedDead = [] #8 sounds long
 for i in range(6, 14):
-	waveLoader(f"sounds/Death_Screams/Human/sfx_deathscream_human{i}.wav", f"infectedDead{i}")
+	waveLoader(f"sounds/Death_Screams/Human/sfx_deathscream_human{i}.wav", f"infectedDead{i}", priority=3)
 	infectedDead.append(f"infectedDead{i}")
 
 #other sounds
-new_message = waveLoader("sounds/General_Sounds/Coins/sfx_coin_single5.wav", "new_message")
-hostile_seen = waveLoader("sounds/General_Sounds/Neutral_Sounds/sfx_sound_neutral11.wav", "hostile_seen", volume=.4)
-error_sound = waveLoader("sounds/General_Sounds/Simple_Bleeps/sfx_sounds_Blip9.wav", "error_sound", volume = .4)
+new_message = waveLoader("sounds/General_Sounds/Coins/sfx_coin_single5.wav", "new_message", priority=1)
+hostile_seen = waveLoader("sounds/General_Sounds/Neutral_Sounds/sfx_sound_neutral11.wav", "hostile_seen", volume=.4, priority=2)
+error_sound = waveLoader("sounds/General_Sounds/Simple_Bleeps/sfx_sounds_Blip9.wav", "error_sound", volume = .4, priority=5)
 
-reloaded_sound = waveLoader("sounds/General_Sounds/Positive Sounds/sfx_sounds_powerup4.wav", "reloaded_sound")
-gun_empty = waveLoader("sounds/Weapons/Out of Ammo/sfx_wpn_reload.wav", "gun_empty")
+reloaded_sound = waveLoader("sounds/General_Sounds/Positive Sounds/sfx_sounds_powerup4.wav", "reloaded_sound", priority=3)
+gun_empty = waveLoader("sounds/Weapons/Out of Ammo/sfx_wpn_reload.wav", "gun_empty", priority=4)
@@ -58,4 +58,18 @@ wall = new_tile(
 	transparent=False,
 	dark=(ord("#"), (96, 96, 96), (32, 32, 32)),
 	light=(ord("#"), (0, 255, 255), (0, 196, 196)),
-)
\ No newline at end of file
+)
+
+down_stairs = new_tile(
+	walkable = True,
+	transparent=True,
+	dark=(ord(">"), (0, 0, 100), (50, 50, 150)),
+	light=(ord(">"), (255, 255, 255), (200, 180, 50)),
+)
+
+up_stairs = new_tile(
+	walkable = True,
+	transparent=True,
+	dark=(ord("<"), (0, 0, 100), (50, 50, 150)),
+	light=(ord("<"), (255, 255, 255), (200, 180, 50)),
+)